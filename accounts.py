@@ -0,0 +1,185 @@
+from contextlib import contextmanager
+from flask import Blueprint, current_app, render_template, url_for, redirect, flash, make_response
+from flask_login import login_user, current_user, logout_user
+from flask_mail import Message
+from forms import RegisterForm, LoginRegisterForm, LoginForm, ForgotPasswordForm, ResetPasswordForm
+from passwords import PasswordHasherBusy
+from user_cache import CachedUser
+from extensions import db, mail, metrics, login_manager, password_hasher, user_cache, mail_dispatcher
+from models import User, OutboxMail
+
+# the user accounts: login, registration, logout and the password reset mails
+
+accounts = Blueprint("accounts", __name__)
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    user_id = int(user_id)
+    user = user_cache.get(user_id)
+    if user is None:
+        # read the version first, a change committed while loading is not cached under the new version
+        version = user_cache.version(user_id)
+        found = User.query.get(user_id)
+        if found is None:
+            return None
+        user = CachedUser(found.id, found.email, found.nickname)
+        user_cache.set(user_id, user, version)
+    return user
+
+
+# an smtp connection of the dispatcher, the time spent sending is recorded
+@contextmanager
+def mail_connection():
+    with mail.connect() as connection:
+        connection.send = metrics.timed("smtp_send", connection.send)
+        yield connection
+
+
+# the mail of an outbox row
+def outbox_message(row):
+    return Message(row["subject"], recipients=[row["recipient"]], sender=current_app.config["MAIL_USERNAME"],
+                   body=row["body"])
+
+
+# forgot password function, queue the password reset link for the user, the dispatcher sends it
+def send_mail(user):
+    token = user.get_token()
+    body = f''' To reset your password, please follow the link below.
+    {url_for('accounts.reset_token', token=token, _external=True)}
+    If you don't send a password reset request, please ignore this message.
+'''
+    db.session.add(OutboxMail(recipient=user.email, subject="Password reset request", body=body))
+    db.session.commit()
+    if current_app.config["MAIL_QUEUE_IN_PROCESS"]:
+        mail_dispatcher.start()
+    mail_dispatcher.wake()
+
+
+# hash and check passwords on the hashing pool, timed as sections of /metrics
+def hash_password(password):
+    with metrics.section("password_hash"):
+        return password_hasher.hash(password)
+
+
+def verify_password(stored, password):
+    with metrics.section("password_verify"):
+        return password_hasher.verify(stored, password)
+
+
+# every password hashing worker is busy, ask the client to come back instead of queueing more requests
+@accounts.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    response = make_response("Too many logins right now, please try again in a few seconds.", 503)
+    response.headers["Retry-After"] = "5"
+    return response
+
+
+# login or register route
+@accounts.route('/login-register', methods=["POST", "GET"])
+def login_register():
+    form = LoginRegisterForm()
+    if form.validate_on_submit():
+        email = form.email.data
+        # check if user is registered, and redirect the corresponding page
+        if User.query.filter_by(email=email).first():
+            return redirect(url_for("accounts.login", id=email))
+        else:
+            return redirect(url_for("accounts.register", id=email))
+    return render_template("login-register.html", form=form, current_user=current_user, year=current_user)
+
+
+# login route
+@accounts.route('/login/<string:id>', methods=["POST", "GET"])
+def login(id):
+    form = LoginForm()
+    form.email.data = id
+    if form.validate_on_submit():
+        email = form.email.data
+        password = form.password.data
+        # check if email exists
+        user = User.query.filter_by(email=email).first()
+        if user:
+            # check the password on the hashing workers
+            if verify_password(user.password, password) and user.email == email:
+                # upgrade hashes made with an older method or weaker parameters
+                if password_hasher.needs_rehash(user.password):
+                    user.password = hash_password(password)
+                    db.session.commit()
+                login_user(user)
+                return redirect(url_for("pages.home"))
+            else:
+                flash('Password incorrect, please try again.')
+                return redirect(url_for('accounts.login', id=email))
+        else:
+            flash("That email does not exist, please try again.")
+            return redirect(url_for('accounts.login'))
+    return render_template("login.html", form=form, current_user=current_user, year=current_user)
+
+
+# register route
+@accounts.route("/register/<string:id>", methods=["POST", "GET"])
+def register(id):
+    form = RegisterForm()
+    form.email.data = id
+    if form.validate_on_submit():
+        nickname = form.nickname.data
+        if User.query.filter_by(nickname=nickname).first():
+            flash("Nickname already exist")
+        else:
+            # check if 2 passwords matches and hashing the password
+            if form.password.data == form.password_check.data:
+                hash_and_salted_password = hash_password(form.password.data)
+                # create new user
+                new_user = User(
+                    email=form.email.data,
+                    password=hash_and_salted_password,
+                    nickname=form.nickname.data
+
+                )
+                db.session.add(new_user)
+                db.session.commit()
+                user_cache.bump(new_user.id)
+                login_user(new_user)
+                return redirect(url_for("pages.home"))
+            else:
+                flash("The passwords do not match")
+    return render_template("register.html", form=form, current_user=current_user, year=current_user)
+
+
+# logut route
+@accounts.route('/logout')
+def logout():
+    logout_user()
+    return redirect(url_for('pages.home'))
+
+
+# forgot password route
+@accounts.route("/forgot", methods=["POST", "GET"])
+def forgot():
+    form = ForgotPasswordForm()
+    if form.validate_on_submit():
+        user = User.query.filter_by(email=form.email.data).first()
+        if user:
+            send_mail(user)
+            return redirect(url_for("pages.home"))
+    return render_template("forgot.html", form=form, year=current_user)
+
+
+# forgot password reset token, for validation
+@accounts.route("/forgot/<token>", methods=["POST", "GET"])
+def reset_token(token):
+    user = User.verify_token(token)
+    if user is None:
+        flash("That is invalid token or expired.")
+        return redirect(url_for("accounts.forgot"))
+    form = ResetPasswordForm()
+    if form.validate_on_submit():
+        if form.password.data == form.password_check.data:
+            hash_and_salted_password = hash_password(form.password.data)
+            user.password = hash_and_salted_password
+            db.session.commit()
+            user_cache.bump(user.id)
+            flash("Password changed successfully, please login")
+            return redirect(url_for("accounts.login", id=user.email))
+    return render_template("reset_password.html", form=form, current_user=current_user, year=current_user)
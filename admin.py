@@ -0,0 +1,248 @@
+from functools import wraps
+from flask import Blueprint, current_app, render_template, url_for, request, redirect, abort, flash, jsonify, \
+    Response, stream_with_context
+from flask_login import current_user
+from sqlalchemy.exc import IntegrityError
+from catalogue_io import FORMATS, export_rows, write_rows
+from cafe_ingest import cafe_from_form, approve_suggestions
+from admin_tables import table_state, table_page, table_rows
+from extensions import db, user_cache
+from models import Cafe, Suggest, User, Comment, user_table, suggestion_table
+from catalogue import rate_cafe, touch_catalogue, cafe_snapshot, cafe_changed, cafes_changed, delete_cafes, \
+    fetch_thumbnails_later, export_columns, export_table
+
+# the admin pages: adding, editing and deleting cafes, the suggestions and the users, only for the admin (user 1)
+
+admin = Blueprint("admin", __name__)
+
+
+# set the admin only route
+def admin_only(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if current_user.id != 1:
+            return abort(403)
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+# set the add new cafe route, only for admin
+@admin.route("/add", methods=["POST", "GET"])
+@admin_only
+def add():
+    # add new cafe, get all data from the form
+    if request.method == "POST":
+        try:
+            new_coffee = Cafe(**cafe_from_form(request.form, rate_cafe))
+        except ValueError as error:
+            flash(f"Please check the form, {error}")
+            return render_template("add.html", current_user=current_user, year=current_user)
+        db.session.add(new_coffee)
+        try:
+            touch_catalogue()
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('This cafe already exist')
+            return render_template("add.html", current_user=current_user, year=current_user)
+        cafe_changed(after=cafe_snapshot(new_coffee))
+        # the image is fetched after the response, the page shows the remote image until then
+        fetch_thumbnails_later({new_coffee.id: new_coffee.img_url})
+        return redirect(url_for("pages.home"))
+    return render_template("add.html", current_user=current_user, year=current_user)
+
+
+# stream the cafes or the suggestions as csv or ndjson, only for admin
+@admin.route("/export/<string:name>.<string:file_format>")
+@admin_only
+def export(name, file_format):
+    table = export_table(name)
+    if table is None or file_format not in FORMATS:
+        return abort(404)
+    columns = export_columns(table)
+    mimetype = "text/csv" if file_format == "csv" else "application/x-ndjson"
+    response = Response(stream_with_context(write_rows(export_rows(db.engine, table, columns), columns, file_format)),
+                        mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={name}.{file_format}"
+    return response
+
+
+# one page of an admin table for the request arguments, and the url of the next page on the endpoint
+def admin_table_page(table, endpoint):
+    state = table_state(table, request.args)
+    page = table_page(db.session, table, state, cursor=request.args.get("cursor"),
+                      per_page=current_app.config['ADMIN_ROWS_PER_PAGE'])
+    next_url = url_for(endpoint, sort=state.sort, order="desc" if state.descending else "asc",
+                       q=state.search or None, cursor=page.next_cursor) if page.next_cursor else None
+    return state, page.items, next_url
+
+
+# view suggested cafes, only for admin
+@admin.route("/suggested")
+@admin_only
+def suggested():
+    # show one page of the suggested cafes
+    state, all_cafe, next_url = admin_table_page(suggestion_table, "admin.suggested")
+    return render_template('cafe_database.html', all_cafe=all_cafe, state=state, next_url=next_url,
+                           year=current_user)
+
+
+# the suggested cafes table as json
+@admin.route("/suggested.json")
+@admin_only
+def suggested_json():
+    state, rows, next_url = admin_table_page(suggestion_table, "admin.suggested_json")
+    return jsonify(rows=table_rows(suggestion_table, rows), next=next_url)
+
+
+# accept suggested cafes, only for admin
+@admin.route("/edit/<string:id>", methods=["POST", "GET"])
+@admin_only
+def edit_suggested(id):
+    # publish the suggestion with the corrections of the admin, the suggestion is removed in the same commit
+    if request.method == "POST":
+        try:
+            new_coffee = Cafe(**cafe_from_form(request.form, rate_cafe))
+        except ValueError as error:
+            flash(f"Please check the form, {error}")
+        else:
+            db.session.add(new_coffee)
+            try:
+                Suggest.query.filter_by(id=id).delete()
+                touch_catalogue()
+                db.session.commit()
+            except IntegrityError:
+                # check if suggested cafe already exist
+                db.session.rollback()
+                flash('This cafe already exist')
+            else:
+                cafe_changed(after=cafe_snapshot(new_coffee))
+                fetch_thumbnails_later({new_coffee.id: new_coffee.img_url})
+                return redirect(url_for("admin.suggested"))
+    this_cafe = Suggest.query.get(id)
+    return render_template("edit_suggested.html", this_cafe=this_cafe, current_user=current_user, year=current_user)
+
+
+# delete suggested cafe, only for admin
+@admin.route("/delete_suggested/<string:id>")
+@admin_only
+def delete_suggested(id):
+    # get the cafe by id, and delete
+    this_cafe = Suggest.query.get(id)
+    db.session.delete(this_cafe)
+    db.session.commit()
+    return redirect(url_for("admin.suggested"))
+
+
+# publish the selected suggested cafes at once, only for admin
+@admin.route("/approve_suggested", methods=["POST"])
+@admin_only
+def approve_suggested():
+    ids = id_arguments(request.form.getlist("ids"))
+    cafes, left = approve_suggestions(db.session.connection(), Cafe.__table__, Suggest.__table__, ids,
+                                      current_app.config['RATING_MODEL'])
+    if cafes:
+        touch_catalogue()
+    db.session.commit()
+    if cafes:
+        cafes_changed(afters=cafes)
+        # the images are fetched after the response, one request does not wait for all of them
+        fetch_thumbnails_later({cafe["id"]: cafe["img_url"] for cafe in cafes})
+    flash(f"{len(cafes)} cafes published")
+    if left:
+        flash(f"{left} suggestions were not published, a cafe with the same name already exist")
+    return redirect(url_for("admin.suggested"))
+
+
+# view users, only for admin
+@admin.route("/user_database")
+@admin_only
+def user_database():
+    # show one page of the users
+    state, all_users, next_url = admin_table_page(user_table, "admin.user_database")
+    return render_template('user_database.html', all_users=all_users, state=state, next_url=next_url,
+                           year=current_user)
+
+
+# the users table as json
+@admin.route("/user_database.json")
+@admin_only
+def user_database_json():
+    state, rows, next_url = admin_table_page(user_table, "admin.user_database_json")
+    return jsonify(rows=table_rows(user_table, rows), next=next_url)
+
+
+# the ids of the form's checkboxes or of the route
+def id_arguments(values):
+    return [int(value) for value in values if str(value).isdigit()]
+
+
+# delete users and their comments with one statement per table in a single transaction, 1 is the admin and stays
+# returns the number of deleted users
+def delete_users(ids):
+    ids = [id for id in ids if id != 1]
+    if not ids:
+        return 0
+    Comment.query.filter(Comment.author_id.in_(ids)).delete(synchronize_session=False)
+    deleted = User.query.filter(User.id.in_(ids)).delete(synchronize_session=False)
+    db.session.commit()
+    for id in ids:
+        user_cache.bump(id)
+    return deleted
+
+
+# delete users, only for admin
+@admin.route("/delete_user/<string:id>")
+@admin_only
+def delete_user(id):
+    # find the user by id, and delete, if the id is not 1, because 1 is admin
+    delete_users(id_arguments([id]))
+    return redirect(url_for("admin.user_database"))
+
+
+# delete the selected (spam) accounts and everything they wrote at once, only for admin
+@admin.route("/purge_users", methods=["POST"])
+@admin_only
+def purge_users():
+    deleted = delete_users(id_arguments(request.form.getlist("ids")))
+    flash(f"{deleted} users deleted")
+    return redirect(url_for("admin.user_database"))
+
+
+# delete cafe, only for admin
+@admin.route("/delete/<string:id>")
+@admin_only
+def delete(id):
+    # find the cafe by id, and delete it with its comments
+    delete_cafes(id_arguments([id]))
+    return redirect(url_for("pages.home"))
+
+
+# edit cafe, only for admin
+@admin.route("/edit/<string:id>", methods=["POST", "GET"])
+@admin_only
+def edit(id):
+    # find the cafe by id, and edit
+    if request.method == "POST":
+        cafe_to_update = Cafe.query.filter_by(id=id).first()
+        try:
+            cafe = cafe_from_form(request.form, rate_cafe)
+        except ValueError as error:
+            flash(f"Please check the form, {error}")
+            return render_template("edit.html", this_cafe=cafe_to_update, current_user=current_user,
+                                   year=current_user)
+        before = cafe_snapshot(cafe_to_update)
+        if cafe["img_url"] != before["img_url"]:
+            # the thumbnails of the old image are not shown for the new one
+            cafe["image_digest"] = None
+        for key, value in cafe.items():
+            setattr(cafe_to_update, key, value)
+        touch_catalogue()
+        db.session.commit()
+        cafe_changed(before=before, after=cafe_snapshot(cafe_to_update))
+        if cafe["img_url"] != before["img_url"] or before["image_digest"] is None:
+            fetch_thumbnails_later({cafe_to_update.id: cafe["img_url"]})
+        return redirect(url_for("pages.info", id=cafe_to_update.id))
+    this_cafe = Cafe.query.get(id)
+    return render_template("edit.html", this_cafe=this_cafe, current_user=current_user, year=current_user)
@@ -0,0 +1,43 @@
+from collections import namedtuple
+from sqlalchemy import and_, or_
+from pagination import keyset_page
+
+# server side paginated admin tables, only the shown columns are selected and every page is a keyset query
+# over an index, so a page costs the same on the first and the ten thousandth sign-up
+
+# columns are the shown columns (the first one is the unique id), sortable and searchable are column names
+# searching is by prefix, a range on the column that its index can serve, case sensitive like the index
+AdminTable = namedtuple("AdminTable", ["columns", "sortable", "searchable"])
+
+# sort column, order and search text of the current request
+TableState = namedtuple("TableState", ["sort", "descending", "search"])
+
+
+def table_state(table, arguments):
+    sort = arguments.get("sort")
+    if sort not in table.sortable:
+        sort = table.columns[0].key
+    return TableState(sort, arguments.get("order") == "desc", (arguments.get("q") or "").strip())
+
+
+# rows whose searchable columns start with the text
+def prefix_condition(columns, text):
+    return or_(*[and_(column >= text, column < text + "\uffff") for column in columns])
+
+
+# one page of rows of the table in the requested order, rows are named tuples of the shown columns
+def table_page(session, table, state, cursor=None, per_page=50):
+    columns = {column.key: column for column in table.columns}
+    id_column = table.columns[0]
+    query = session.query(*table.columns)
+    if state.search:
+        query = query.filter(prefix_condition([columns[name] for name in table.searchable], state.search))
+    order = [(id_column, state.descending)]
+    if state.sort != id_column.key:
+        order.insert(0, (columns[state.sort], state.descending))
+    return keyset_page(query, order, cursor=cursor, per_page=per_page)
+
+
+# the rows as json objects
+def table_rows(table, rows):
+    return [{column.key: getattr(row, column.key) for column in table.columns} for row in rows]
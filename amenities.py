@@ -0,0 +1,218 @@
+import threading
+from bisect import bisect_left, bisect_right
+
+# amenity bitmap index for multi-facet filtering
+# every bitmap is a python int with bit n set for the cafe with id n, so filters are & and | over whole bitmaps and
+# counts are popcounts, the database is only read when the index is (re)built
+# a build collects the ids of every value first and makes each bitmap once, setting the bits one by one would copy
+# the whole bitmap for every cafe
+
+AMENITIES = ("has_wifi", "has_sockets", "can_take_calls", "can_pay_with_card", "has_toilet")
+COLUMNS = ("id", "country", "city", "seats", "coffee_price", "rating") + AMENITIES
+BIT_COUNT = hasattr(int, "bit_count")
+
+
+# int.bit_count() is new in python 3.10
+def popcount(bits):
+    return bits.bit_count() if BIT_COUNT else bin(bits).count("1")
+
+
+# the bitmap of the ids, made in one pass over a byte array
+def bitmap(ids):
+    if not ids:
+        return 0
+    data = bytearray((max(ids) >> 3) + 1)
+    for cafe_id in ids:
+        data[cafe_id >> 3] |= 1 << (cafe_id & 7)
+    return int.from_bytes(data, "little")
+
+
+# ids of the set bits, highest first, at most limit of them
+def highest_ids(bits, limit):
+    ids = []
+    while bits and len(ids) < limit:
+        position = bits.bit_length() - 1
+        ids.append(position)
+        bits ^= 1 << position
+    return ids
+
+
+class AmenityIndex:
+    def __init__(self, loader):
+        # loader returns rows (mappings) with the COLUMNS of every cafe, it only runs when the index is (re)built
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._version = None
+        self._loaded = False
+
+    def _reset(self):
+        self._all = 0
+        self._amenities = {name: 0 for name in AMENITIES}
+        # value -> bitmap, one bitmap per distinct value, ranges are unions of them
+        self._cities = {}
+        self._countries = {}
+        self._seats = {}
+        self._prices = {}
+        self._ratings = {}
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._reset()
+        every = []
+        amenities = {name: [] for name in AMENITIES}
+        groups = [(self._cities, "city", {}), (self._countries, "country", {}), (self._seats, "seats", {}),
+                  (self._prices, "coffee_price", {}), (self._ratings, "rating", {})]
+        for row in self._loader():
+            cafe_id = row["id"]
+            every.append(cafe_id)
+            for name in AMENITIES:
+                if row[name]:
+                    amenities[name].append(cafe_id)
+            for _, column, ids in groups:
+                ids.setdefault(row[column], []).append(cafe_id)
+        self._all = bitmap(every)
+        self._amenities = {name: bitmap(ids) for name, ids in amenities.items()}
+        for bitmaps, _, values in groups:
+            for value, ids in values.items():
+                bitmaps[value] = bitmap(ids)
+        self._loaded = True
+
+    def _set(self, row, present):
+        bit = 1 << row["id"]
+        groups = [(self._cities, row["city"]), (self._countries, row["country"]), (self._seats, row["seats"]),
+                  (self._prices, row["coffee_price"]), (self._ratings, row["rating"])]
+        if present:
+            self._all |= bit
+            for name in AMENITIES:
+                if row[name]:
+                    self._amenities[name] |= bit
+            for bitmaps, value in groups:
+                bitmaps[value] = bitmaps.get(value, 0) | bit
+        else:
+            self._all &= ~bit
+            for name in AMENITIES:
+                self._amenities[name] &= ~bit
+            for bitmaps, value in groups:
+                remaining = bitmaps.get(value, 0) & ~bit
+                if remaining:
+                    bitmaps[value] = remaining
+                else:
+                    bitmaps.pop(value, None)
+
+    # union of the bitmaps whose value is within [low, high], or [low, high) when high is exclusive, either bound may
+    # be None
+    @staticmethod
+    def _range(bitmaps, low, high, high_inclusive=True):
+        values = sorted(bitmaps)
+        start = 0 if low is None else bisect_left(values, low)
+        if high is None:
+            end = len(values)
+        else:
+            end = bisect_right(values, high) if high_inclusive else bisect_left(values, high)
+        bits = 0
+        for value in values[start:end]:
+            bits |= bitmaps[value]
+        return bits
+
+    def _match(self, amenities=(), country=None, city=None, min_seats=None, max_seats=None, min_price=None,
+               max_price=None):
+        bits = self._all
+        for name in amenities:
+            bits &= self._amenities[name]
+        if country is not None:
+            bits &= self._countries.get(country, 0)
+        if city is not None:
+            bits &= self._cities.get(city, 0)
+        if min_seats is not None or max_seats is not None:
+            bits &= self._range(self._seats, min_seats, max_seats)
+        if min_price is not None or max_price is not None:
+            # "under 3" leaves out the cafes asking 3.00
+            bits &= self._range(self._prices, min_price, max_price, high_inclusive=False)
+        return bits
+
+    # bitmap of the cafes matching every given facet
+    def match(self, **facets):
+        with self._lock:
+            self._ensure_loaded()
+            return self._match(**facets)
+
+    # number of matching cafes per amenity and per city for the given facets, to show next to every facet
+    # the cities are counted without the city facet, so the other cities can still be picked
+    def counts(self, city=None, **facets):
+        with self._lock:
+            self._ensure_loaded()
+            others = self._match(**facets)
+            bits = others & self._cities.get(city, 0) if city is not None else others
+            amenities = {name: popcount(bits & self._amenities[name]) for name in AMENITIES}
+            cities = {}
+            for name, city_bits in self._cities.items():
+                count = popcount(others & city_bits)
+                if count:
+                    cities[name] = count
+            return {"total": popcount(bits), "amenities": amenities, "cities": cities}
+
+    # a (rating, id) cursor of plain non negative ints within the ratings and ids of the index, None otherwise
+    def _valid_cursor(self, after):
+        if after is None or len(after) != 2:
+            return None
+        if not all(isinstance(value, int) and not isinstance(value, bool) and value >= 0 for value in after):
+            return None
+        rating, cafe_id = after
+        if not self._ratings or rating > max(self._ratings) or cafe_id > self._all.bit_length():
+            return None
+        return after
+
+    # one page of the matching cafe ids in listing order (rating, id) descending, after the (rating, id) cursor
+    # a cursor that does not fit the index starts from the first page
+    def page(self, bits, after=None, limit=24):
+        with self._lock:
+            self._ensure_loaded()
+            after = self._valid_cursor(after)
+            ids = []
+            for rating in sorted(self._ratings, reverse=True):
+                if after is not None and rating > after[0]:
+                    continue
+                rating_bits = bits & self._ratings[rating]
+                if after is not None and rating == after[0]:
+                    rating_bits &= (1 << after[1]) - 1
+                ids.extend((rating, cafe_id) for cafe_id in highest_ids(rating_bits, limit + 1 - len(ids)))
+                if len(ids) > limit:
+                    break
+            return ids[:limit], (ids[limit - 1] if len(ids) > limit else None)
+
+    def cities(self):
+        with self._lock:
+            self._ensure_loaded()
+            return sorted(self._cities)
+
+    # a cafe was added, row holds its COLUMNS
+    def add(self, row):
+        with self._lock:
+            if self._loaded:
+                self._set(row, True)
+
+    # a cafe was deleted, row holds its COLUMNS as they were before
+    def remove(self, row):
+        with self._lock:
+            if self._loaded:
+                self._set(row, False)
+
+    # a local commit that was already applied incrementally moved the catalogue to version
+    # the index stays when it was the only change since the last sync, otherwise it is rebuilt
+    def advance(self, version):
+        with self._lock:
+            if self._version is None or version != self._version + 1:
+                self._loaded = False
+            self._version = version
+
+    # rebuild on the next read when the catalogue version changed, e.g. by a commit in another worker
+    def sync(self, version):
+        with self._lock:
+            if version != self._version:
+                self._loaded = False
+                self._version = version
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
@@ -0,0 +1,87 @@
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# helpers of the read-only json api
+# the routes select only the requested columns, encode the rows in chunks (with orjson when it is installed) and
+# stream the page, finished bodies of list pages are kept in a small cache under the catalogue version
+
+
+class FieldError(ValueError):
+    pass
+
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# the fields of a "fields=name,city" argument in the order of allowed, all of them when there is none
+def selected_fields(argument, allowed):
+    if not argument:
+        return list(allowed)
+    requested = {field.strip() for field in argument.split(",") if field.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise FieldError(f"unknown fields: {', '.join(sorted(unknown))}")
+    return [field for field in allowed if field in requested]
+
+
+def row_object(row, fields):
+    return {field: getattr(row, field) for field in fields}
+
+
+# {"<name>": [rows], "next": next_url} in chunks of encoded rows
+def stream_page(name, rows, fields, next_url, chunk_rows=500):
+    yield b'{' + dumps(name) + b':['
+    for start in range(0, len(rows), chunk_rows):
+        encoded = dumps([row_object(row, fields) for row in rows[start:start + chunk_rows]])[1:-1]
+        yield (b"," if start else b"") + encoded
+    yield b'],"next":' + dumps(next_url) + b'}'
+
+
+# finished response bodies by key, least recently used ones are dropped, bodies over max_body_bytes are not kept
+class ResponseCache:
+    def __init__(self, maxsize=256, max_body_bytes=256 * 1024):
+        self.maxsize = maxsize
+        self.max_body_bytes = max_body_bytes
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is not None:
+                self._bodies.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_body_bytes:
+            return
+        with self._lock:
+            self._bodies[key] = body
+            self._bodies.move_to_end(key)
+            while len(self._bodies) > self.maxsize:
+                self._bodies.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
+
+    # pass the chunks through and keep the body once all of them were sent
+    def recording(self, key, chunks):
+        body = []
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            if size <= self.max_body_bytes:
+                body.append(chunk)
+            yield chunk
+        if size <= self.max_body_bytes:
+            self.set(key, b"".join(body))
@@ -0,0 +1,116 @@
+import hashlib
+from flask import Blueprint, current_app, url_for, request, jsonify, make_response, Response, stream_with_context
+from pagination import keyset_page
+from catalogue_io import CAFE_FIELDS
+from database import read_replica
+from api import FieldError, dumps, row_object, selected_fields, stream_page
+from extensions import db, api_cache
+from models import Cafe, User, Comment, Catalogue
+from catalogue import info_validator
+from pages import number_argument
+
+# ------------------------------------------------------ JSON API ------------------------------------------------- #
+# read-only, the rows are selected column by column and never loaded as models
+
+api_v1 = Blueprint("api", __name__, url_prefix="/api/v1")
+
+API_CAFE_FIELDS = ("id",) + CAFE_FIELDS + ("rating",)
+API_COMMENT_FIELDS = ("id", "text", "date", "author")
+
+
+def api_error(status, message):
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
+
+
+# the page size of the limit argument
+def api_limit():
+    limit = number_argument("limit", int) or current_app.config['API_PAGE_SIZE']
+    return max(1, min(limit, current_app.config['API_MAX_PAGE_SIZE']))
+
+
+# answer with the body of the data version, 304 when the client has it already and from the cache when this
+# version of the page was sent before, body() returns the chunks of a new one
+def api_response(version, body, cached=True):
+    etag = hashlib.sha1(f"{version}|{request.full_path}".encode("utf-8")).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        key = (version, request.full_path)
+        chunks = api_cache.get(key) if cached else None
+        if chunks is None:
+            chunks = body()
+            if cached:
+                chunks = api_cache.recording(key, chunks)
+            chunks = stream_with_context(chunks)
+        response = Response(chunks, mimetype="application/json")
+    response.set_etag(etag)
+    # public data, but clients have to revalidate
+    response.headers["Cache-Control"] = "public, no-cache"
+    return response
+
+
+# the cafes ordered like the listing, optionally of one city or country, with the requested fields
+@api_v1.route("/cafes")
+@read_replica
+def api_cafes():
+    try:
+        fields = selected_fields(request.args.get("fields"), API_CAFE_FIELDS)
+    except FieldError as error:
+        return api_error(400, str(error))
+    city, country = request.args.get("city"), request.args.get("country")
+    cursor, limit = request.args.get("cursor"), api_limit()
+
+    def body():
+        # the sort columns are selected for the cursor even when they are not asked for
+        columns = [getattr(Cafe, field) for field in fields if field not in ("rating", "id")] + [Cafe.rating, Cafe.id]
+        query = db.session.query(*columns)
+        if city:
+            query = query.filter(Cafe.city == city)
+        if country:
+            query = query.filter(Cafe.country == country)
+        page = keyset_page(query, [(Cafe.rating, True), (Cafe.id, True)], cursor=cursor, per_page=limit)
+        next_url = url_for("api.api_cafes", fields=request.args.get("fields"), city=city, country=country,
+                           limit=request.args.get("limit"), cursor=page.next_cursor) if page.next_cursor else None
+        return stream_page("cafes", page.items, fields, next_url)
+
+    return api_response(f"catalogue-{Catalogue.query.get(1).version}", body)
+
+
+# one cafe with the requested fields
+@api_v1.route("/cafes/<int:id>")
+@read_replica
+def api_cafe(id):
+    try:
+        fields = selected_fields(request.args.get("fields"), API_CAFE_FIELDS)
+    except FieldError as error:
+        return api_error(400, str(error))
+    row = db.session.query(Cafe.version, *[getattr(Cafe, field) for field in fields]).filter(Cafe.id == id).first()
+    if row is None:
+        return api_error(404, "no such cafe")
+    return api_response(f"cafe-{id}-{row.version}", lambda: [dumps(row_object(row, fields))], cached=False)
+
+
+# the comments of a cafe, newest first
+@api_v1.route("/cafes/<int:id>/comments")
+@read_replica
+def api_comments(id):
+    try:
+        fields = selected_fields(request.args.get("fields"), API_COMMENT_FIELDS)
+    except FieldError as error:
+        return api_error(400, str(error))
+    validated = info_validator(id)
+    if validated is None:
+        return api_error(404, "no such cafe")
+    cursor, limit = request.args.get("cursor"), api_limit()
+
+    def body():
+        query = db.session.query(Comment.id, Comment.text, Comment.date, User.nickname.label("author")) \
+            .join(User, User.id == Comment.author_id).filter(Comment.cafe_id == id)
+        page = keyset_page(query, [(Comment.id, True)], cursor=cursor, per_page=limit)
+        next_url = url_for("api.api_comments", id=id, fields=request.args.get("fields"),
+                           limit=request.args.get("limit"), cursor=page.next_cursor) if page.next_cursor else None
+        return stream_page("comments", page.items, fields, next_url)
+
+    return api_response(validated[0], body)
@@ -0,0 +1,266 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from flask import request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+# fingerprinted static files, "flask build-assets" copies every file of the static folder to static/dist under a name
+# with the hash of its content, bundles the css and js of the pages into one file each and writes gzip (and brotli
+# when installed) variants next to them, the names never change while the content stays the same so they are
+# served with a one year immutable cache and a repeat visit asks for none of them
+# without a build the original files are served as before
+
+BUILD_DIRECTORY = "dist"
+MANIFEST = "manifest.json"
+IMMUTABLE = "public, max-age=31536000, immutable"
+# already compressed formats are not compressed again
+COMPRESSIBLE = (".css", ".js", ".svg", ".ttf", ".eot", ".otf", ".ico", ".json", ".txt", ".xml")
+# source maps are only for development
+SKIPPED = (".map",)
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+CSS_IMPORT = re.compile(r"""@import\s+(['"])([^'"]+)\1""")
+CSS_IMPORT_STATEMENT = re.compile(r"""@import\s[^;]*;""")
+# comments and strings are found first so that nothing inside a string is mistaken for a comment and the other way
+CSS_TOKENS = re.compile(r"""(/\*.*?\*/|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')""", re.S)
+SOURCE_MAP = re.compile(r"^\s*(?://|/\*)# sourceMappingURL=.*$", re.M)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+# "assets/css/owl.css" -> "dist/assets/css/owl.<hash>.css"
+def hashed_name(filename, data):
+    stem, extension = os.path.splitext(filename)
+    return f"{BUILD_DIRECTORY}/{stem}.{content_hash(data)}{extension}"
+
+
+# urls of other files, fonts and images, are left alone when they are absolute or data
+def is_local(url):
+    return not url.startswith(("data:", "http:", "https:", "//", "/", "#", "about:"))
+
+
+# drop the comments (but /*! licences) and the whitespace the browser does not need
+def minify_css(css):
+    output = []
+    for index, part in enumerate(CSS_TOKENS.split(css)):
+        if index % 2:
+            if part.startswith("/*") and not part.startswith("/*!"):
+                continue
+            output.append(part)
+            continue
+        part = re.sub(r"\s+", " ", part)
+        part = re.sub(r"\s*([{};,>])\s*", r"\1", part)
+        part = re.sub(r":\s+", ":", part)
+        output.append(part.replace(";}", "}"))
+    return "".join(output).strip()
+
+
+def minify_js(js, filename):
+    if rjsmin is None or ".min." in filename:
+        return js
+    return rjsmin.jsmin(js, keep_bang_comments=True)
+
+
+# the logical names of every static file, built ones and source maps excluded
+def static_files(static_folder):
+    files = []
+    for directory, directories, names in os.walk(static_folder):
+        relative = os.path.relpath(directory, static_folder).replace(os.sep, "/")
+        if relative == BUILD_DIRECTORY or relative.startswith(BUILD_DIRECTORY + "/"):
+            directories[:] = []
+            continue
+        for name in names:
+            if not name.endswith(SKIPPED):
+                files.append(name if relative == "." else f"{relative}/{name}")
+    return sorted(files)
+
+
+# write the file unless a build already did, every name is the hash of its content
+def write_file(path, data):
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+
+# the precompressed variants worth keeping, [(encoding, suffix, data)]
+def compressed_variants(data):
+    variants = [("gzip", ".gz", gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        variants.insert(0, ("br", ".br", brotli.compress(data)))
+    return [variant for variant in variants if len(variant[2]) < len(data)]
+
+
+class AssetBuild:
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.sources = set(static_files(static_folder))
+        self.files = {}
+        self.encodings = {}
+
+    def read(self, filename):
+        with open(os.path.join(self.static_folder, filename), "rb") as file:
+            return file.read()
+
+    # the built name of a static file, css files are built with their urls pointing at the built names
+    def fingerprint(self, filename):
+        if filename in self.files:
+            return self.files[filename]
+        data = self.read(filename)
+        if filename.endswith(".css"):
+            data = self.build_css(data.decode("utf-8"), filename).encode("utf-8")
+        elif filename.endswith(".js"):
+            data = SOURCE_MAP.sub("", minify_js(data.decode("utf-8"), filename)).encode("utf-8")
+        self.files[filename] = self.write(filename, data)
+        return self.files[filename]
+
+    # the css with its urls pointing at the built files, relative to the directory it is written to
+    def build_css(self, css, filename, output_directory=None):
+        source_directory = os.path.dirname(filename)
+        # the built css and the built targets are both under the build directory
+        output_directory = output_directory or f"{BUILD_DIRECTORY}/{source_directory}"
+
+        def built_url(url):
+            # the query and the fragment stay, fonts use them for old browsers
+            path, suffix = re.match(r"([^?#]*)(.*)", url, re.S).groups()
+            if not is_local(url):
+                return None
+            target = os.path.normpath(os.path.join(source_directory, path)).replace(os.sep, "/")
+            # a missing file keeps pointing where it did
+            built = self.fingerprint(target) if target in self.sources else target
+            return os.path.relpath(built, output_directory).replace(os.sep, "/") + suffix
+
+        def replace_url(match):
+            url = built_url(match.group(2).strip())
+            return match.group(0) if url is None else f'url("{url}")'
+
+        def replace_import(match):
+            url = built_url(match.group(2).strip())
+            return match.group(0) if url is None else f'@import "{url}"'
+
+        css = CSS_IMPORT.sub(replace_import, CSS_URL.sub(replace_url, css))
+        return minify_css(SOURCE_MAP.sub("", css))
+
+    # one file of the listed css or js files in order
+    def bundle(self, name, filenames):
+        if name.endswith(".css"):
+            output_directory = f"{BUILD_DIRECTORY}/{os.path.dirname(name)}"
+            parts = [self.build_css(self.read(filename).decode("utf-8"), filename, output_directory)
+                     for filename in filenames]
+            # an @import only counts at the top of a stylesheet
+            imports = [statement for part in parts for statement in CSS_IMPORT_STATEMENT.findall(part)]
+            data = "\n".join(imports + [CSS_IMPORT_STATEMENT.sub("", part) for part in parts]).encode("utf-8")
+        else:
+            parts = [SOURCE_MAP.sub("", minify_js(self.read(filename).decode("utf-8"), filename)).strip()
+                     for filename in filenames]
+            # a file without a closing semicolon must not run into the next one
+            data = "\n;\n".join(parts).encode("utf-8")
+        self.files[name] = self.write(name, data)
+        return self.files[name]
+
+    def write(self, filename, data):
+        built = hashed_name(filename, data)
+        path = os.path.join(self.static_folder, built)
+        write_file(path, data)
+        if filename.endswith(COMPRESSIBLE):
+            variants = compressed_variants(data)
+            for encoding, suffix, compressed in variants:
+                write_file(path + suffix, compressed)
+            self.encodings[built] = [encoding for encoding, suffix, compressed in variants]
+        return built
+
+
+# build every static file and the bundles, {name: [static files]}, into static/dist and write the manifest
+# returns the manifest
+def build_assets(static_folder, bundles):
+    build = AssetBuild(static_folder)
+    for filename in sorted(build.sources):
+        build.fingerprint(filename)
+    for name, filenames in bundles.items():
+        build.bundle(name, filenames)
+    manifest = {"files": build.files, "bundles": {name: build.files[name] for name in bundles},
+                "encodings": build.encodings}
+    path = os.path.join(static_folder, BUILD_DIRECTORY, MANIFEST)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(temporary, path)
+    return manifest
+
+
+# the runtime side, url_for("static", filename=...) gives the built name when there is one and the static route
+# serves the built files with the immutable cache header and the precompressed variant the browser accepts
+# the files go out with send_file, so through wsgi.file_wrapper (sendfile under gunicorn) or X-Sendfile when
+# USE_X_SENDFILE is set
+class Assets:
+    def __init__(self, app, bundles):
+        self.app = app
+        self.bundles = bundles
+        self.files = {}
+        self.encodings = {}
+        # the hash of the manifest, changes with every build that changes a file
+        self.version = ""
+        self.reload()
+        app.url_defaults(self.built_filename)
+        app.add_template_global(self.asset_bundle)
+        app.view_functions["static"] = self.send_static
+
+    def reload(self):
+        try:
+            with open(os.path.join(self.app.static_folder, BUILD_DIRECTORY, MANIFEST), "rb") as file:
+                data = file.read()
+        except OSError:
+            data = b""
+        manifest = json.loads(data.decode("utf-8")) if data else {}
+        self.version = content_hash(data) if data else ""
+        self.files = manifest.get("files", {})
+        self.encodings = manifest.get("encodings", {})
+
+    def build(self):
+        build_assets(self.app.static_folder, self.bundles)
+        self.reload()
+
+    def built_filename(self, endpoint, values):
+        if endpoint == "static" and values.get("filename") in self.files:
+            values["filename"] = self.files[values["filename"]]
+
+    # the urls of a bundle, the built file or the files it is made of when there is no build
+    def asset_bundle(self, name):
+        if name in self.files:
+            return [url_for("static", filename=name)]
+        return [url_for("static", filename=filename) for filename in self.bundles[name]]
+
+    def send_static(self, filename):
+        if not filename.startswith(BUILD_DIRECTORY + "/"):
+            return self.app.send_static_file(filename)
+        served, encoding = filename, None
+        accepted = self.encodings.get(filename, [])
+        for name, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if name in accepted and request.accept_encodings[name]:
+                served, encoding = filename + suffix, name
+                break
+        response = send_from_directory(self.app.static_folder, served,
+                                       mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        if accepted:
+            response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = IMMUTABLE
+        return response
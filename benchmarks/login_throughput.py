@@ -0,0 +1,53 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordHasher  # noqa: E402
+
+# login throughput of the password hasher, i.e. how many password checks per second (and per core) the
+# configured method and parameters allow, run it on the production hardware before changing the cost settings
+#
+#   python benchmarks/login_throughput.py --workers 4 --concurrency 32 --logins 200
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure password verifications per second.")
+    parser.add_argument("--method", default=os.environ.get("PASSWORD_HASH_METHOD", "scrypt"))
+    parser.add_argument("--scrypt-n", type=int, default=int(os.environ.get("PASSWORD_SCRYPT_N", 2 ** 15)))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="hashing processes")
+    parser.add_argument("--concurrency", type=int, default=16, help="simultaneous logins")
+    parser.add_argument("--logins", type=int, default=100)
+    arguments = parser.parse_args()
+
+    hasher = PasswordHasher(method=arguments.method, scrypt_n=arguments.scrypt_n, workers=arguments.workers,
+                            max_pending=arguments.concurrency)
+    stored = hasher.hash("correct horse battery staple")
+    # warm up the pool so process start up is not measured
+    list(ThreadPoolExecutor(arguments.workers).map(lambda _: hasher.verify(stored, "x"), range(arguments.workers)))
+
+    latencies = []
+
+    def login(_):
+        start = time.perf_counter()
+        assert hasher.verify(stored, "correct horse battery staple")
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(arguments.concurrency) as pool:
+        list(pool.map(login, range(arguments.logins)))
+    elapsed = time.perf_counter() - start
+    hasher.shutdown()
+
+    latencies.sort()
+    throughput = arguments.logins / elapsed
+    print(f"method={arguments.method} workers={arguments.workers} concurrency={arguments.concurrency}")
+    print(f"logins/s={throughput:.1f} logins/s/core={throughput / max(arguments.workers, 1):.1f}")
+    print(f"p50={latencies[len(latencies) // 2] * 1000:.1f}ms p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
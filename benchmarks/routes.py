@@ -0,0 +1,310 @@
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import create_app  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from extensions import db, metrics, password_hasher, thumbnails  # noqa: E402
+from thumbnails import file_fetcher, pillow_installed  # noqa: E402
+from models import Cafe, User, Comment  # noqa: E402
+from accounts import hash_password  # noqa: E402
+from catalogue import rate_cafe  # noqa: E402
+
+# latency, queries per request and memory of the main routes on a synthetic catalogue
+# the catalogue is generated into a temporary sqlite database, every route is driven through the flask test client
+# and a local wsgi server with the given concurrency, the results can be stored as a baseline and later runs are
+# compared against it, a route that got slower, runs more queries or uses more memory fails the run
+#
+#   python benchmarks/routes.py --cafes 100000 --save
+#   python benchmarks/routes.py --cafes 100000 --compare
+
+ROUTES = ("home", "sorted_cafe", "cities", "info", "login", "add")
+# the endpoint of every route in /metrics
+ENDPOINTS = {"home": "pages.home", "sorted_cafe": "pages.sorted_cafe", "cities": "pages.cities", "info": "pages.info",
+             "login": "accounts.login", "add": "admin.add"}
+MODES = ("client", "server")
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+PASSWORD = "benchmark password"
+# the image of every cafe, read from a generated file instead of the network
+IMAGE_URL = "https://img.example.com/cafe.jpg"
+
+COUNTRIES = {
+    "Hungary": ["Budapest", "Debrecen", "Szeged", "Pecs", "Gyor", "Miskolc"],
+    "Germany": ["Berlin", "Hamburg", "Munich", "Cologne", "Leipzig", "Dresden"],
+    "Austria": ["Vienna", "Graz", "Linz", "Salzburg"],
+    "Italy": ["Rome", "Milan", "Naples", "Turin", "Bologna", "Florence"],
+    "France": ["Paris", "Lyon", "Marseille", "Lille", "Nantes"],
+    "Spain": ["Madrid", "Barcelona", "Valencia", "Seville"],
+}
+WORDS = ("espresso", "latte", "flat", "white", "cozy", "quiet", "roastery", "brunch", "cake", "terrace", "garden",
+         "vinyl", "books", "laptop", "friendly", "specialty", "filter", "cold", "brew")
+
+
+def rss_mb():
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# cafes, users with one shared password hash and a long tailed number of comments per cafe (a few cafes get most)
+def generate(cafes, users, comments_per_cafe, chunk_size=10000):
+    engine = db.engine
+    cities = [(country, city) for country, names in COUNTRIES.items() for city in names]
+    stored = hash_password(PASSWORD)
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            {"email": f"user{number}@example.com", "nickname": f"user{number}", "password": stored}
+            for number in range(1, users + 1)])
+    for start in range(0, cafes, chunk_size):
+        rows = []
+        for number in range(start, min(start + chunk_size, cafes)):
+            country, city = random.choice(cities)
+            cafe = {
+                "name": f"Cafe {number}", "map_url": "https://maps.example.com", "img_url": IMAGE_URL,
+                "latitude": random.uniform(36, 55), "longitude": random.uniform(-5, 25), "country": country,
+                "city": city, "location": f"{random.randint(1, 200)} {random.choice(WORDS).title()} street",
+                "description": " ".join(random.sample(WORDS, 5)), "seats": random.randint(2, 80),
+                "coffee_price": round(random.uniform(1, 6), 2), "has_toilet": random.random() < 0.8,
+                "has_wifi": random.random() < 0.6, "has_sockets": random.random() < 0.4,
+                "can_take_calls": random.random() < 0.5, "can_pay_with_card": random.random() < 0.9,
+            }
+            cafe["rating"] = rate_cafe(cafe)
+            rows.append(cafe)
+        comments = []
+        for cafe_id in range(start + 1, start + len(rows) + 1):
+            # paretovariate(1.5) - 1 has a mean of 2
+            count = min(int((random.paretovariate(1.5) - 1) * comments_per_cafe / 2), 2000)
+            comments.extend({"cafe_id": cafe_id, "author_id": random.randint(1, users),
+                             "text": " ".join(random.sample(WORDS, 8)), "date": "January 1, 2024"}
+                            for _ in range(count))
+        with engine.begin() as connection:
+            connection.execute(Cafe.__table__.insert(), rows)
+            if comments:
+                connection.execute(Comment.__table__.insert(), comments)
+
+
+# a fetcher that reads the image of IMAGE_URL from the directory, so the add route makes real thumbnails offline
+def image_fetcher(directory):
+    if pillow_installed():
+        from PIL import Image
+        Image.new("RGB", (1600, 1200), (111, 78, 55)).save(os.path.join(directory, IMAGE_URL.rsplit("/", 1)[-1]),
+                                                             quality=85)
+    return file_fetcher(directory)
+
+
+# (method, path, form data, logged in as the admin) of one request to the route
+def request_for(route, cafes, users):
+    if route == "home":
+        return "GET", "/", None, False
+    if route == "sorted_cafe":
+        city = random.choice(random.choice(list(COUNTRIES.values())))
+        return "GET", f"/sorted/{city}", None, False
+    if route == "cities":
+        if random.random() < 0.5:
+            return "GET", "/cities", None, False
+        return "POST", "/cities", {"gender": random.choice(list(COUNTRIES))}, False
+    if route == "info":
+        return "GET", f"/info/{random.randint(1, cafes)}", None, False
+    if route == "login":
+        email = f"user{random.randint(2, users)}@example.com"
+        return "POST", f"/login/{email}", {"email": email, "password": PASSWORD}, False
+    if route == "add":
+        country, city = random.choice([(country, city) for country, names in COUNTRIES.items() for city in names])
+        return "POST", "/add", {
+            "name": f"Benchmark {uuid.uuid4().hex}", "map_url": "https://maps.example.com",
+            "img_url": IMAGE_URL, "latitude": "47.5", "longitude": "19.05", "country": country,
+            "city": city, "location": "1 Main street", "description": "added by the benchmark", "seats": "20",
+            "coffee_price": "2.5", "has_wifi": "on"}, True
+    raise ValueError(route)
+
+
+class TestClientDriver:
+    def __init__(self, app, admin_cookie):
+        self.app = app
+        self.admin_cookie = admin_cookie
+        self.local = threading.local()
+
+    def send(self, method, path, data, admin):
+        # one client per thread, the test client is not shared between threads, the logins do not stick
+        if not hasattr(self.local, "client"):
+            self.local.client = self.app.test_client(use_cookies=False)
+        headers = {"Cookie": f"session={self.admin_cookie}"} if admin else {}
+        response = self.local.client.open(path, method=method, data=data, headers=headers)
+        response.close()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class ServerDriver:
+    def __init__(self, app, admin_cookie):
+        from werkzeug.serving import make_server
+        # no access log line per request
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        self.admin_cookie = admin_cookie
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def send(self, method, path, data, admin):
+        connection = http.client.HTTPConnection("127.0.0.1", self.server.server_port, timeout=60)
+        headers = {"Cookie": f"session={self.admin_cookie}"} if admin else {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        return response.status
+
+    def close(self):
+        self.server.shutdown()
+
+
+# run the requests of one route with the given concurrency, returns its measurements
+def measure(driver, route, requests, concurrency, cafes, users):
+    endpoint = (("endpoint", ENDPOINTS[route]),)
+    before = metrics.totals("cafe_request_sql_statements").get(endpoint, (0, 0.0))
+    latencies = []
+    errors = []
+
+    def run(_):
+        method, path, data, admin = request_for(route, cafes, users)
+        start = time.perf_counter()
+        status = driver.send(method, path, data, admin)
+        latencies.append(time.perf_counter() - start)
+        if status >= 400:
+            errors.append(status)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(run, range(requests)))
+    after = metrics.totals("cafe_request_sql_statements").get(endpoint, (0, 0.0))
+    count = after[0] - before[0]
+    return {
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "queries": round((after[1] - before[1]) / count, 2) if count else None,
+        "rss_mb": round(rss_mb(), 1),
+        "errors": len(errors),
+    }
+
+
+# the regressions of the results against the baseline, latency and memory within the tolerance, queries exactly
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, result in results.items():
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        for name in ("p50_ms", "p99_ms", "rss_mb"):
+            if result[name] > expected[name] * (1 + tolerance):
+                regressions.append(f"{key} {name} {result[name]} > {expected[name]} (+{tolerance:.0%})")
+        if result["queries"] is not None and expected["queries"] is not None \
+                and result["queries"] > expected["queries"] + 0.5:
+            regressions.append(f"{key} queries {result['queries']} > {expected['queries']}")
+        if result["errors"] > expected["errors"]:
+            regressions.append(f"{key} errors {result['errors']} > {expected['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cafe routes on a synthetic catalogue.")
+    parser.add_argument("--cafes", type=int, default=1000, help="e.g. 1000, 100000 or 1000000")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--comments-per-cafe", type=float, default=3.0, help="mean of the long tailed distribution")
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=list(ROUTES))
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--requests", type=int, default=200, help="requests per route and mode")
+    parser.add_argument("--login-requests", type=int, default=40, help="logins hash a password, so fewer of them")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per route and mode")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help=f"baseline file, by default {BASELINES}/routes-<cafes>.json")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="fail on regressions against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed latency and memory growth")
+    arguments = parser.parse_args()
+
+    random.seed(arguments.seed)
+    directory = tempfile.mkdtemp(prefix="cafe-benchmark-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'cafes.db')}"
+    os.environ["MAIL_QUEUE_IN_PROCESS"] = "0"
+    os.environ["THUMBNAIL_DIR"] = os.path.join(directory, "thumbnails")
+    os.environ["USER_CACHE_DIR"] = os.path.join(directory, "user_versions")
+    app = create_app({"WTF_CSRF_ENABLED": False})
+    start = time.perf_counter()
+    # the bulk inserts are slow queries by design
+    logging.getLogger("metrics").setLevel(logging.ERROR)
+    with app.app_context():
+        thumbnails.fetcher = image_fetcher(directory)
+        upgrade(db.engine)
+        generate(arguments.cafes, arguments.users, arguments.comments_per_cafe)
+        comments = Comment.query.count()
+        db.session.remove()
+    logging.getLogger("metrics").setLevel(logging.NOTSET)
+    print(f"{arguments.cafes} cafes, {arguments.users} users, {comments} comments generated in "
+          f"{time.perf_counter() - start:.1f}s into {directory}")
+    # user 1 is the admin
+    admin_cookie = app.session_interface.get_signing_serializer(app).dumps({"_user_id": "1", "_fresh": True})
+
+    results = {}
+    for mode in arguments.modes:
+        driver = (TestClientDriver if mode == "client" else ServerDriver)(app, admin_cookie)
+        for route in arguments.routes:
+            requests = arguments.login_requests if route == "login" else arguments.requests
+            measure(driver, route, arguments.warmup, arguments.concurrency, arguments.cafes, arguments.users)
+            result = measure(driver, route, requests, arguments.concurrency, arguments.cafes, arguments.users)
+            results[f"{route}/{mode}"] = result
+            print(f"{route:12} {mode:7} p50={result['p50_ms']:8.2f}ms p99={result['p99_ms']:8.2f}ms "
+                  f"queries={result['queries']} rss={result['rss_mb']}MB errors={result['errors']}")
+        driver.close()
+    print(f"peak rss {peak_rss_mb():.1f}MB")
+    with app.app_context():
+        password_hasher.shutdown()
+
+    path = arguments.baseline or os.path.join(BASELINES, f"routes-{arguments.cafes}.json")
+    if arguments.compare:
+        if not os.path.exists(path):
+            sys.exit(f"no baseline in {path}, run with --save first")
+        with open(path, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file)["results"], arguments.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {path}")
+    if arguments.save:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"arguments": {name: getattr(arguments, name) for name in (
+                "cafes", "users", "comments_per_cafe", "requests", "login_requests", "concurrency", "seed")},
+                "results": results}, file, indent=2, sort_keys=True)
+        print(f"baseline stored in {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# cold start of a worker: the import time of every module (python -X importtime), the time to make the app and the
+# time to its first response, in a new interpreter each run, plus the first response of a worker forked from a
+# preloaded app (gunicorn --preload with PRELOAD=1), the medians can be stored as a baseline and later runs are
+# compared against it
+#
+#   python benchmarks/startup.py --runs 10 --save
+#   python benchmarks/startup.py --runs 10 --compare
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+MODES = ("cold", "preload")
+# "import time:       532 |       1045 |   flask.app"
+IMPORT_TIME = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)\s*$")
+
+
+# {module: (self us, cumulative us, depth)} of python -X importtime output
+def import_times(stderr):
+    modules = {}
+    for line in stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            depth = (len(match.group(3)) - 1) // 2
+            modules[match.group(4)] = (int(match.group(1)), int(match.group(2)), depth)
+    return modules
+
+
+# run in a new interpreter: make the app and get the home page, milliseconds since the interpreter started
+def measure_child(mode):
+    started = time.perf_counter()
+    from main import create_app
+    imported = time.perf_counter()
+    app = create_app()
+    created = time.perf_counter()
+    if mode == "preload":
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            forked = time.perf_counter()
+            status = app.test_client().get("/").status_code
+            os.write(write, json.dumps({"status": status,
+                                        "first_response_ms": (time.perf_counter() - forked) * 1000}).encode())
+            os._exit(0)
+        os.waitpid(pid, 0)
+        result = json.loads(os.read(read, 4096))
+        result.update(import_ms=(imported - started) * 1000, create_app_ms=(created - imported) * 1000)
+    else:
+        status = app.test_client().get("/").status_code
+        result = {"status": status, "import_ms": (imported - started) * 1000,
+                  "create_app_ms": (created - imported) * 1000,
+                  "first_response_ms": (time.perf_counter() - created) * 1000}
+    print(json.dumps(result))
+
+
+def run_child(mode, environ):
+    if mode == "preload":
+        environ = dict(environ, PRELOAD="1")
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode], env=environ, cwd=ROOT,
+                               capture_output=True, text=True, check=True)
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    # interpreter start up included
+    result["total_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def import_profile(environ):
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], env=environ, cwd=ROOT,
+                               capture_output=True, text=True, check=True)
+    return import_times(completed.stderr)
+
+
+# the modules imported by main itself, their own import time and everything they import
+def top_level_imports(modules, main_depth):
+    return {name: values for name, values in modules.items() if values[2] == main_depth + 1}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, value in results.items():
+        expected = baseline.get(key)
+        if expected is not None and value > expected * (1 + tolerance):
+            regressions.append(f"{key} {value} > {expected} (+{tolerance:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the start up of a worker.")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--runs", type=int, default=5, help="new interpreters per mode")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports shown")
+    parser.add_argument("--baseline", help=f"baseline file, by default {BASELINES}/startup.json")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="fail on regressions against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed growth of every time")
+    arguments = parser.parse_args()
+    if arguments.child:
+        measure_child(arguments.child)
+        return
+
+    # an upgraded empty database, the first response reads the catalogue version
+    directory = tempfile.mkdtemp(prefix="cafe-startup-")
+    environ = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(directory, 'cafes.db')}",
+                   MAIL_QUEUE_IN_PROCESS="0", FLASK_APP="main")
+    subprocess.run([sys.executable, "-m", "flask", "db-upgrade"], env=environ, cwd=ROOT, check=True,
+                   capture_output=True)
+
+    modules = import_profile(environ)
+    main_self, main_cumulative, main_depth = modules["main"]
+    print(f"import main {main_cumulative / 1000:.1f}ms, {len(modules)} modules, main itself {main_self / 1000:.1f}ms")
+    slowest = sorted(top_level_imports(modules, main_depth).items(), key=lambda item: -item[1][1])
+    for name, (own, cumulative, depth) in slowest[:arguments.top]:
+        print(f"  {name:28} {cumulative / 1000:8.1f}ms")
+
+    results = {"import_main_ms": round(main_cumulative / 1000, 1)}
+    for mode in MODES:
+        runs = [run_child(mode, environ) for _ in range(arguments.runs)]
+        if any(run["status"] != 200 for run in runs):
+            sys.exit(f"{mode}: the first response was not 200")
+        for name in ("import_ms", "create_app_ms", "first_response_ms", "total_ms"):
+            results[f"{mode}/{name}"] = round(statistics.median(run[name] for run in runs), 1)
+        print(f"{mode:8} import={results[f'{mode}/import_ms']:7.1f}ms "
+              f"create_app={results[f'{mode}/create_app_ms']:7.1f}ms "
+              f"first_response={results[f'{mode}/first_response_ms']:7.1f}ms "
+              f"total={results[f'{mode}/total_ms']:7.1f}ms")
+
+    path = arguments.baseline or os.path.join(BASELINES, "startup.json")
+    if arguments.compare:
+        if not os.path.exists(path):
+            sys.exit(f"no baseline in {path}, run with --save first")
+        with open(path, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file)["results"], arguments.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {path}")
+    if arguments.save:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"arguments": {"runs": arguments.runs}, "results": results}, file, indent=2, sort_keys=True)
+        print(f"baseline stored in {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+from sqlalchemy import and_, func, select
+from catalogue_io import BOOLEAN_FIELDS, CAFE_FIELDS, clean_row, insert_ignoring_duplicates
+from rating import score_expression
+
+# the one way a cafe gets into the catalogue, the add, suggest and edit forms and the suggestion approval all use
+# the validation of the catalogue import
+
+
+# the cafe columns of a submitted add, suggest or edit form, raises ValueError with the reason
+# rate(cafe) returns the rating of the cleaned columns
+def cafe_from_form(form, rate):
+    row = {field: form.get(field) for field in CAFE_FIELDS}
+    # unchecked boxes are not sent at all
+    for field in BOOLEAN_FIELDS:
+        row[field] = bool(form.get(field))
+    cafe = clean_row(row)
+    cafe["rating"] = rate(cafe)
+    return cafe
+
+
+# move the selected suggestions into the cafe table with a single INSERT ... SELECT, rated with the current model
+# suggestions whose name is already taken by a cafe stay where they are, run it inside the caller's transaction
+# returns (the new cafe rows as dicts, the number of suggestions left because of their name)
+def approve_suggestions(connection, cafe_table, suggest_table, ids, model):
+    ids = list(ids)
+    if not ids:
+        return [], 0
+    last_id = connection.execute(select([func.max(cafe_table.c.id)])).scalar() or 0
+    columns = [cafe_table.c[field] for field in CAFE_FIELDS] + [cafe_table.c.rating]
+    suggestions = select([suggest_table.c[field] for field in CAFE_FIELDS] + [score_expression(model, suggest_table)]) \
+        .where(suggest_table.c.id.in_(ids)).order_by(suggest_table.c.id)
+    connection.execute(insert_ignoring_duplicates(cafe_table, connection.dialect.name).from_select(columns,
+                                                                                                     suggestions))
+    # the suggestions that became one of the new cafes, duplicates of an approved name included
+    approved = select([suggest_table.c.id]).select_from(
+        suggest_table.join(cafe_table, and_(cafe_table.c.name == suggest_table.c.name, cafe_table.c.id > last_id))) \
+        .where(suggest_table.c.id.in_(ids))
+    approved_ids = [row[0] for row in connection.execute(approved)]
+    cafes = [dict(row) for row in connection.execute(
+        select([cafe_table]).where(and_(cafe_table.c.id > last_id, cafe_table.c.name.in_(
+            select([suggest_table.c.name]).where(suggest_table.c.id.in_(approved_ids))))))] if approved_ids else []
+    if approved_ids:
+        connection.execute(suggest_table.delete().where(suggest_table.c.id.in_(approved_ids)))
+    return cafes, len(set(ids)) - len(approved_ids)
@@ -0,0 +1,149 @@
+import logging
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import bindparam, func
+from rating import score
+from extensions import db, metrics, thumbnails, facet_index, amenity_index, fragment_cache, api_cache
+from models import Cafe, Suggest, Comment, Catalogue
+
+# the cafe catalogue shared by the site, the admin pages, the api and the commands: ratings, the catalogue version,
+# the derived indexes and caches that follow every cafe change, and the thumbnails of the images
+
+logger = logging.getLogger(__name__)
+
+
+# manage and calculate the cafe rating with the configured rating model
+def rating_calculator(seats, has_wifi, has_toilet, has_sockets, can_take_calls, can_pay_with_card):
+    return score(current_app.config['RATING_MODEL'], seats, has_wifi=has_wifi, has_toilet=has_toilet,
+                 has_sockets=has_sockets, can_take_calls=can_take_calls, can_pay_with_card=can_pay_with_card)
+
+
+# the rating of a cleaned cafe row
+def rate_cafe(cafe):
+    return rating_calculator(cafe["seats"], cafe["has_wifi"], cafe["has_toilet"], cafe["has_sockets"],
+                             cafe["can_take_calls"], cafe["can_pay_with_card"])
+
+
+# bump the catalogue version inside the current transaction, every cafe change calls it before its commit
+def touch_catalogue():
+    Catalogue.query.filter_by(id=1).update({Catalogue.version: Catalogue.version + 1,
+                                            Catalogue.updated_at: datetime.utcnow()})
+
+
+# the column values of a cafe, taken before a commit expires or deletes it
+def cafe_snapshot(cafe):
+    return {column.key: getattr(cafe, column.key) for column in Cafe.__table__.columns}
+
+
+# keep the derived cafe indexes up to date after a cafe commit
+# before is the snapshot of the cafe before the change (None if it was added), after the one after it (None if deleted)
+def cafe_changed(before=None, after=None):
+    cafes_changed([before] if before is not None else [], [after] if after is not None else [])
+
+
+# the same for a commit that changed many cafes, befores are the snapshots of the changed and deleted cafes, afters
+# the ones of the changed and added cafes
+def cafes_changed(befores=(), afters=()):
+    for before in befores:
+        facet_index.remove(before["country"], before["city"])
+        amenity_index.remove(before)
+        fragment_cache.invalidate(before["id"])
+    for after in afters:
+        facet_index.add(after["country"], after["city"])
+        amenity_index.add(after)
+    # the cached api pages are keyed by the catalogue version, none of them will be asked for again
+    api_cache.clear()
+    version = Catalogue.query.get(1).version
+    facet_index.advance(version)
+    amenity_index.advance(version)
+
+
+# delete cafes and their comments with one statement per table in a single transaction
+# returns the number of deleted cafes
+def delete_cafes(ids):
+    befores = [row._asdict() for row in db.session.query(*Cafe.__table__.columns).filter(Cafe.id.in_(ids))] \
+        if ids else []
+    if not befores:
+        return 0
+    ids = [before["id"] for before in befores]
+    Comment.query.filter(Comment.cafe_id.in_(ids)).delete(synchronize_session=False)
+    Cafe.query.filter(Cafe.id.in_(ids)).delete(synchronize_session=False)
+    touch_catalogue()
+    db.session.commit()
+    cafes_changed(befores=befores)
+    return len(befores)
+
+
+# {img_url: digest} of the images, fetched and made into thumbnails, failed ones are None
+def image_digests(urls):
+    with metrics.section("thumbnails"):
+        return thumbnails.store_many(urls)
+
+
+# store the digests {cafe id: digest or None} of the fetched images, with a new row version so that the cached cards
+# link the thumbnails, returns the number of cafes that got one
+def set_image_digests(digests):
+    ids = [cafe_id for cafe_id, digest in digests.items() if digest]
+    cafe_table = Cafe.__table__
+    befores = [row._asdict() for row in db.session.query(*cafe_table.columns).filter(Cafe.id.in_(ids))] if ids else []
+    if not befores:
+        return 0
+    db.session.execute(cafe_table.update().where(cafe_table.c.id == bindparam("cafe_id")).values(
+        image_digest=bindparam("digest"), version=cafe_table.c.version + 1),
+        [{"cafe_id": before["id"], "digest": digests[before["id"]]} for before in befores])
+    touch_catalogue()
+    db.session.commit()
+    cafes_changed(befores, [dict(before, image_digest=digests[before["id"]], version=before["version"] + 1)
+                            for before in befores])
+    return len(befores)
+
+
+# make the thumbnails of the cafes {cafe id: image url} on the background worker after the request, the pages show
+# the remote images until then, the ones of a worker that stops first are left to "flask fetch-thumbnails"
+def fetch_thumbnails_later(images):
+    if not images or not thumbnails.available:
+        return
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                digests = image_digests(images.values())
+                set_image_digests({cafe_id: digests.get(url) for cafe_id, url in images.items()})
+            except Exception:
+                logger.exception("could not store the thumbnails of %s cafes", len(images))
+
+    thumbnails.submit(run)
+
+
+# (rating, number of cafes) of every rating from the highest, read from ix_cafe_rating_id or ix_cafe_city_rating_id
+def rating_counts(city=None):
+    query = db.session.query(Cafe.rating, func.count(Cafe.id))
+    if city is not None:
+        query = query.filter(Cafe.city == city)
+    return query.group_by(Cafe.rating).order_by(Cafe.rating.desc()).all()
+
+
+# the columns of an exported table, the row version and the image digest are internal
+def export_columns(table):
+    return [column.name for column in table.columns if column.name not in ("version", "image_digest")]
+
+
+# the tables that can be exported
+def export_table(name):
+    return {"cafes": Cafe.__table__, "suggestions": Suggest.__table__}.get(name)
+
+
+# the listing pages only change with the catalogue
+def catalogue_validator(*args, **kwargs):
+    catalogue = Catalogue.query.get(1)
+    return f"catalogue-{catalogue.version}", catalogue.updated_at
+
+
+# the information page changes with the cafe and its comments
+def info_validator(id):
+    row = db.session.query(Cafe.version, func.count(Comment.id), func.max(Comment.id)) \
+        .outerjoin(Comment, Comment.cafe_id == Cafe.id).filter(Cafe.id == id).group_by(Cafe.id).first()
+    if row is None:
+        return None
+    return f"cafe-{id}-{row[0]}-{row[1]}-{row[2]}", None
@@ -0,0 +1,137 @@
+import csv
+import io
+import json
+from sqlalchemy import select
+
+# streaming import and export of the cafe catalogue as csv or ndjson
+# rows flow through generators, so memory stays bounded by one batch whatever the size of the file
+
+CAFE_FIELDS = ("name", "map_url", "latitude", "longitude", "img_url", "country", "city", "location", "description",
+               "seats", "coffee_price", "has_toilet", "has_wifi", "has_sockets", "can_take_calls",
+               "can_pay_with_card")
+FLOAT_FIELDS = ("latitude", "longitude", "coffee_price")
+BOOLEAN_FIELDS = ("has_toilet", "has_wifi", "has_sockets", "can_take_calls", "can_pay_with_card")
+TRUE_VALUES = ("1", "true", "yes", "y", "on")
+FALSE_VALUES = ("", "0", "false", "no", "n", "off")
+FORMATS = ("csv", "ndjson")
+
+
+# read rows from a text file, one dict per cafe
+def read_rows(file, format):
+    if format == "csv":
+        yield from csv.DictReader(file)
+    elif format == "ndjson":
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError(f"unknown format {format}")
+
+
+# check and convert one row to the cafe columns, raises ValueError with the reason
+def clean_row(row):
+    cafe = {}
+    for field in CAFE_FIELDS:
+        value = row.get(field)
+        if value is None or (isinstance(value, str) and not value.strip() and field not in BOOLEAN_FIELDS):
+            raise ValueError(f"{field} is missing")
+        if field in BOOLEAN_FIELDS:
+            if isinstance(value, str):
+                if value.strip().lower() not in TRUE_VALUES + FALSE_VALUES:
+                    raise ValueError(f"{field} is not a boolean")
+                value = value.strip().lower() in TRUE_VALUES
+            cafe[field] = bool(value)
+        elif field in FLOAT_FIELDS:
+            cafe[field] = float(value)
+        elif field == "seats":
+            cafe[field] = int(value)
+        else:
+            cafe[field] = str(value).strip()
+    return cafe
+
+
+# the insert that skips rows whose unique name already exists
+def insert_ignoring_duplicates(table, dialect_name):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing(index_elements=["name"])
+    if dialect_name == "sqlite":
+        return table.insert().prefix_with("OR IGNORE")
+    raise ValueError(f"duplicate safe import is not supported on {dialect_name}")
+
+
+# insert the rows into the cafe table in batches, one transaction per batch
+# rate(cafe) returns the rating of a cleaned row, invalid rows are reported but do not stop the import
+# returns (inserted, skipped as duplicates, [(row number, error)])
+def import_rows(engine, table, rows, rate, batch_size=5000, max_errors=100):
+    statement = insert_ignoring_duplicates(table, engine.dialect.name)
+    inserted = skipped = 0
+    errors = []
+    batch = {}
+
+    def flush():
+        with engine.begin() as connection:
+            count = connection.execute(statement, list(batch.values())).rowcount
+        batch.clear()
+        return count
+
+    for number, row in enumerate(rows, start=1):
+        try:
+            cafe = clean_row(row)
+        except (ValueError, TypeError) as error:
+            if len(errors) < max_errors:
+                errors.append((number, str(error)))
+            continue
+        if cafe["name"] in batch:
+            skipped += 1
+            continue
+        cafe["rating"] = rate(cafe)
+        batch[cafe["name"]] = cafe
+        if len(batch) >= batch_size:
+            size = len(batch)
+            count = flush()
+            inserted += count
+            skipped += size - count
+    if batch:
+        size = len(batch)
+        count = flush()
+        inserted += count
+        skipped += size - count
+    return inserted, skipped, errors
+
+
+# every row of the table as a dict, read in primary key order one chunk at a time
+def export_rows(engine, table, columns, chunk_size=5000):
+    selected = [table.c[column] for column in columns]
+    last_id = None
+    while True:
+        query = select(selected).order_by(table.c.id).limit(chunk_size)
+        if last_id is not None:
+            query = query.where(table.c.id > last_id)
+        with engine.connect() as connection:
+            rows = connection.execute(query).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield dict(zip(columns, row))
+        last_id = rows[-1]["id"]
+
+
+# serialise rows to csv or ndjson text chunks
+def write_rows(rows, columns, format):
+    if format == "ndjson":
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+        return
+    if format != "csv":
+        raise ValueError(f"unknown format {format}")
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() > 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,177 @@
+import os
+import click
+from flask import current_app, url_for
+from flask.cli import with_appcontext
+from pagination import encode_cursor
+from rating import recompute_ratings
+from catalogue_io import FORMATS, read_rows, import_rows, export_rows, write_rows
+from migrations import upgrade, current_version, MIGRATIONS
+from query_plans import recorded_statements, full_scans
+from extensions import db, assets, thumbnails, facet_index, amenity_index, mail_dispatcher
+from models import Cafe, Suggest, Catalogue, user_table, suggestion_table
+from catalogue import rate_cafe, touch_catalogue, image_digests, set_image_digests, export_columns, export_table
+
+# the flask commands, e.g. "FLASK_APP=main flask db-upgrade", create_app registers every command of COMMANDS
+
+
+# send the queued mails until interrupted
+@click.command("send-mail")
+@with_appcontext
+def send_mail_command():
+    mail_dispatcher.run_forever()
+
+
+# fingerprint, bundle and precompress the static files into static/dist, run it again after changing them
+@click.command("build-assets")
+@with_appcontext
+def build_assets_command():
+    assets.build()
+    click.echo(f"{len(assets.files)} static files built into {os.path.join(current_app.static_folder, 'dist')}")
+
+
+# rescore every cafe and suggestion with the configured rating model
+@click.command("recompute-ratings")
+@click.option("--chunk-size", default=50000, help="Rows rescored per transaction.")
+@with_appcontext
+def recompute_ratings_command(chunk_size):
+    model = current_app.config['RATING_MODEL']
+    cafes = recompute_ratings(db.engine, Cafe.__table__, model, chunk_size=chunk_size, bump_version=True)
+    suggestions = recompute_ratings(db.engine, Suggest.__table__, model, chunk_size=chunk_size)
+    if cafes:
+        touch_catalogue()
+        db.session.commit()
+    click.echo(f"{cafes} cafes and {suggestions} suggestions rescored")
+
+
+# import cafes from a csv or ndjson file, duplicate names are skipped
+@click.command("import-cafes")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "file_format", type=click.Choice(FORMATS), default="csv")
+@click.option("--batch-size", default=5000, help="Rows inserted per transaction.")
+@with_appcontext
+def import_cafes_command(file, file_format, batch_size):
+    inserted, skipped, errors = import_rows(
+        db.engine, Cafe.__table__, read_rows(file, file_format), batch_size=batch_size, rate=rate_cafe)
+    if inserted:
+        touch_catalogue()
+        db.session.commit()
+    for number, error in errors:
+        click.echo(f"row {number}: {error}", err=True)
+    click.echo(f"{inserted} cafes imported, {skipped} duplicates skipped, {len(errors)} invalid rows")
+
+
+# export the cafes or the suggestions as csv or ndjson
+@click.command("export-cafes")
+@click.argument("output", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--table", "table_name", type=click.Choice(["cafes", "suggestions"]), default="cafes")
+@click.option("--format", "file_format", type=click.Choice(FORMATS), default="csv")
+@with_appcontext
+def export_cafes_command(output, table_name, file_format):
+    table = export_table(table_name)
+    columns = export_columns(table)
+    for chunk in write_rows(export_rows(db.engine, table, columns), columns, file_format):
+        output.write(chunk)
+
+
+# create or upgrade the database schema, run it once after every deploy before the workers start
+@click.command("db-upgrade")
+@click.option("--target", type=int, default=None, help="Stop at this schema version.")
+@with_appcontext
+def db_upgrade_command(target):
+    for version, description in upgrade(db.engine, target=target):
+        click.echo(f"{version}: {description}")
+    click.echo(f"schema version {current_version(db.engine)} of {max(version for version, _, _ in MIGRATIONS)}")
+
+
+# make the thumbnails of the cafes that have none yet (or of every cafe with --all), e.g. after an import
+@click.command("fetch-thumbnails")
+@click.option("--all", "every_cafe", is_flag=True, help="Fetch the images of every cafe again.")
+@click.option("--chunk-size", default=200, help="Cafes fetched per transaction.")
+@with_appcontext
+def fetch_thumbnails_command(every_cafe, chunk_size):
+    if not thumbnails.available:
+        raise click.ClickException("thumbnails need the Pillow package")
+    query = db.session.query(Cafe.id, Cafe.img_url).order_by(Cafe.id)
+    if not every_cafe:
+        query = query.filter(Cafe.image_digest.is_(None))
+    last_id, made, failed = 0, 0, 0
+    while True:
+        cafes = query.filter(Cafe.id > last_id).limit(chunk_size).all()
+        if not cafes:
+            break
+        last_id = cafes[-1].id
+        digests = image_digests(cafe.img_url for cafe in cafes)
+        changed = set_image_digests({cafe.id: digests.get(cafe.img_url) for cafe in cafes})
+        failed += len(cafes) - changed
+        made += changed
+    click.echo(f"thumbnails of {made} cafes made, {failed} images could not be fetched")
+
+
+# the public pages of the first cafe, its city and a word of its name
+def plan_check_urls(cafe):
+    word = cafe.name.split()[0]
+    return [
+        url_for("pages.home"),
+        url_for("pages.cafe_chunk", cursor=encode_cursor([cafe.rating, cafe.id])),
+        url_for("pages.sorted_cafe", id=cafe.city),
+        url_for("pages.cafe_chunk", city=cafe.city, cursor=encode_cursor([cafe.rating, cafe.id])),
+        url_for("pages.cities"),
+        url_for("pages.info", id=cafe.id),
+        url_for("pages.search", q=word),
+        url_for("pages.nearby", lat=cafe.latitude, lng=cafe.longitude),
+        url_for("pages.nearby_json", lat=cafe.latitude, lng=cafe.longitude),
+        url_for("pages.filter_cafes", has_wifi="on", city=cafe.city),
+        url_for("api.api_cafes", fields="name,city", cursor=encode_cursor([cafe.rating, cafe.id])),
+        url_for("api.api_cafes", city=cafe.city),
+        url_for("api.api_cafes", country=cafe.country),
+        url_for("api.api_cafe", id=cafe.id, fields="name"),
+        url_for("api.api_comments", id=cafe.id),
+    ]
+
+
+# the admin tables in every order and with a search
+def admin_plan_check_urls():
+    urls = []
+    for endpoint, table in [("admin.user_database", user_table), ("admin.suggested", suggestion_table)]:
+        for sort in table.sortable:
+            last = [0] if sort == "id" else ["m", 0]
+            urls.append(url_for(endpoint, sort=sort, order="desc", cursor=encode_cursor(last)))
+        urls.append(url_for(endpoint, q="a"))
+    return urls
+
+
+# request every public and admin page and EXPLAIN the queries it runs, fail when one of them reads a whole table
+# the in-memory indexes are loaded first, reading the whole catalogue once is what they are for
+@click.command("check-query-plans")
+@with_appcontext
+def check_query_plans_command():
+    cafe = Cafe.query.order_by(Cafe.id).first()
+    if cafe is None:
+        raise click.ClickException("the plans can only be checked with at least one cafe in the database")
+    version = Catalogue.query.get(1).version
+    facet_index.sync(version)
+    facet_index.countries()
+    amenity_index.sync(version)
+    amenity_index.cities()
+    app = current_app._get_current_object()
+    with app.test_request_context():
+        urls = plan_check_urls(cafe) + admin_plan_check_urls()
+    failures = 0
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = "1"
+    for url in urls:
+        with recorded_statements(db.engine) as statements:
+            status = client.get(url).status_code
+        click.echo(f"{url} {status} {len(statements)} queries")
+        for statement, parameters in statements:
+            scans = full_scans(db.engine, statement, parameters)
+            if scans:
+                failures += 1
+                click.echo(f"  full scan of {', '.join(scans)}: {' '.join(statement.split())}", err=True)
+    if failures:
+        raise click.ClickException(f"{failures} queries read a whole table")
+
+
+COMMANDS = [send_mail_command, build_assets_command, recompute_ratings_command, import_cafes_command,
+            export_cafes_command, db_upgrade_command, fetch_thumbnails_command, check_query_plans_command]
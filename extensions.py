@@ -0,0 +1,42 @@
+from flask import current_app
+from flask_bootstrap import Bootstrap
+from flask_gravatar import Gravatar
+from flask_login import LoginManager
+from flask_mail import Mail
+from werkzeug.local import LocalProxy
+from database import RoutingSQLAlchemy
+from metrics import Metrics
+
+# the extensions, made without an app and bound to it by create_app in main.py, importing this module does not read
+# the configuration nor open a connection
+
+db = RoutingSQLAlchemy()
+bootstrap = Bootstrap()
+mail = Mail()
+# set gravatar for automatic user avatars
+gravatar = Gravatar(size=100, rating='g', default='retro', force_default=False, force_lower=False, use_ssl=False,
+                    base_url=None)
+# set login manager for login users
+login_manager = LoginManager()
+# the numbers are per process, shared by the apps of the process
+metrics = Metrics()
+
+# the objects create_app makes from the configuration of the app, e.g. the fragment cache with its size,
+# app.extensions["cafe"] holds them by name and these stand for the ones of the current app
+SERVICES = "cafe"
+
+
+def service(name):
+    return LocalProxy(lambda: current_app.extensions[SERVICES][name])
+
+
+assets = service("assets")
+thumbnails = service("thumbnails")
+password_hasher = service("password_hasher")
+user_cache = service("user_cache")
+facet_index = service("facet_index")
+amenity_index = service("amenity_index")
+rating_histograms = service("rating_histograms")
+mail_dispatcher = service("mail_dispatcher")
+fragment_cache = service("fragment_cache")
+api_cache = service("api_cache")
@@ -0,0 +1,101 @@
+import threading
+from collections import OrderedDict
+
+
+# country -> city -> number of cafes, built from one grouped query and kept up to date on every cafe commit
+class FacetIndex:
+    def __init__(self, loader):
+        # loader returns (country, city, count) rows, it only runs when the index is (re)built
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._countries = None
+        self._version = None
+
+    def _ensure_loaded(self):
+        if self._countries is None:
+            countries = {}
+            for country, city, count in self._loader():
+                countries.setdefault(country, {})[city] = count
+            self._countries = countries
+        return self._countries
+
+    # sorted list of every country that has at least one cafe
+    def countries(self):
+        with self._lock:
+            return sorted(self._ensure_loaded())
+
+    # sorted list of (city, number of cafes) pairs in the given country
+    def cities(self, country):
+        with self._lock:
+            return sorted(self._ensure_loaded().get(country, {}).items())
+
+    # a cafe was added to (or moved into) this city
+    def add(self, country, city):
+        with self._lock:
+            if self._countries is None:
+                return
+            cities = self._countries.setdefault(country, {})
+            cities[city] = cities.get(city, 0) + 1
+
+    # a cafe was deleted from (or moved out of) this city
+    def remove(self, country, city):
+        with self._lock:
+            if self._countries is None:
+                return
+            cities = self._countries.get(country, {})
+            if cities.get(city, 0) > 1:
+                cities[city] -= 1
+                return
+            cities.pop(city, None)
+            if not cities:
+                self._countries.pop(country, None)
+
+    # a local commit that was already applied incrementally moved the catalogue to version
+    # the index stays when it was the only change since the last sync, otherwise it is rebuilt
+    def advance(self, version):
+        with self._lock:
+            if self._version is None or version != self._version + 1:
+                self._countries = None
+            self._version = version
+
+    # rebuild on the next read when the catalogue version changed, e.g. by a commit in another worker
+    def sync(self, version):
+        with self._lock:
+            if version != self._version:
+                self._countries = None
+                self._version = version
+
+    # drop everything, the next read rebuilds the index from the database
+    def invalidate(self):
+        with self._lock:
+            self._countries = None
+
+
+# city (None for every cafe) -> [(rating, number of cafes)] from highest to lowest rating for the listing pages,
+# each one read with one grouped query over the rating index and kept until the catalogue version changes
+class RatingHistograms:
+    def __init__(self, loader, maxsize=256):
+        # loader(city) returns the (rating, count) rows
+        self._loader = loader
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._histograms = OrderedDict()
+        self._version = None
+
+    def get(self, version, city=None):
+        with self._lock:
+            if version != self._version:
+                self._histograms.clear()
+                self._version = version
+            histogram = self._histograms.get(city)
+            if histogram is not None:
+                self._histograms.move_to_end(city)
+                return histogram
+        # read outside of the lock, two requests may both load the same histogram
+        histogram = [(rating, count) for rating, count in self._loader(city)]
+        with self._lock:
+            if version == self._version:
+                self._histograms[city] = histogram
+                while len(self._histograms) > self._maxsize:
+                    self._histograms.popitem(last=False)
+        return histogram
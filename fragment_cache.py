@@ -0,0 +1,109 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+
+
+# shared on-disk store, one directory per cafe so a cafe's fragments can be dropped at once
+# several workers can point at the same directory, files are replaced atomically
+class DiskFragmentStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, kind, cafe_id, version):
+        # the kind may come from anywhere, keep the file name safe
+        name = hashlib.sha1(f"{kind}-{version}".encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, str(cafe_id), name + ".html")
+
+    def get(self, kind, cafe_id, version):
+        try:
+            with open(self._path(kind, cafe_id, version), encoding="utf-8") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    # a directory removed meanwhile by invalidate() or clear() of another worker only means the fragment is not stored
+    def set(self, kind, cafe_id, version, html):
+        path = self._path(kind, cafe_id, version)
+        temporary = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(handle, "w", encoding="utf-8") as file:
+                file.write(html)
+            os.replace(temporary, path)
+        except OSError:
+            if temporary is not None:
+                try:
+                    os.remove(temporary)
+                except OSError:
+                    pass
+
+    def invalidate(self, cafe_id):
+        shutil.rmtree(os.path.join(self.directory, str(cafe_id)), ignore_errors=True)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+
+# bounded LRU of rendered html fragments keyed by (kind, cafe id, row version)
+# a bumped row version never hits an old entry, invalidate() frees the entries of a changed or deleted cafe
+class FragmentCache:
+    def __init__(self, maxsize=2048, directory=None):
+        self.maxsize = maxsize
+        self.store = DiskFragmentStore(directory) if directory else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind, cafe_id, version):
+        key = (kind, cafe_id, version)
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                return html
+        if self.store is not None:
+            html = self.store.get(kind, cafe_id, version)
+            if html is not None:
+                html = Markup(html)
+                self._remember(key, html)
+        return html
+
+    def set(self, kind, cafe_id, version, html):
+        html = Markup(html)
+        self._remember((kind, cafe_id, version), html)
+        if self.store is not None:
+            self.store.set(kind, cafe_id, version, str(html))
+        return html
+
+    def _remember(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # return the cached fragment, or render and cache it
+    def get_or_render(self, kind, cafe_id, version, render):
+        html = self.get(kind, cafe_id, version)
+        if html is None:
+            html = self.set(kind, cafe_id, version, render())
+        return html
+
+    def invalidate(self, cafe_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == cafe_id]:
+                del self._entries[key]
+        if self.store is not None:
+            self.store.invalidate(cafe_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.store is not None:
+            self.store.clear()
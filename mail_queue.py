@@ -0,0 +1,192 @@
+import logging
+import os
+import random
+import smtplib
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import and_, select
+
+# background delivery of queued emails
+# requests only insert into the outbox table, worker threads claim batches of due rows, send them over one reused
+# SMTP connection per worker, and reschedule failures with exponential backoff
+
+logger = logging.getLogger(__name__)
+
+# errors that mean the connection is gone, not that one message is bad
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError,
+                     socket.timeout, EOFError)
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+# shared limit of messages per second over all workers of the process
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class MailDispatcher:
+    # connect returns a context manager whose value has send(message), e.g. Mail.connect of Flask-Mail
+    # build_message turns an outbox row into that message, context wraps every worker (e.g. app.app_context)
+    def __init__(self, engine, table, connect, build_message, context, workers=1, batch_size=20, max_attempts=5,
+                 backoff=30, rate=5.0, lease=600, poll_interval=5):
+        self.engine = engine
+        self.table = table
+        self.connect = connect
+        self.build_message = build_message
+        self.context = context
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.bucket = TokenBucket(rate)
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # start the worker threads once per process, a forked process has none of the threads of its parent
+    def start(self):
+        with self._lock:
+            if self._threads and self._pid == os.getpid():
+                return
+            self._threads = []
+            self._pid = os.getpid()
+            self._stopping.clear()
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"mail-dispatcher-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    # a new message was queued, let an idle worker look at the outbox right away
+    def wake(self):
+        self._wake.set()
+
+    # run the workers in the foreground until interrupted
+    def run_forever(self):
+        self.start()
+        try:
+            while any(thread.is_alive() for thread in self._threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stop()
+
+    # mark a batch of due rows as ours, a claimed row comes back after the lease if the worker dies
+    def claim(self):
+        table = self.table
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        due = select([table.c.id]).where(and_(table.c.status.in_([PENDING, SENDING]),
+                                              table.c.next_attempt_at <= now)) \
+            .order_by(table.c.id).limit(self.batch_size)
+        with self.engine.begin() as connection:
+            connection.execute(table.update().where(and_(table.c.id.in_(due),
+                                                         table.c.status.in_([PENDING, SENDING]),
+                                                         table.c.next_attempt_at <= now))
+                               .values(status=SENDING, claim=token,
+                                       next_attempt_at=now + timedelta(seconds=self.lease)))
+            return connection.execute(select([table]).where(table.c.claim == token).order_by(table.c.id)).fetchall()
+
+    # put a row back with exponential backoff, or give up after max_attempts
+    def _retry(self, connection, row, error):
+        attempts = row["attempts"] + 1
+        delay = self.backoff * 2 ** (attempts - 1) * random.uniform(0.8, 1.2)
+        connection.execute(self.table.update().where(self.table.c.id == row["id"]).values(
+            status=FAILED if attempts >= self.max_attempts else PENDING, attempts=attempts, claim=None,
+            last_error=str(error)[:500], next_attempt_at=datetime.utcnow() + timedelta(seconds=delay)))
+
+    def _work(self):
+        with self.context():
+            session = None
+            while not self._stopping.is_set():
+                try:
+                    batch = self.claim()
+                except Exception:
+                    logger.exception("could not claim queued mail")
+                    batch = []
+                if not batch:
+                    # close the idle SMTP connection and wait for new mail
+                    session = self._close(session)
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+                    continue
+                session = self._deliver(batch, session)
+            self._close(session)
+
+    # send a claimed batch over the open connection, opening it if needed, returns the connection to reuse
+    def _deliver(self, batch, session):
+        sent = []
+        failures = []
+        if session is None:
+            try:
+                session = self._open()
+            except Exception as error:
+                logger.warning("could not connect to the smtp server: %s", error)
+                failures = [(row, error) for row in batch]
+                batch = []
+        for position, row in enumerate(batch):
+            try:
+                self.bucket.take()
+                session[1].send(self.build_message(row))
+                sent.append(row["id"])
+            except CONNECTION_ERRORS as error:
+                # the connection is broken, the rest of the batch waits for the retry as well
+                logger.warning("smtp connection failed: %s", error)
+                session = self._close(session)
+                failures.extend((rest, error) for rest in batch[position:])
+                break
+            except Exception as error:
+                logger.warning("could not send queued mail %s: %s", row["id"], error)
+                failures.append((row, error))
+        with self.engine.begin() as connection:
+            if sent:
+                connection.execute(self.table.update().where(self.table.c.id.in_(sent)).values(
+                    status=SENT, claim=None, sent_at=datetime.utcnow()))
+            for row, error in failures:
+                self._retry(connection, row, error)
+        return session
+
+    def _open(self):
+        manager = self.connect()
+        return manager, manager.__enter__()
+
+    @staticmethod
+    def _close(session):
+        if session is not None:
+            try:
+                session[0].__exit__(None, None, None)
+            except Exception:
+                logger.debug("closing the smtp connection failed", exc_info=True)
+        return None
@@ -1,572 +1,223 @@
-from flask import Flask, render_template, url_for, request, redirect, abort, flash
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import relationship
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_login import UserMixin, login_user, LoginManager, login_required, current_user, logout_user
-from flask_gravatar import Gravatar
-from functools import wraps
-from datetime import date
-from flask_bootstrap import Bootstrap
-from forms import RegisterForm, LoginRegisterForm, LoginForm, ForgotPasswordForm, ResetPasswordForm
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from flask_mail import Mail, Message
+import hmac
+import logging
+import os
+from flask import Flask, abort, current_app, make_response, request
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from facets import FacetIndex, RatingHistograms
+from fragment_cache import FragmentCache
+from amenities import AmenityIndex, COLUMNS as AMENITY_COLUMNS
+from rating import DEFAULT_RATING_MODEL
+from mail_queue import MailDispatcher
+from passwords import PasswordHasher
+from user_cache import UserCache
+from database import database_config
+from metrics import instrument
+from assets import Assets
+from thumbnails import ThumbnailCache, http_fetcher
+from api import ResponseCache
+from extensions import db, bootstrap, mail, gravatar, login_manager, metrics, SERVICES, facet_index, amenity_index
+from models import Cafe, Catalogue, OutboxMail
+from catalogue import rating_counts
+from accounts import accounts, mail_connection, outbox_message
+from admin import admin
+from api_v1 import api_v1
+from pages import pages
+from commands import COMMANDS
 
 # ------------------------------------------ SET THE APPLICATION --------------------------------------------------- #
-
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///cafes.db'
-app.config['SECRET_KEY'] = '8BYkEfBA6O6donzWlSihBXox7C0sKR6b'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JSON_AS_ASCII'] = False
-db = SQLAlchemy(app)
-Bootstrap(app)
-current_year = date.today().year
-
-# set smpt email server, you have to set your smtp address, email address, and password
-SMTP = "YOUR EMAIL SERVICE SMTP ADDRESS"
-EMAIL = "YOUR EMAIL ADDRESS"
-PASSWORD = "YOUR PASSWORD"
-
-app.config["MAIL_SERVER"] = SMTP
-app.config["MAIL_PORT"] = "e.g.587"
-app.config["MAIL_USE_TLS"] = True
-app.config["MAIL_USERNAME"] = EMAIL
-app.config["MAIL_PASSWORD"] = PASSWORD
-mail = Mail(app)
-
-# set gravatar for automatic user avatars
-gravatar = Gravatar(app, size=100, rating='g', default='retro', force_default=False, force_lower=False, use_ssl=False,
-                    base_url=None)
-# set login manager for login users
-login_manager = LoginManager()
-login_manager.init_app(app)
-
-
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
-
-
-# ------------------------------------------------- SET THE DATABASE MODELS --------------------------------------- #
-
-# set the cafe database model
-class Cafe(db.Model):
-    __tablename__ = "cafe"
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(250), unique=True, nullable=False)
-    map_url = db.Column(db.String(500), nullable=False)
-    latitude = db.Column(db.Float, nullable=False)
-    longitude = db.Column(db.Float, nullable=False)
-    img_url = db.Column(db.String(500), nullable=False)
-    country = db.Column(db.String(250), nullable=False)
-    city = db.Column(db.String(250), nullable=False)
-    location = db.Column(db.String(250), nullable=False)
-    description = db.Column(db.String(250), nullable=False)
-    seats = db.Column(db.Integer, nullable=False)
-    coffee_price = db.Column(db.Float, nullable=False)
-    rating = db.Column(db.Integer, nullable=False)
-    has_toilet = db.Column(db.Boolean, nullable=False)
-    has_wifi = db.Column(db.Boolean, nullable=False)
-    has_sockets = db.Column(db.Boolean, nullable=False)
-    can_take_calls = db.Column(db.Boolean, nullable=False)
-    can_pay_with_card = db.Column(db.Boolean, nullable=False)
-    comments = relationship("Comment", back_populates="parent_cafe")
-
-
-# set the suggest cafe database model
-class Suggest(db.Model):
-    __tablename__ = "suggest"
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(250), nullable=False)
-    map_url = db.Column(db.String(500), nullable=False)
-    latitude = db.Column(db.Float, nullable=False)
-    longitude = db.Column(db.Float, nullable=False)
-    img_url = db.Column(db.String(500), nullable=False)
-    country = db.Column(db.String(250), nullable=False)
-    city = db.Column(db.String(250), nullable=False)
-    location = db.Column(db.String(250), nullable=False)
-    description = db.Column(db.String(250), nullable=False)
-    seats = db.Column(db.Integer, nullable=False)
-    coffee_price = db.Column(db.Float, nullable=False)
-    rating = db.Column(db.Integer, nullable=False)
-    has_toilet = db.Column(db.Boolean, nullable=False)
-    has_wifi = db.Column(db.Boolean, nullable=False)
-    has_sockets = db.Column(db.Boolean, nullable=False)
-    can_take_calls = db.Column(db.Boolean, nullable=False)
-    can_pay_with_card = db.Column(db.Boolean, nullable=False)
-
-
-# set the user database model
-class User(UserMixin, db.Model):
-    __tablename__ = "users"
-    id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(100), nullable=False, unique=True)
-    nickname = db.Column(db.String(100), nullable=False, unique=True)
-    password = db.Column(db.String(100), nullable=False)
-    comments = relationship("Comment", back_populates="comment_author")
-
-    # set token for reset user password
-    def get_token(self, expires_sec=300):
-        serial = Serializer(app.config['SECRET_KEY'], expires_in=expires_sec)
-        return serial.dumps({"user_id": self.id}).decode("utf-8")
-
-    # verify token for sercure reset password
-    @staticmethod
-    def verify_token(token):
-        serial = Serializer(app.config['SECRET_KEY'])
+# importing this module sets nothing up, create_app makes the app, e.g. "FLASK_APP=main flask db-upgrade" or
+# "gunicorn 'main:create_app()'", see preload for gunicorn --preload
+
+logger = logging.getLogger(__name__)
+
+
+# the settings of the app, read from the environment when the app is made
+def configure(app):
+    # database url, pool, replica and sqlite pragmas come from the environment, see database.py
+    app.config.update(database_config())
+    app.config['SECRET_KEY'] = '8BYkEfBA6O6donzWlSihBXox7C0sKR6b'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JSON_AS_ASCII'] = False
+    # number of cafe cards rendered per page, the rest is loaded on scroll
+    app.config['CAFES_PER_PAGE'] = 24
+    # number of reviews shown at once on the cafe information page
+    app.config['COMMENTS_PER_PAGE'] = 20
+    # rows per page of the admin user and suggestion tables
+    app.config['ADMIN_ROWS_PER_PAGE'] = 50
+    # rendered cafe cards and info blocks kept in memory, set FRAGMENT_CACHE_DIR to share them between workers
+    app.config['FRAGMENT_CACHE_SIZE'] = 4096
+    app.config['FRAGMENT_CACHE_DIR'] = os.environ.get("FRAGMENT_CACHE_DIR")
+    # default and maximum page size of the json api, and the number of list responses kept in memory
+    app.config['API_PAGE_SIZE'] = 100
+    app.config['API_MAX_PAGE_SIZE'] = 1000
+    app.config['API_CACHE_SIZE'] = 256
+    # maximum number of cafes returned by the search
+    app.config['SEARCH_RESULTS'] = 48
+    # default and maximum radius (km) and number of cafes of the nearby search
+    app.config['NEARBY_RADIUS'] = 2.0
+    app.config['NEARBY_MAX_RADIUS'] = 50.0
+    app.config['NEARBY_RESULTS'] = 12
+    app.config['NEARBY_MAX_RESULTS'] = 100
+    # weights of the cafe rating, run "flask recompute-ratings" after changing them
+    app.config['RATING_MODEL'] = DEFAULT_RATING_MODEL
+    # statements slower than this are logged with the line that ran them, PROFILE_TOKEN enables "X-Profile: <token>"
+    # and METRICS_TOKEN protects /metrics with "Authorization: Bearer <token>"
+    app.config['SLOW_QUERY_SECONDS'] = float(os.environ.get("SLOW_QUERY_SECONDS", 0.25))
+    app.config['PROFILE_TOKEN'] = os.environ.get("PROFILE_TOKEN")
+    app.config['METRICS_TOKEN'] = os.environ.get("METRICS_TOKEN")
+    # the css and js bundles of the site pages, run "flask build-assets" to build them with the fingerprinted static
+    # files, set USE_X_SENDFILE when a front server (nginx, apache) should send the static files
+    app.config['ASSET_BUNDLES'] = {
+        "bundles/site.css": ["vendor/bootstrap/css/bootstrap.min.css", "assets/css/templatemo-style.css",
+                             "assets/css/owl.css", "assets/css/lightbox.css"],
+        "bundles/site.js": ["vendor/jquery/jquery.min.js", "vendor/bootstrap/js/bootstrap.bundle.min.js",
+                            "assets/js/isotope.min.js", "assets/js/owl-carousel.js", "assets/js/lightbox.js",
+                            "assets/js/custom.js"],
+    }
+    app.config['USE_X_SENDFILE'] = os.environ.get("USE_X_SENDFILE") == "1"
+    # the version of the deployed code and templates, e.g. the git commit, part of the ETag of every page and of the
+    # key of every cached fragment
+    app.config['RELEASE'] = os.environ.get("RELEASE", "")
+    # local thumbnails of the cafe images (needs Pillow), kept in THUMBNAIL_DIR up to THUMBNAIL_CACHE_BYTES
+    app.config['THUMBNAIL_DIR'] = os.environ.get("THUMBNAIL_DIR", os.path.join(app.instance_path, "thumbnails"))
+    app.config['THUMBNAIL_CACHE_BYTES'] = int(os.environ.get("THUMBNAIL_CACHE_BYTES", 512 * 1024 * 1024))
+    app.config['THUMBNAIL_WIDTHS'] = (320, 640, 1280)
+    app.config['THUMBNAIL_FETCH_TIMEOUT'] = float(os.environ.get("THUMBNAIL_FETCH_TIMEOUT", 10))
+    app.config['THUMBNAIL_FETCH_WORKERS'] = 4
+    # set PRELOAD=1 with gunicorn --preload, the workers are forked with the templates and indexes loaded
+    app.config['PRELOAD'] = os.environ.get("PRELOAD") == "1"
+
+    # set smpt email server, you have to set your smtp address, email address, and password (or the MAIL_* variables)
+    app.config["MAIL_SERVER"] = os.environ.get("MAIL_SERVER", "YOUR EMAIL SERVICE SMTP ADDRESS")
+    app.config["MAIL_PORT"] = int(os.environ.get("MAIL_PORT", 587))
+    app.config["MAIL_USE_TLS"] = os.environ.get("MAIL_USE_TLS", "1") == "1"
+    app.config["MAIL_USERNAME"] = os.environ.get("MAIL_USERNAME", "YOUR EMAIL ADDRESS")
+    app.config["MAIL_PASSWORD"] = os.environ.get("MAIL_PASSWORD", "YOUR PASSWORD")
+    # queued mails are sent by background workers, in the web process or with "flask send-mail"
+    app.config["MAIL_QUEUE_IN_PROCESS"] = os.environ.get("MAIL_QUEUE_IN_PROCESS", "1") == "1"
+    app.config["MAIL_QUEUE_WORKERS"] = int(os.environ.get("MAIL_QUEUE_WORKERS", 1))
+    app.config["MAIL_QUEUE_BATCH_SIZE"] = 20
+    app.config["MAIL_QUEUE_MAX_ATTEMPTS"] = 6
+    app.config["MAIL_QUEUE_BACKOFF"] = 30
+    app.config["MAIL_QUEUE_RATE"] = float(os.environ.get("MAIL_QUEUE_RATE", 5))
+
+    # set password hashing, "scrypt" or "argon2" (needs argon2-cffi), hashes with other parameters are upgraded on login
+    app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+    app.config["PASSWORD_SCRYPT_N"] = int(os.environ.get("PASSWORD_SCRYPT_N", 2 ** 15))
+    app.config["PASSWORD_SCRYPT_R"] = int(os.environ.get("PASSWORD_SCRYPT_R", 8))
+    app.config["PASSWORD_SCRYPT_P"] = int(os.environ.get("PASSWORD_SCRYPT_P", 1))
+    app.config["PASSWORD_ARGON2_TIME_COST"] = int(os.environ.get("PASSWORD_ARGON2_TIME_COST", 3))
+    app.config["PASSWORD_ARGON2_MEMORY_COST"] = int(os.environ.get("PASSWORD_ARGON2_MEMORY_COST", 65536))
+    # processes hashing passwords, 0 hashes on the request thread
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.environ.get("PASSWORD_HASH_WORKERS",
+                                                             max(1, (os.cpu_count() or 2) // 2)))
+
+    # logged in users are cached between requests, the user versions in USER_CACHE_DIR tell every worker of the host
+    # about a change, an empty USER_CACHE_DIR keeps them in memory, which is only right with a single worker
+    # a cached user reads its version file at most every USER_CACHE_CHECK_SECONDS, the other workers see a change
+    # within that time
+    app.config["USER_CACHE_TTL"] = int(os.environ.get("USER_CACHE_TTL", 300))
+    app.config["USER_CACHE_SIZE"] = int(os.environ.get("USER_CACHE_SIZE", 10000))
+    app.config["USER_CACHE_DIR"] = os.environ.get("USER_CACHE_DIR",
+                                                  os.path.join(app.instance_path, "user_versions")) or None
+    app.config["USER_CACHE_CHECK_SECONDS"] = float(os.environ.get("USER_CACHE_CHECK_SECONDS", 1))
+
+
+# bind the extensions to the app and make its services from the settings, nothing connects to the database or
+# starts a thread or a process here, that happens on first use
+def init_extensions(app):
+    config = app.config
+    instrument(app, metrics, slow_query_seconds=config['SLOW_QUERY_SECONDS'], profile_token=config['PROFILE_TOKEN'])
+    db.init_app(app)
+    bootstrap.init_app(app)
+    mail.init_app(app)
+    gravatar.init_app(app)
+    login_manager.init_app(app)
+    app.extensions[SERVICES] = {
+        "assets": Assets(app, config['ASSET_BUNDLES']),
+        "thumbnails": ThumbnailCache(
+            config['THUMBNAIL_DIR'], http_fetcher(timeout=config['THUMBNAIL_FETCH_TIMEOUT']),
+            widths=config['THUMBNAIL_WIDTHS'], max_bytes=config['THUMBNAIL_CACHE_BYTES'],
+            workers=config['THUMBNAIL_FETCH_WORKERS']),
+        "password_hasher": PasswordHasher(
+            method=config["PASSWORD_HASH_METHOD"], scrypt_n=config["PASSWORD_SCRYPT_N"],
+            scrypt_r=config["PASSWORD_SCRYPT_R"], scrypt_p=config["PASSWORD_SCRYPT_P"],
+            argon2_time_cost=config["PASSWORD_ARGON2_TIME_COST"],
+            argon2_memory_cost=config["PASSWORD_ARGON2_MEMORY_COST"], workers=config["PASSWORD_HASH_WORKERS"]),
+        "user_cache": UserCache(ttl=config["USER_CACHE_TTL"], maxsize=config["USER_CACHE_SIZE"],
+                                directory=config["USER_CACHE_DIR"],
+                                check_interval=config["USER_CACHE_CHECK_SECONDS"]),
+        # country -> city facets for the /cities route, read from the (country, city) index only
+        "facet_index": FacetIndex(
+            lambda: db.session.query(Cafe.country, Cafe.city, func.count(Cafe.id))
+            .group_by(Cafe.country, Cafe.city).all()),
+        # the rating histograms of the listing pages
+        "rating_histograms": RatingHistograms(rating_counts),
+        # amenity, place, seats and price bitmaps for the /filter route
+        "amenity_index": AmenityIndex(
+            lambda: (row._asdict() for row in db.session.query(*[getattr(Cafe, name) for name in AMENITY_COLUMNS]))),
+        # background sender of the outbox
+        "mail_dispatcher": MailDispatcher(
+            db.get_engine(app), OutboxMail.__table__, connect=mail_connection, context=app.app_context,
+            build_message=outbox_message, workers=config["MAIL_QUEUE_WORKERS"],
+            batch_size=config["MAIL_QUEUE_BATCH_SIZE"], max_attempts=config["MAIL_QUEUE_MAX_ATTEMPTS"],
+            backoff=config["MAIL_QUEUE_BACKOFF"], rate=config["MAIL_QUEUE_RATE"]),
+        # rendered cafe fragments, keyed by cafe id, row version and release
+        "fragment_cache": FragmentCache(maxsize=config['FRAGMENT_CACHE_SIZE'], directory=config['FRAGMENT_CACHE_DIR']),
+        "api_cache": ResponseCache(maxsize=config['API_CACHE_SIZE']),
+    }
+
+
+# request metrics of this worker in the prometheus text format
+def metrics_endpoint():
+    token = current_app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return abort(401)
+    response = make_response(metrics.render())
+    response.mimetype = "text/plain; version=0.0.4"
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+# with gunicorn --preload the app is made once in the master and the workers are forked from it, the templates are
+# compiled and the in-memory indexes loaded here so that every worker starts with them instead of paying for them on
+# its first requests, the connections this opened are closed before the fork
+def preload(app):
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(name)
+    with app.app_context():
         try:
-            user_id = serial.loads(token)["user_id"]
-        except:
-            return None
-        return User.query.get(user_id)
-
-
-# set the comment database model
-class Comment(db.Model):
-    __tablename__ = "comments"
-    id = db.Column(db.Integer, primary_key=True)
-    cafe_id = db.Column(db.Integer, db.ForeignKey("cafe.id"))
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
-    parent_cafe = relationship("Cafe", back_populates="comments")
-    comment_author = relationship("User", back_populates="comments")
-    text = db.Column(db.Text, nullable=False)
-    date = db.Column(db.Text, nullable=False)
-
-
-# create sql database
-db.create_all()
-
-# -------------------------------------------- FUNCTIONS ----------------------------------------------------------- #
-
-
-# forgot password function, send password reset link to the user
-def send_mail(user):
-    token = user.get_token()
-    msg = Message("Password reset request", recipients=[user.email], sender=EMAIL)
-    msg.body = f''' To reset your password, please follow the link below.
-    {url_for('reset_token', token=token, _external=True)}
-    If you don't send a password reset request, please ignore this message.
-'''
-    mail.send(msg)
-
-
-# manage and calculate the cafe rating
-def rating_calculator(seats, has_wifi, has_toilet, has_sockets, can_take_calls, can_pay_with_card):
-    rating = 0
-    if seats >= 30:
-        rating += 3
-    elif seats >= 10:
-        rating += 2
-    else:
-        rating += 1
-    if has_wifi:
-        rating += 2
-    if has_toilet:
-        rating += 2
-    if has_sockets:
-        rating += 1
-    if can_take_calls:
-        rating += 1
-    if can_pay_with_card:
-        rating += 1
-    return rating
-
-
-# ---------------------------------------------------- SET ALL ROUTES --------------------------------------------- #
-# set the admin only route
-def admin_only(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if current_user.id != 1:
-            return abort(403)
-        return f(*args, **kwargs)
-
-    return decorated_function
-
-
-# set the home page route
-@app.route("/")
-def home():
-    # render index.html and all cafes from database
-    all_cafes = Cafe.query.order_by(Cafe.rating.desc()).all()
-    return render_template('index.html', year=current_user, current_user=current_user, all_cafes=all_cafes)
-
-
-# set the filter route
-@app.route("/sorted/<string:id>")
-def sorted_cafe(id):
-    # filter cafes by city
-    filtered = Cafe.query.filter_by(city=id).order_by(Cafe.rating.desc())
-    return render_template('index.html', current_user=current_user, all_cafes=filtered, year=current_user)
-
-
-# set the city filter route
-@app.route("/cities", methods=["POST", "GET"])
-def cities():
-    country_list = []
-    city_list = []
-    countries = Cafe.query.all()
-    # show all cities in the database
-    for i in countries:
-        if i.country not in country_list:
-            country_list.append(i.country)
-    if request.method == "POST":
-        country = request.form.get("gender")
-        city_list_raw = Cafe.query.filter_by(country=country)
-        for i in city_list_raw:
-            if i.city not in city_list:
-                city_list.append(i.city)
-        city_list.sort()
-        return render_template('cities.html', country_list=country_list, city_list=city_list,
-                               current_user=current_user, year=current_user)
-
-    return render_template('cities.html', country_list=country_list, city_list=city_list,
-                           current_user=current_user, year=current_user)
-
-
-# set the add new cafe route, only for admin
-@app.route("/add", methods=["POST", "GET"])
-@admin_only
-def add():
-    # add new cafe, get all data from the form
-    if request.method == "POST":
-        seats = int(request.form.get("seats"))
-        has_wifi = bool(request.form.get("has_wifi"))
-        has_toilet = bool(request.form.get("has_toilet"))
-        has_sockets = bool(request.form.get("has_sockets"))
-        can_take_calls = bool(request.form.get("can_take_calls"))
-        can_pay_with_card = bool(request.form.get("can_pay_with_card"))
-        rating = rating_calculator(seats, has_wifi, has_toilet, has_sockets, can_take_calls, can_pay_with_card)
-        new_coffee = Cafe(
-            name=request.form.get("name"),
-            map_url=request.form.get("map_url"),
-            latitude=request.form.get("latitude"),
-            longitude=request.form.get("longitude"),
-            img_url=request.form.get("img_url"),
-            city=request.form.get("city"),
-            country=request.form.get("country"),
-            location=request.form.get("location"),
-            description=request.form.get("description"),
-            seats=seats,
-            has_toilet=has_toilet,
-            has_wifi=has_wifi,
-            has_sockets=has_sockets,
-            can_take_calls=can_take_calls,
-            coffee_price=request.form.get("coffee_price"),
-            can_pay_with_card=can_pay_with_card,
-            rating=rating
-        )
-        db.session.add(new_coffee)
-        db.session.commit()
-        return redirect(url_for("home"))
-    return render_template("add.html", current_user=current_user, year=current_user)
-
-
-# set the suggest cafe route
-@app.route("/suggest", methods=["POST", "GET"])
-def suggest():
-    # add new cafe suggestion, get all data from the form
-    if request.method == "POST":
-        seats = int(request.form.get("seats"))
-        has_wifi = bool(request.form.get("has_wifi"))
-        has_toilet = bool(request.form.get("has_toilet"))
-        has_sockets = bool(request.form.get("has_sockets"))
-        can_take_calls = bool(request.form.get("can_take_calls"))
-        can_pay_with_card = bool(request.form.get("can_pay_with_card"))
-        rating = rating_calculator(seats, has_wifi, has_toilet, has_sockets, can_take_calls, can_pay_with_card)
-        new_coffee = Suggest(
-            name=request.form.get("name"),
-            map_url=request.form.get("map_url"),
-            latitude=request.form.get("latitude"),
-            longitude=request.form.get("longitude"),
-            img_url=request.form.get("img_url"),
-            city=request.form.get("city"),
-            country=request.form.get("country"),
-            location=request.form.get("location"),
-            description=request.form.get("description"),
-            seats=seats,
-            has_toilet=has_toilet,
-            has_wifi=has_wifi,
-            has_sockets=has_sockets,
-            can_take_calls=can_take_calls,
-            coffee_price=request.form.get("coffee_price"),
-            can_pay_with_card=can_pay_with_card,
-            rating=rating
-        )
-        db.session.add(new_coffee)
-        db.session.commit()
-        return redirect(url_for("home"))
-    return render_template("suggest.html", current_user=current_user, year=current_user)
-
-
-# view suggested cafes, only for admin
-@app.route("/suggested")
-@admin_only
-def suggested():
-    # show all suggested cafes
-    all_cafe = Suggest.query.all()
-    return render_template('cafe_database.html', all_cafe=all_cafe, year=current_user)
-
-
-# accept suggested cafes, only for admin
-@app.route("/edit/<string:id>", methods=["POST", "GET"])
-@admin_only
-def edit_suggested(id):
-    if request.method == "POST":
-        name = request.form.get("name")
-        # check if suggested cafe already exist
-        if Cafe.query.filter_by(name=name).first():
-            flash('This cafe already exist')
-        else:
-            seats = int(request.form.get("seats"))
-            has_wifi = bool(request.form.get("has_wifi"))
-            has_toilet = bool(request.form.get("has_toilet"))
-            has_sockets = bool(request.form.get("has_sockets"))
-            can_take_calls = bool(request.form.get("can_take_calls"))
-            can_pay_with_card = bool(request.form.get("can_pay_with_card"))
-            rating = rating_calculator(seats, has_wifi, has_toilet, has_sockets, can_take_calls, can_pay_with_card)
-            new_coffee = Cafe(
-                name=name,
-                map_url=request.form.get("map_url"),
-                latitude=request.form.get("latitude"),
-                longitude=request.form.get("longitude"),
-                img_url=request.form.get("img_url"),
-                city=request.form.get("city"),
-                country=request.form.get("country"),
-                location=request.form.get("location"),
-                description=request.form.get("description"),
-                seats=seats,
-                has_toilet=has_toilet,
-                has_wifi=has_wifi,
-                has_sockets=has_sockets,
-                can_take_calls=can_take_calls,
-                coffee_price=request.form.get("coffee_price"),
-                can_pay_with_card=can_pay_with_card,
-                rating=rating
-            )
-            db.session.add(new_coffee)
-            db.session.commit()
-            return redirect(url_for("delete_suggested", id=id))
-    this_cafe = Suggest.query.get(id)
-    return render_template("edit_suggested.html", this_cafe=this_cafe, current_user=current_user, year=current_user)
-
-
-# delete suggested cafe, only for admin
-@app.route("/delete_suggested/<string:id>")
-@admin_only
-def delete_suggested(id):
-    # get the cafe by id, and delete
-    this_cafe = Suggest.query.get(id)
-    db.session.delete(this_cafe)
-    db.session.commit()
-    return redirect(url_for("suggested"))
-
-
-# view users, only for admin
-@app.route("/user_database")
-@admin_only
-def user_database():
-    all_users = User.query.all()
-    return render_template('user_database.html', all_users=all_users, year=current_user)
-
-
-# delete users, only for admin
-@app.route("/delete_user/<string:id>")
-@admin_only
-def delete_user(id):
-    # find the user by id, and delete, if the id is not 1, because 1 is admin
-    if id != str(1):
-        user_comments = Comment.query.filter_by(author_id=id).all()
-        selected_user = User.query.get(id)
-        db.session.delete(selected_user)
-        for i in user_comments:
-            db.session.delete(i)
-            db.session.commit()
-        db.session.commit()
-    else:
-        return redirect(url_for("user_database"))
-    return redirect(url_for("user_database"))
-
-
-# delete cafe, only for admin
-@app.route("/delete/<string:id>")
-@admin_only
-def delete(id):
-    # find the cafe by id, and delete
-    this_cafe = Cafe.query.get(id)
-    db.session.delete(this_cafe)
-    db.session.commit()
-    return redirect(url_for("home"))
-
-
-# edit cafe, only for admin
-@app.route("/edit/<string:id>", methods=["POST", "GET"])
-@admin_only
-def edit(id):
-    # find the cafe by id, and edit
-    if request.method == "POST":
-        cafe_to_update = Cafe.query.filter_by(id=id).first()
-        has_toilet = bool(request.form.get("has_toilet"))
-        has_wifi = bool(request.form.get("has_wifi"))
-        has_sockets = bool(request.form.get("has_sockets"))
-        can_take_calls = bool(request.form.get("can_take_calls"))
-        can_pay_with_card = bool(request.form.get("can_pay_with_card"))
-        seats = int(request.form.get("seats"))
-        rating = rating_calculator(seats, has_wifi, has_toilet, has_sockets, can_take_calls, can_pay_with_card)
-        cafe_to_update.has_toilet = has_toilet
-        cafe_to_update.has_wifi = has_wifi
-        cafe_to_update.has_sockets = has_sockets
-        cafe_to_update.can_take_calls = can_take_calls
-        cafe_to_update.can_pay_with_card = can_pay_with_card
-        cafe_to_update.seats = seats
-        cafe_to_update.name = request.form.get("name")
-        cafe_to_update.map_url = request.form.get("map_url")
-        cafe_to_update.longitude = request.form.get("longitude")
-        cafe_to_update.latitude = request.form.get("latitude")
-        cafe_to_update.img_url = request.form.get("img_url")
-        cafe_to_update.location = request.form.get("location")
-        cafe_to_update.city = request.form.get("city")
-        cafe_to_update.country = request.form.get("country")
-        cafe_to_update.description = request.form.get("description")
-        cafe_to_update.coffee_price = request.form.get("coffee_price")
-        cafe_to_update.rating = rating
-        db.session.commit()
-        return redirect(url_for("info", id=cafe_to_update.id))
-    this_cafe = Cafe.query.get(id)
-    return render_template("edit.html", this_cafe=this_cafe, current_user=current_user, year=current_user)
-
-
-# view cafe information
-@app.route("/info/<string:id>", methods=["POST", "GET"])
-def info(id):
-    # find the cafe by id, and show details, comments
-    this_cafe = Cafe.query.get(id)
-    comments = Comment.query.filter_by(cafe_id=this_cafe.id)
-    if request.method == "POST":
-        new_comment = Comment(
-            cafe_id=this_cafe.id,
-            author_id=current_user.id,
-            text=request.form.get("message"),
-            date=date.today().strftime("%B %d, %Y")
-        )
-        db.session.add(new_comment)
-        db.session.commit()
-    return render_template("info.html", this_cafe=this_cafe, comments=comments,
-                           current_user=current_user, year=current_user)
-
-
-# login or register route
-@app.route('/login-register', methods=["POST", "GET"])
-def login_register():
-    form = LoginRegisterForm()
-    if form.validate_on_submit():
-        email = form.email.data
-        # check if user is registered, and redirect the corresponding page
-        if User.query.filter_by(email=email).first():
-            return redirect(url_for("login", id=email))
-        else:
-            return redirect(url_for("register", id=email))
-    return render_template("login-register.html", form=form, current_user=current_user, year=current_user)
-
-
-# login route
-@app.route('/login/<string:id>', methods=["POST", "GET"])
-def login(id):
-    form = LoginForm()
-    form.email.data = id
-    if form.validate_on_submit():
-        email = form.email.data
-        password = form.password.data
-        # check if email exists
-        if User.query.filter_by(email=email).first():
-            user = User.query.filter_by(email=email).first()
-            # check the password with flask build in function
-            if check_password_hash(user.password, password) and user.email == email:
-                login_user(user)
-                return redirect(url_for("home"))
-            else:
-                flash('Password incorrect, please try again.')
-                return redirect(url_for('login', id=email))
-        else:
-            flash("That email does not exist, please try again.")
-            return redirect(url_for('login'))
-    return render_template("login.html", form=form, current_user=current_user, year=current_user)
-
-
-# register route
-@app.route("/register/<string:id>", methods=["POST", "GET"])
-def register(id):
-    form = RegisterForm()
-    form.email.data = id
-    if form.validate_on_submit():
-        nickname = form.nickname.data
-        if User.query.filter_by(nickname=nickname).first():
-            flash("Nickname already exist")
-        else:
-            # check if 2 passwords matches and hashing the password
-            if form.password.data == form.password_check.data:
-                hash_and_salted_password = generate_password_hash(
-                    form.password.data,
-                    method='pbkdf2:sha256',
-                    salt_length=8
-                )
-                # create new user
-                new_user = User(
-                    email=form.email.data,
-                    password=hash_and_salted_password,
-                    nickname=form.nickname.data
-
-                )
-                db.session.add(new_user)
-                db.session.commit()
-                login_user(new_user)
-                return redirect(url_for("home"))
-            else:
-                flash("The passwords do not match")
-    return render_template("register.html", form=form, current_user=current_user, year=current_user)
-
-
-# logut route
-@app.route('/logout')
-def logout():
-    logout_user()
-    return redirect(url_for('home'))
-
-
-# forgot password route
-@app.route("/forgot", methods=["POST", "GET"])
-def forgot():
-    form = ForgotPasswordForm()
-    if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
-        if user:
-            send_mail(user)
-            return redirect(url_for("home"))
-    return render_template("forgot.html", form=form, year=current_user)
-
-
-# forgot password reset token, for validation
-@app.route("/forgot/<token>", methods=["POST", "GET"])
-def reset_token(token):
-    user = User.verify_token(token)
-    if user is None:
-        flash("That is invalid token or expired.")
-        return redirect(url_for("forgot"))
-    form = ResetPasswordForm()
-    if form.validate_on_submit():
-        if form.password.data == form.password_check.data:
-            hash_and_salted_password = generate_password_hash(
-                form.password.data,
-                method='pbkdf2:sha256',
-                salt_length=8
-            )
-            user.password = hash_and_salted_password
-            db.session.commit()
-            flash("Password changed successfully, please login")
-            return redirect(url_for("login", id=user.email))
-    return render_template("reset_password.html", form=form, current_user=current_user, year=current_user)
+            version = Catalogue.query.get(1).version
+            facet_index.sync(version)
+            facet_index.countries()
+            amenity_index.sync(version)
+            amenity_index.cities()
+        except SQLAlchemyError as error:
+            # e.g. before the first "flask db-upgrade", the workers load the indexes themselves
+            logger.warning("the indexes are not preloaded: %s", error)
+        finally:
+            db.session.remove()
+    db.dispose_engines(app)
+
+
+# make the app, config overrides the settings of the environment, e.g. in tests and benchmarks
+def create_app(config=None):
+    app = Flask(__name__)
+    configure(app)
+    if config is not None:
+        app.config.update(config)
+    init_extensions(app)
+    for blueprint in (pages, api_v1, admin, accounts):
+        app.register_blueprint(blueprint)
+    app.add_url_rule("/metrics", "metrics_endpoint", metrics_endpoint)
+    for command in COMMANDS:
+        app.cli.add_command(command)
+    if app.config['PRELOAD']:
+        preload(app)
+    return app
 
 
 # start the app
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
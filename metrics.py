@@ -0,0 +1,248 @@
+import bisect
+import cProfile
+import hmac
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from flask import Response, current_app, g, has_app_context, has_request_context, request
+from flask.signals import signals_available, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# request level instrumentation, exposed in the prometheus text format
+# per route: latency, number of sql statements and the time spent in them, template render time, plus the time of
+# named sections like password hashing, the slow statements are logged with the line of the app that ran them
+# the numbers are per process, every worker serves its own /metrics
+
+logger = logging.getLogger(__name__)
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENTS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+HISTOGRAMS = {
+    "cafe_request_duration_seconds": ("Request latency by route.", SECONDS),
+    "cafe_request_sql_statements": ("SQL statements per request by route.", STATEMENTS),
+    "cafe_request_sql_duration_seconds": ("Time spent in SQL per request by route.", SECONDS),
+    "cafe_request_template_duration_seconds": ("Time spent rendering templates per request by route.", SECONDS),
+    "cafe_template_render_duration_seconds": ("Render time by template, nested templates included.", SECONDS),
+    "cafe_section_duration_seconds": ("Time spent in named sections like password hashing.", SECONDS),
+}
+COUNTERS = {
+    "cafe_slow_queries_total": "SQL statements slower than the slow query threshold by route.",
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def label_text(labels):
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+               for name, value in labels]
+    return ",".join(f'{name}="{value}"' for name, value in escaped)
+
+
+class Metrics:
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    # labels is a tuple of (name, value) pairs
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = Histogram(HISTOGRAMS[name][1])
+            histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + amount
+
+    # time the block as a named section, inside a request it also counts for the request's profile
+    @contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("cafe_section_duration_seconds", (("section", name),), elapsed)
+            if has_request_context() and "metrics" in g:
+                g.metrics["sections"][name] = g.metrics["sections"].get(name, 0.0) + elapsed
+
+    # the function with every call timed as a named section
+    def timed(self, name, function):
+        def timed_function(*args, **kwargs):
+            with self.section(name):
+                return function(*args, **kwargs)
+
+        return timed_function
+
+    # {labels: (count, sum)} of a histogram, e.g. for comparing two points in time
+    def totals(self, name):
+        with self._lock:
+            return {labels: (sum(histogram.counts), histogram.sum)
+                    for (metric, labels), histogram in self._histograms.items() if metric == name}
+
+    # everything in the prometheus text exposition format
+    def render(self):
+        with self._lock:
+            histograms = sorted((key, histogram.counts[:], histogram.sum) for key, histogram in self._histograms.items())
+            counters = sorted(self._counters.items())
+        lines = []
+        for name, (description, buckets) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), counts, total in histograms:
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ["+Inf"], counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{{{label_text(labels + (('le', bound),))}}} {cumulative}")
+                lines.append(f"{name}_sum{{{label_text(labels)}}} {total}")
+                lines.append(f"{name}_count{{{label_text(labels)}}} {cumulative}")
+        for name, description in COUNTERS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in counters:
+                if metric == name:
+                    lines.append(f"{name}{{{label_text(labels)}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# the first frame of the application that led to the statement, e.g. "pages.py:112 in cafe_page"
+def caller(root):
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(root) and "site-packages" not in filename \
+                and filename != os.path.abspath(__file__):
+            return f"{os.path.relpath(filename, root)}:{frame.lineno} in {frame.name}"
+    return "unknown"
+
+
+def endpoint_label():
+    return request.url_rule.endpoint if request.url_rule is not None else "unmatched"
+
+
+# the sql statements of every engine are timed once per process, the slow ones are counted and logged with the
+# settings of the app that ran them
+def start_statement(connection, cursor, statement, parameters, context, executemany):
+    context.metrics_start = time.perf_counter()
+
+
+def end_statement(connection, cursor, statement, parameters, context, executemany):
+    if not has_app_context() or "metrics" not in current_app.extensions:
+        return
+    metrics, slow_query_seconds, root = current_app.extensions["metrics"]
+    elapsed = time.perf_counter() - context.metrics_start
+    in_request = has_request_context() and "metrics" in g
+    if in_request:
+        g.metrics["statements"] += 1
+        g.metrics["sql"] += elapsed
+    if elapsed >= slow_query_seconds:
+        endpoint = endpoint_label() if in_request else "none"
+        metrics.inc("cafe_slow_queries_total", (("endpoint", endpoint),))
+        logger.warning("slow query %.3fs in %s from %s: %s", elapsed, endpoint, caller(root),
+                       " ".join(statement.split()))
+
+
+# hook the instrumentation into the app and every engine
+# statements slower than slow_query_seconds are logged, a request with the header "X-Profile: <profile_token>" is
+# run under cProfile and answered with the report instead of the page
+def instrument(app, metrics, slow_query_seconds=0.25, profile_token=None):
+    app.extensions["metrics"] = (metrics, slow_query_seconds, os.path.abspath(app.root_path))
+    if not event.contains(Engine, "after_cursor_execute", end_statement):
+        event.listen(Engine, "before_cursor_execute", start_statement)
+        event.listen(Engine, "after_cursor_execute", end_statement)
+
+    if signals_available:
+        # templates render inside each other (the cafe cards inside the listing), only the outermost counts for the
+        # request
+        @before_render_template.connect_via(app)
+        def start_template(sender, template, context, **extra):
+            if "metrics" in g:
+                g.metrics["templates"].append(time.perf_counter())
+
+        @template_rendered.connect_via(app)
+        def end_template(sender, template, context, **extra):
+            if "metrics" not in g or not g.metrics["templates"]:
+                return
+            elapsed = time.perf_counter() - g.metrics["templates"].pop()
+            metrics.observe("cafe_template_render_duration_seconds", (("template", template.name),), elapsed)
+            if not g.metrics["templates"]:
+                g.metrics["template"] += elapsed
+
+    @app.before_request
+    def start_request():
+        g.metrics = {"start": time.perf_counter(), "statements": 0, "sql": 0.0, "templates": [], "template": 0.0,
+                     "sections": {}, "status": 500}
+        header = request.headers.get("X-Profile")
+        if profile_token and header and hmac.compare_digest(header, profile_token):
+            g.metrics["profiler"] = cProfile.Profile()
+            g.metrics["profiler"].enable()
+
+    @app.after_request
+    def end_request(response):
+        if "metrics" not in g:
+            return response
+        g.metrics["status"] = response.status_code
+        profiler = g.metrics.pop("profiler", None)
+        if profiler is None:
+            return response
+        profiler.disable()
+        report = profile_report(g.metrics, profiler, response)
+        profiled = Response(report, status=response.status_code, mimetype="text/plain")
+        profiled.headers["Server-Timing"] = server_timing(g.metrics)
+        profiled.headers["Cache-Control"] = "no-store"
+        return profiled
+
+    @app.teardown_request
+    def record_request(error=None):
+        if "metrics" not in g:
+            return
+        measured = g.pop("metrics")
+        endpoint = endpoint_label()
+        labels = (("endpoint", endpoint),)
+        metrics.observe("cafe_request_duration_seconds",
+                        labels + (("method", request.method), ("status", measured["status"])),
+                        time.perf_counter() - measured["start"])
+        metrics.observe("cafe_request_sql_statements", labels, measured["statements"])
+        metrics.observe("cafe_request_sql_duration_seconds", labels, measured["sql"])
+        metrics.observe("cafe_request_template_duration_seconds", labels, measured["template"])
+
+
+def server_timing(measured):
+    entries = [f'sql;dur={measured["sql"] * 1000:.1f};desc="{measured["statements"]} statements"',
+               f'template;dur={measured["template"] * 1000:.1f}']
+    entries += [f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in measured["sections"].items()]
+    entries.append(f'total;dur={(time.perf_counter() - measured["start"]) * 1000:.1f}')
+    return ", ".join(entries)
+
+
+def profile_report(measured, profiler, response):
+    output = io.StringIO()
+    output.write(f"{request.method} {request.full_path} -> {response.status}\n")
+    output.write(f"total {(time.perf_counter() - measured['start']) * 1000:.1f} ms, "
+                 f"sql {measured['sql'] * 1000:.1f} ms in {measured['statements']} statements, "
+                 f"templates {measured['template'] * 1000:.1f} ms\n")
+    for name, elapsed in measured["sections"].items():
+        output.write(f"{name} {elapsed * 1000:.1f} ms\n")
+    output.write("\n")
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(40)
+    return output.getvalue()
@@ -0,0 +1,262 @@
+from datetime import datetime
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, MetaData, String, Table, Text, \
+    inspect, select
+from search import create_search_index
+from nearby import create_spatial_index
+
+# versioned schema migrations, run with `flask db-upgrade` after every deploy instead of on every worker start
+# the version of the database is kept in the schema_version table, every step runs in its own transaction together
+# with the version update, so an interrupted upgrade continues where it stopped
+# the steps are idempotent, databases created before the migrations existed start at version 0 and are upgraded too
+# a step never reads the models, it has its own DDL or a copy of the tables as they were when it was released, so it
+# does the same on every database however the models change later
+
+MIGRATIONS = []
+
+schema_version = Table("schema_version", MetaData(), Column("version", Integer, nullable=False))
+
+
+# the tables of schema version 1, a copy of the models as they were then, never change it
+def version_1_tables():
+    metadata = MetaData()
+    Table("cafe", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("name", String(250), unique=True, nullable=False),
+          Column("map_url", String(500), nullable=False),
+          Column("latitude", Float, nullable=False),
+          Column("longitude", Float, nullable=False),
+          Column("img_url", String(500), nullable=False),
+          Column("country", String(250), nullable=False),
+          Column("city", String(250), nullable=False),
+          Column("location", String(250), nullable=False),
+          Column("description", String(250), nullable=False),
+          Column("seats", Integer, nullable=False),
+          Column("coffee_price", Float, nullable=False),
+          Column("rating", Integer, nullable=False),
+          Column("has_toilet", Boolean, nullable=False),
+          Column("has_wifi", Boolean, nullable=False),
+          Column("has_sockets", Boolean, nullable=False),
+          Column("can_take_calls", Boolean, nullable=False),
+          Column("can_pay_with_card", Boolean, nullable=False),
+          Column("version", Integer, nullable=False, server_default="1"),
+          Index("ix_cafe_rating_id", "rating", "id"),
+          Index("ix_cafe_country_city", "country", "city"),
+          Index("ix_cafe_city_rating_id", "city", "rating", "id"))
+    Table("suggest", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("name", String(250), nullable=False),
+          Column("map_url", String(500), nullable=False),
+          Column("latitude", Float, nullable=False),
+          Column("longitude", Float, nullable=False),
+          Column("img_url", String(500), nullable=False),
+          Column("country", String(250), nullable=False),
+          Column("city", String(250), nullable=False),
+          Column("location", String(250), nullable=False),
+          Column("description", String(250), nullable=False),
+          Column("seats", Integer, nullable=False),
+          Column("coffee_price", Float, nullable=False),
+          Column("rating", Integer, nullable=False),
+          Column("has_toilet", Boolean, nullable=False),
+          Column("has_wifi", Boolean, nullable=False),
+          Column("has_sockets", Boolean, nullable=False),
+          Column("can_take_calls", Boolean, nullable=False),
+          Column("can_pay_with_card", Boolean, nullable=False),
+          Index("ix_suggest_name", "name"))
+    Table("users", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("email", String(100), nullable=False, unique=True),
+          Column("nickname", String(100), nullable=False, unique=True),
+          Column("password", String(255), nullable=False))
+    Table("comments", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("cafe_id", Integer, ForeignKey("cafe.id")),
+          Column("author_id", Integer, ForeignKey("users.id")),
+          Column("text", Text, nullable=False),
+          Column("date", Text, nullable=False),
+          Index("ix_comments_cafe_id_id", "cafe_id", "id"),
+          Index("ix_comments_author_id", "author_id"))
+    Table("catalogue", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("version", Integer, nullable=False),
+          Column("updated_at", DateTime, nullable=False))
+    Table("outbox", metadata,
+          Column("id", Integer, primary_key=True),
+          Column("recipient", String(100), nullable=False),
+          Column("subject", String(250), nullable=False),
+          Column("body", Text, nullable=False),
+          Column("status", String(10), nullable=False),
+          Column("attempts", Integer, nullable=False),
+          Column("claim", String(32)),
+          Column("last_error", Text),
+          Column("created_at", DateTime, nullable=False),
+          Column("next_attempt_at", DateTime, nullable=False),
+          Column("sent_at", DateTime),
+          Index("ix_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+          Index("ix_outbox_claim", "claim"))
+    return metadata
+
+
+VERSION_1 = version_1_tables()
+
+
+# register a migration, new ones get the next version number and are never edited once released
+def migration(version, description):
+    def register(function):
+        MIGRATIONS.append((version, description, function))
+        return function
+
+    return register
+
+
+@migration(1, "create the tables")
+def create_tables(connection):
+    VERSION_1.create_all(bind=connection)
+
+
+# add the columns that create_all skips on tables which already exist, new columns need a server default
+@migration(2, "add the row version column and the listing indexes to existing tables")
+def create_missing_columns_and_indexes(connection):
+    inspector = inspect(connection)
+    for table in VERSION_1.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=connection.dialect)
+                default = column.server_default.arg
+                if isinstance(default, str):
+                    default = "'" + default.replace("'", "''") + "'"
+                connection.execute(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} "
+                                   f"NOT NULL DEFAULT {default}")
+    create_missing_indexes(connection, VERSION_1)
+
+
+# the listing of one city, the comments of a user (deleted with the user) and the suggestion names
+# country, rating and comments.cafe_id are the leading columns of ix_cafe_country_city, ix_cafe_rating_id and
+# ix_comments_cafe_id_id already
+@migration(3, "index cafe.city, comments.author_id and suggest.name")
+def create_lookup_indexes(connection):
+    create_missing_indexes(connection, VERSION_1,
+                           ["ix_cafe_city_rating_id", "ix_comments_author_id", "ix_suggest_name"])
+
+
+@migration(4, "create the catalogue row")
+def create_catalogue(connection):
+    catalogue = VERSION_1.tables["catalogue"]
+    if connection.execute(select([catalogue.c.id]).where(catalogue.c.id == 1)).first() is None:
+        connection.execute(catalogue.insert().values(id=1, version=1, updated_at=datetime.utcnow()))
+
+
+@migration(5, "create the full text search index")
+def create_search(connection):
+    create_search_index(connection)
+
+
+@migration(6, "create the spatial index")
+def create_spatial(connection):
+    create_spatial_index(connection)
+
+
+# deleting a cafe used to leave its comments behind
+@migration(7, "delete the comments of deleted cafes and users")
+def delete_orphan_comments(connection):
+    connection.execute("DELETE FROM comments WHERE cafe_id NOT IN (SELECT id FROM cafe) "
+                       "OR author_id NOT IN (SELECT id FROM users)")
+
+
+# a nullable column without a default, released steps are never edited so it gets its own step
+@migration(8, "add the image digest column of the cafe thumbnails")
+def create_image_digest(connection):
+    existing = {column["name"] for column in inspect(connection).get_columns("cafe")}
+    if "image_digest" not in existing:
+        connection.execute("ALTER TABLE cafe ADD COLUMN image_digest VARCHAR(32)")
+
+
+# sqlite gives a new row the highest id + 1, so deleting the newest cafe freed its id for the next one and the (id, row
+# version) of the new cafe could name the deleted one in the fragment caches of other workers and in the ETags of the
+# info page and the api, AUTOINCREMENT never hands out an id twice, other databases never reuse a sequence value
+CAFE_AUTOINCREMENT_TABLE = """
+    CREATE TABLE cafe_autoincrement (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(250) NOT NULL UNIQUE,
+        map_url VARCHAR(500) NOT NULL,
+        latitude FLOAT NOT NULL,
+        longitude FLOAT NOT NULL,
+        img_url VARCHAR(500) NOT NULL,
+        country VARCHAR(250) NOT NULL,
+        city VARCHAR(250) NOT NULL,
+        location VARCHAR(250) NOT NULL,
+        description VARCHAR(250) NOT NULL,
+        seats INTEGER NOT NULL,
+        coffee_price FLOAT NOT NULL,
+        rating INTEGER NOT NULL,
+        has_toilet BOOLEAN NOT NULL,
+        has_wifi BOOLEAN NOT NULL,
+        has_sockets BOOLEAN NOT NULL,
+        can_take_calls BOOLEAN NOT NULL,
+        can_pay_with_card BOOLEAN NOT NULL,
+        version INTEGER NOT NULL DEFAULT '1',
+        image_digest VARCHAR(32)
+    )
+"""
+
+CAFE_COLUMNS = "id, name, map_url, latitude, longitude, img_url, country, city, location, description, seats, " \
+               "coffee_price, rating, has_toilet, has_wifi, has_sockets, can_take_calls, can_pay_with_card, version, " \
+               "image_digest"
+
+CAFE_INDEXES = [
+    "CREATE INDEX ix_cafe_rating_id ON cafe (rating, id)",
+    "CREATE INDEX ix_cafe_country_city ON cafe (country, city)",
+    "CREATE INDEX ix_cafe_city_rating_id ON cafe (city, rating, id)",
+]
+
+
+# the table is copied, dropping the old one drops its indexes and the search and spatial triggers, which are made again
+@migration(9, "never reuse the id of a deleted cafe")
+def create_cafe_autoincrement(connection):
+    if connection.dialect.name != "sqlite":
+        return
+    sql = connection.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'cafe'").scalar()
+    if "AUTOINCREMENT" in sql.upper():
+        return
+    connection.execute(CAFE_AUTOINCREMENT_TABLE)
+    connection.execute(f"INSERT INTO cafe_autoincrement ({CAFE_COLUMNS}) SELECT {CAFE_COLUMNS} FROM cafe")
+    connection.execute("DROP TABLE cafe")
+    connection.execute("ALTER TABLE cafe_autoincrement RENAME TO cafe")
+    for statement in CAFE_INDEXES:
+        connection.execute(statement)
+    create_search_index(connection)
+    create_spatial_index(connection)
+
+
+# create the indexes of the models that are missing from the database, optionally only the named ones
+def create_missing_indexes(connection, metadata, names=None):
+    inspector = inspect(connection)
+    for table in metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing and (names is None or index.name in names):
+                index.create(bind=connection)
+
+
+def current_version(engine):
+    with engine.connect() as connection:
+        if not engine.dialect.has_table(connection, schema_version.name):
+            return 0
+        return connection.execute(select([schema_version.c.version])).scalar() or 0
+
+
+# run the migrations newer than the database, returns the (version, description) of every step that ran
+def upgrade(engine, target=None):
+    schema_version.create(bind=engine, checkfirst=True)
+    applied = []
+    for version, description, function in sorted(MIGRATIONS, key=lambda step: step[0]):
+        if target is not None and version > target:
+            break
+        with engine.begin() as connection:
+            if (connection.execute(select([schema_version.c.version])).scalar() or 0) >= version:
+                continue
+            function(connection)
+            connection.execute(schema_version.delete())
+            connection.execute(schema_version.insert().values(version=version))
+        applied.append((version, description))
+    return applied
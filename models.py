@@ -0,0 +1,145 @@
+from datetime import datetime
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy.orm import relationship
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from admin_tables import AdminTable
+from mail_queue import PENDING
+from extensions import db
+
+# ------------------------------------------------- SET THE DATABASE MODELS --------------------------------------- #
+
+
+# set the cafe database model
+class Cafe(db.Model):
+    __tablename__ = "cafe"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(250), unique=True, nullable=False)
+    map_url = db.Column(db.String(500), nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    img_url = db.Column(db.String(500), nullable=False)
+    country = db.Column(db.String(250), nullable=False)
+    city = db.Column(db.String(250), nullable=False)
+    location = db.Column(db.String(250), nullable=False)
+    description = db.Column(db.String(250), nullable=False)
+    seats = db.Column(db.Integer, nullable=False)
+    coffee_price = db.Column(db.Float, nullable=False)
+    rating = db.Column(db.Integer, nullable=False)
+    has_toilet = db.Column(db.Boolean, nullable=False)
+    has_wifi = db.Column(db.Boolean, nullable=False)
+    has_sockets = db.Column(db.Boolean, nullable=False)
+    can_take_calls = db.Column(db.Boolean, nullable=False)
+    can_pay_with_card = db.Column(db.Boolean, nullable=False)
+    # row version, increased by every update, the rendered fragments of the cafe are cached under it
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    # hash of the image at img_url, its thumbnails are served locally, None until they are made
+    image_digest = db.Column(db.String(32))
+    comments = relationship("Comment", back_populates="parent_cafe")
+    # the listing is ordered by (rating, id), this index serves every page of it
+    # (country, city) covers the grouped query behind the city facets, (city, rating, id) the listing of one city
+    __table_args__ = (db.Index("ix_cafe_rating_id", "rating", "id"),
+                      db.Index("ix_cafe_country_city", "country", "city"),
+                      db.Index("ix_cafe_city_rating_id", "city", "rating", "id"),
+                      # the id of a deleted cafe is never given to a new one, see migration 9
+                      {"sqlite_autoincrement": True})
+    __mapper_args__ = {"version_id_col": version}
+
+
+# set the suggest cafe database model
+class Suggest(db.Model):
+    __tablename__ = "suggest"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(250), nullable=False)
+    map_url = db.Column(db.String(500), nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    img_url = db.Column(db.String(500), nullable=False)
+    country = db.Column(db.String(250), nullable=False)
+    city = db.Column(db.String(250), nullable=False)
+    location = db.Column(db.String(250), nullable=False)
+    description = db.Column(db.String(250), nullable=False)
+    seats = db.Column(db.Integer, nullable=False)
+    coffee_price = db.Column(db.Float, nullable=False)
+    rating = db.Column(db.Integer, nullable=False)
+    has_toilet = db.Column(db.Boolean, nullable=False)
+    has_wifi = db.Column(db.Boolean, nullable=False)
+    has_sockets = db.Column(db.Boolean, nullable=False)
+    can_take_calls = db.Column(db.Boolean, nullable=False)
+    can_pay_with_card = db.Column(db.Boolean, nullable=False)
+    # suggestions are matched against the cafe names when they are approved
+    __table_args__ = (db.Index("ix_suggest_name", "name"),)
+
+
+# set the user database model
+class User(UserMixin, db.Model):
+    __tablename__ = "users"
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(100), nullable=False, unique=True)
+    nickname = db.Column(db.String(100), nullable=False, unique=True)
+    password = db.Column(db.String(255), nullable=False)
+    comments = relationship("Comment", back_populates="comment_author")
+
+    # set token for reset user password
+    def get_token(self, expires_sec=300):
+        serial = Serializer(current_app.config['SECRET_KEY'], expires_in=expires_sec)
+        return serial.dumps({"user_id": self.id}).decode("utf-8")
+
+    # verify token for sercure reset password
+    @staticmethod
+    def verify_token(token):
+        serial = Serializer(current_app.config['SECRET_KEY'])
+        try:
+            user_id = serial.loads(token)["user_id"]
+        except:
+            return None
+        return User.query.get(user_id)
+
+
+# set the comment database model
+class Comment(db.Model):
+    __tablename__ = "comments"
+    id = db.Column(db.Integer, primary_key=True)
+    cafe_id = db.Column(db.Integer, db.ForeignKey("cafe.id"))
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    parent_cafe = relationship("Cafe", back_populates="comments")
+    comment_author = relationship("User", back_populates="comments")
+    text = db.Column(db.Text, nullable=False)
+    date = db.Column(db.Text, nullable=False)
+    # the comment thread of a cafe is read page by page in id order, the comments of a user are deleted with them
+    __table_args__ = (db.Index("ix_comments_cafe_id_id", "cafe_id", "id"),
+                      db.Index("ix_comments_author_id", "author_id"))
+
+
+# set the catalogue model, a single row whose version is bumped by every cafe change
+# the listing pages are validated against it without touching the cafe table
+class Catalogue(db.Model):
+    __tablename__ = "catalogue"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+# set the outbox model, mails wait here until a dispatcher worker sends them
+class OutboxMail(db.Model):
+    __tablename__ = "outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(100), nullable=False)
+    subject = db.Column(db.String(250), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    claim = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    __table_args__ = (db.Index("ix_outbox_status_next_attempt_at", "status", "next_attempt_at"),
+                      db.Index("ix_outbox_claim", "claim"))
+
+
+# the admin tables, sorted and searched by columns with an index (email and nickname are unique)
+user_table = AdminTable(columns=[User.id, User.email, User.nickname], sortable=["id", "email", "nickname"],
+                        searchable=["email", "nickname"])
+suggestion_table = AdminTable(columns=[Suggest.id, Suggest.country, Suggest.city, Suggest.name, Suggest.location],
+                              sortable=["id", "name"], searchable=["name"])
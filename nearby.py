@@ -0,0 +1,107 @@
+import heapq
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# "cafes near me" over an R*Tree side table of cafe coordinates (a btree index on other databases)
+# the index narrows the catalogue down to a bounding box, the exact distances are only computed for those candidates
+
+EARTH_RADIUS_KM = 6371.0088
+# the box and the distances use the same sphere, a larger km per degree would cut off the edge of the circle
+KM_PER_DEGREE = math.radians(EARTH_RADIUS_KM)
+
+SPATIAL_TABLE = "CREATE VIRTUAL TABLE cafe_rtree USING rtree(id, min_lat, max_lat, min_lng, max_lng)"
+
+SPATIAL_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS cafe_rtree_insert AFTER INSERT ON cafe BEGIN
+        INSERT INTO cafe_rtree VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cafe_rtree_delete AFTER DELETE ON cafe BEGIN
+        DELETE FROM cafe_rtree WHERE id = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cafe_rtree_update AFTER UPDATE OF latitude, longitude ON cafe BEGIN
+        UPDATE cafe_rtree SET min_lat = new.latitude, max_lat = new.latitude,
+                              min_lng = new.longitude, max_lng = new.longitude
+        WHERE id = new.id;
+    END""",
+]
+
+COORDINATE_INDEX = "CREATE INDEX IF NOT EXISTS ix_cafe_latitude_longitude ON cafe (latitude, longitude)"
+
+COORDINATE_QUERY = """
+    SELECT id, latitude, longitude FROM cafe
+    WHERE latitude BETWEEN :min_lat AND :max_lat AND longitude BETWEEN :min_lng AND :max_lng
+"""
+
+CANDIDATE_QUERY = """
+    SELECT cafe.id, cafe.latitude, cafe.longitude FROM cafe_rtree JOIN cafe ON cafe.id = cafe_rtree.id
+    WHERE cafe_rtree.max_lat >= :min_lat AND cafe_rtree.min_lat <= :max_lat
+      AND cafe_rtree.max_lng >= :min_lng AND cafe_rtree.min_lng <= :max_lng
+"""
+
+
+# create the spatial index and its triggers on the connection, index the cafes that are already there
+def create_spatial_index(connection):
+    if connection.dialect.name != "sqlite":
+        connection.execute(COORDINATE_INDEX)
+        return True
+    exists = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cafe_rtree'").first()
+    if exists is None:
+        connection.execute(SPATIAL_TABLE)
+        connection.execute("INSERT INTO cafe_rtree SELECT id, latitude, latitude, longitude, longitude FROM cafe")
+    for statement in SPATIAL_TRIGGERS:
+        connection.execute(statement)
+    return True
+
+
+# the boxes (min_lat, max_lat, min_lng, max_lng) that contain every point within radius_km
+# a box crossing the antimeridian is split in two
+def bounding_boxes(lat, lng, radius_km):
+    delta_lat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = max(lat - delta_lat, -90.0), min(lat + delta_lat, 90.0)
+    cos_lat = min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat)))
+    if cos_lat <= 1e-9 or radius_km / (KM_PER_DEGREE * cos_lat) >= 180.0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+    delta_lng = radius_km / (KM_PER_DEGREE * cos_lat)
+    min_lng, max_lng = lng - delta_lng, lng + delta_lng
+    if min_lng < -180.0:
+        return [(min_lat, max_lat, min_lng + 360.0, 180.0), (min_lat, max_lat, -180.0, max_lng)]
+    if max_lng > 180.0:
+        return [(min_lat, max_lat, min_lng, 180.0), (min_lat, max_lat, -180.0, max_lng - 360.0)]
+    return [(min_lat, max_lat, min_lng, max_lng)]
+
+
+# great circle distances in km from one point to many, vectorised when numpy is installed
+def haversine(lat, lng, latitudes, longitudes):
+    if numpy is not None:
+        lat1, lng1 = numpy.radians(lat), numpy.radians(lng)
+        lat2, lng2 = numpy.radians(numpy.asarray(latitudes, dtype=float)), numpy.radians(
+            numpy.asarray(longitudes, dtype=float))
+        a = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lng2 - lng1) / 2) ** 2
+        return (2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))).tolist()
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    cos_lat1 = math.cos(lat1)
+    distances = []
+    for lat2, lng2 in zip(latitudes, longitudes):
+        lat2, lng2 = math.radians(lat2), math.radians(lng2)
+        a = math.sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+        distances.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0))))
+    return distances
+
+
+# the k nearest cafes within radius_km as (cafe id, distance in km) pairs, nearest first
+def nearby_cafes(connection, lat, lng, radius_km, k, dialect_name="sqlite"):
+    query = CANDIDATE_QUERY if dialect_name == "sqlite" else COORDINATE_QUERY
+    candidates = []
+    for min_lat, max_lat, min_lng, max_lng in bounding_boxes(lat, lng, radius_km):
+        candidates.extend(connection.execute(query, {"min_lat": min_lat, "max_lat": max_lat,
+                                                           "min_lng": min_lng, "max_lng": max_lng}))
+    if not candidates:
+        return []
+    ids, latitudes, longitudes = zip(*candidates)
+    distances = haversine(lat, lng, latitudes, longitudes)
+    within = [(distance, cafe_id) for cafe_id, distance in zip(ids, distances) if distance <= radius_km]
+    return [(cafe_id, distance) for distance, cafe_id in heapq.nsmallest(k, within)]
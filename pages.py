@@ -0,0 +1,324 @@
+import hashlib
+from datetime import date, timezone
+from functools import wraps
+from flask import Blueprint, current_app, render_template, url_for, request, redirect, abort, flash, jsonify, \
+    make_response, send_file
+from flask_login import current_user
+from sqlalchemy.orm import joinedload
+from pagination import keyset_page, encode_cursor, decode_cursor
+from search import search_cafes
+from nearby import nearby_cafes
+from amenities import AMENITIES
+from cafe_ingest import cafe_from_form
+from database import read_replica
+from assets import IMMUTABLE
+from thumbnails import FORMATS as THUMBNAIL_FORMATS
+from extensions import db, assets, thumbnails, facet_index, amenity_index, rating_histograms, fragment_cache
+from models import Cafe, Suggest, Comment, Catalogue
+from catalogue import rate_cafe, catalogue_validator, info_validator
+
+# the public pages of the site: the listing, the search, the filters, the cafe information page and the suggestions
+
+pages = Blueprint("pages", __name__)
+
+
+# the url of a thumbnail and the srcset of all widths of one format
+@pages.app_template_global()
+def thumbnail_url(digest, width, extension="jpg"):
+    return url_for("pages.thumbnail", digest=digest, width=width, extension=extension)
+
+
+@pages.app_template_global()
+def thumbnail_srcset(digest, extension="jpg"):
+    return ", ".join(f"{thumbnail_url(digest, width, extension)} {width}w" for width in thumbnails.widths)
+
+
+# the asset build and the release, a deploy changes the templates and the static files the pages link
+def build_version():
+    return f"{assets.version}|{current_app.config['RELEASE']}"
+
+
+# render a cafe card for the listing, from the fragment cache when this version was rendered before
+# the fragment store outlives a deploy, the build is part of the version so new templates render new fragments
+@pages.app_template_global()
+def cafe_card(cafe):
+    return fragment_cache.get_or_render("card", cafe.id, f"{cafe.version}|{build_version()}",
+                                        lambda: render_template("cafe_card.html", cafe=cafe))
+
+
+# render the amenity block of the information page, from the fragment cache when possible
+@pages.app_template_global()
+def cafe_amenities(cafe):
+    return fragment_cache.get_or_render("amenities", cafe.id, f"{cafe.version}|{build_version()}",
+                                        lambda: render_template("cafe_amenities.html", this_cafe=cafe))
+
+
+# answer conditional GET requests with 304 before the route queries the database or renders anything
+# validator gets the route arguments and returns (version, last modified) of the page, or None to skip
+def conditional(validator):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != "GET":
+                return f(*args, **kwargs)
+            validated = validator(*args, **kwargs)
+            if validated is None:
+                return f(*args, **kwargs)
+            version, last_modified = validated
+            # the header shows different links to every user, so the user is part of the tag, and the pages link
+            # the fingerprinted static files, so a new asset build or release makes new tags
+            etag = hashlib.sha1(f"{version}|{current_user.get_id()}|{build_version()}".encode("utf-8")).hexdigest()
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+            # only the tag decides, If-Modified-Since says nothing about the user and has whole seconds only, two
+            # changes within one second would look the same
+            fresh = bool(request.if_none_match) and request.if_none_match.contains(etag)
+            response = make_response("", 304) if fresh else make_response(f(*args, **kwargs))
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # browsers and proxies have to revalidate, personalised pages must not be shared
+            response.headers["Cache-Control"] = "private, no-cache" if current_user.is_authenticated else "no-cache"
+            response.vary.add("Cookie")
+            return response
+
+        return decorated_function
+
+    return decorator
+
+
+# read an optional number from the query string
+def number_argument(name, convert):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return convert(value)
+    except ValueError:
+        return abort(400)
+
+
+# get one page of cafes ordered by rating, optionally only from one city
+def cafe_page(city=None, cursor=None):
+    query = Cafe.query
+    if city is not None:
+        query = query.filter_by(city=city)
+    return keyset_page(query, [(Cafe.rating, True), (Cafe.id, True)], cursor=cursor,
+                       per_page=current_app.config['CAFES_PER_PAGE'])
+
+
+# set the home page route
+@pages.route("/")
+@read_replica
+@conditional(catalogue_validator)
+def home():
+    # render index.html and the first page of cafes, the next pages are loaded on scroll
+    page = cafe_page(cursor=request.args.get("cursor"))
+    next_url = url_for("pages.home", cursor=page.next_cursor) if page.next_cursor else None
+    more_url = url_for("pages.cafe_chunk", cursor=page.next_cursor) if page.next_cursor else None
+    histogram = rating_histograms.get(Catalogue.query.get(1).version)
+    return render_template('index.html', year=current_user, current_user=current_user, all_cafes=page.items,
+                           next_url=next_url, more_url=more_url, histogram=histogram)
+
+
+# set the filter route
+@pages.route("/sorted/<string:id>")
+@read_replica
+@conditional(catalogue_validator)
+def sorted_cafe(id):
+    # filter cafes by city
+    page = cafe_page(city=id, cursor=request.args.get("cursor"))
+    next_url = url_for("pages.sorted_cafe", id=id, cursor=page.next_cursor) if page.next_cursor else None
+    more_url = url_for("pages.cafe_chunk", city=id, cursor=page.next_cursor) if page.next_cursor else None
+    histogram = rating_histograms.get(Catalogue.query.get(1).version, city=id)
+    return render_template('index.html', current_user=current_user, all_cafes=page.items, year=current_user,
+                           next_url=next_url, more_url=more_url, histogram=histogram)
+
+
+# get one page of a cafe's comments, newest first, with the authors loaded in the same query
+def comment_thread(cafe_id, cursor=None):
+    query = Comment.query.options(joinedload(Comment.comment_author)).filter_by(cafe_id=cafe_id)
+    return keyset_page(query, [(Comment.id, True)], cursor=cursor, per_page=current_app.config['COMMENTS_PER_PAGE'])
+
+
+# infinite scroll route, return the next chunk of cafe cards as json
+@pages.route("/cafes.json")
+@read_replica
+def cafe_chunk():
+    city = request.args.get("city")
+    page = cafe_page(city=city, cursor=request.args.get("cursor"))
+    more_url = url_for("pages.cafe_chunk", city=city, cursor=page.next_cursor) if page.next_cursor else None
+    return jsonify(html=render_template('cafe_cards.html', all_cafes=page.items), next=more_url)
+
+
+# set the search route, rank cafes by name, description, location, city and their reviews
+@pages.route("/search")
+@read_replica
+def search():
+    query = request.args.get("q", "").strip()
+    ids = search_cafes(db.session, query, limit=current_app.config['SEARCH_RESULTS'],
+                       dialect_name=db.engine.dialect.name)
+    found = {cafe.id: cafe for cafe in Cafe.query.filter(Cafe.id.in_(ids))} if ids else {}
+    results = [found[cafe_id] for cafe_id in ids if cafe_id in found]
+    return render_template('search.html', query=query, all_cafes=results, current_user=current_user,
+                           year=current_user)
+
+
+# read the nearby search arguments, None when no position was given
+def nearby_arguments():
+    if not request.args.get("lat") or not request.args.get("lng"):
+        return None
+    config = current_app.config
+    try:
+        lat = float(request.args["lat"])
+        lng = float(request.args["lng"])
+        radius = float(request.args.get("radius", config['NEARBY_RADIUS']))
+        k = int(request.args.get("k", config['NEARBY_RESULTS']))
+    except ValueError:
+        return abort(400)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180 and radius > 0 and k > 0):
+        return abort(400)
+    return lat, lng, min(radius, config['NEARBY_MAX_RADIUS']), min(k, config['NEARBY_MAX_RESULTS'])
+
+
+# the nearest cafes as (cafe, distance in km) pairs, nearest first
+def nearby_results(lat, lng, radius, k):
+    nearest = nearby_cafes(db.session, lat, lng, radius, k, dialect_name=db.engine.dialect.name)
+    found = {cafe.id: cafe for cafe in Cafe.query.filter(Cafe.id.in_([cafe_id for cafe_id, _ in nearest]))} \
+        if nearest else {}
+    return [(found[cafe_id], distance) for cafe_id, distance in nearest if cafe_id in found]
+
+
+# set the nearby cafes route, the browser fills in the position
+@pages.route("/nearby")
+@read_replica
+def nearby():
+    arguments = nearby_arguments()
+    results = nearby_results(*arguments) if arguments else []
+    return render_template('nearby.html', searched=arguments is not None, results=results,
+                           radius=arguments[2] if arguments else current_app.config['NEARBY_RADIUS'],
+                           current_user=current_user, year=current_user)
+
+
+# nearby cafes as json
+@pages.route("/nearby.json")
+@read_replica
+def nearby_json():
+    arguments = nearby_arguments()
+    if arguments is None:
+        return abort(400)
+    return jsonify(cafes=[{
+        "id": cafe.id,
+        "name": cafe.name,
+        "location": cafe.location,
+        "city": cafe.city,
+        "latitude": cafe.latitude,
+        "longitude": cafe.longitude,
+        "rating": cafe.rating,
+        "distance_km": round(distance, 3),
+        "url": url_for("pages.info", id=cafe.id),
+    } for cafe, distance in nearby_results(*arguments)])
+
+
+# set the amenity filter route, e.g. wifi and sockets in Berlin under 3 with at least 10 seats, max_price is exclusive
+@pages.route("/filter")
+@read_replica
+def filter_cafes():
+    amenity_index.sync(Catalogue.query.get(1).version)
+    amenities = [name for name in AMENITIES if request.args.get(name)]
+    city = request.args.get("city") or None
+    min_seats = number_argument("min_seats", int)
+    max_price = number_argument("max_price", float)
+    bits = amenity_index.match(amenities=amenities, city=city, min_seats=min_seats, max_price=max_price)
+    counts = amenity_index.counts(amenities=amenities, city=city, min_seats=min_seats, max_price=max_price)
+    cursor = request.args.get("cursor")
+    keys, last = amenity_index.page(bits, after=decode_cursor(cursor, 2), limit=current_app.config['CAFES_PER_PAGE'])
+    ids = [cafe_id for _, cafe_id in keys]
+    found = {cafe.id: cafe for cafe in Cafe.query.filter(Cafe.id.in_(ids))} if ids else {}
+    results = [found[cafe_id] for cafe_id in ids if cafe_id in found]
+    next_url = None
+    if last is not None:
+        arguments = request.args.to_dict()
+        arguments["cursor"] = encode_cursor(last)
+        next_url = url_for("pages.filter_cafes", **arguments)
+    return render_template('filter.html', all_cafes=results, counts=counts, amenities=amenities, city=city,
+                           min_seats=min_seats, max_price=max_price, next_url=next_url,
+                           current_user=current_user, year=current_user)
+
+
+# set the city filter route
+@pages.route("/cities", methods=["POST", "GET"])
+@read_replica
+@conditional(catalogue_validator)
+def cities():
+    # show all countries, and the cities of the selected country, from the facet index
+    facet_index.sync(Catalogue.query.get(1).version)
+    country_list = facet_index.countries()
+    city_list = []
+    if request.method == "POST":
+        country = request.form.get("gender")
+        city_list = facet_index.cities(country)
+        return render_template('cities.html', country_list=country_list, city_list=city_list,
+                               current_user=current_user, year=current_user)
+
+    return render_template('cities.html', country_list=country_list, city_list=city_list,
+                           current_user=current_user, year=current_user)
+
+
+# set the suggest cafe route
+@pages.route("/suggest", methods=["POST", "GET"])
+def suggest():
+    # add new cafe suggestion, get all data from the form
+    if request.method == "POST":
+        try:
+            new_coffee = Suggest(**cafe_from_form(request.form, rate_cafe))
+        except ValueError as error:
+            flash(f"Please check the form, {error}")
+            return render_template("suggest.html", current_user=current_user, year=current_user)
+        db.session.add(new_coffee)
+        db.session.commit()
+        return redirect(url_for("pages.home"))
+    return render_template("suggest.html", current_user=current_user, year=current_user)
+
+
+# the local thumbnails of the cafe images, the name is the hash of the image so it can be cached forever
+@pages.route("/thumbnails/<string:digest>-<int:width>.<string:extension>")
+def thumbnail(digest, width, extension):
+    if not thumbnails.valid(digest, width, extension):
+        abort(404)
+    path = thumbnails.file(digest, width, extension)
+    if path is None:
+        # an evicted thumbnail is made again in the background, the original image is shown until then
+        source = thumbnails.source(digest)
+        if source is None or not source.lower().startswith(("http://", "https://")):
+            abort(404)
+        thumbnails.restore_later(digest)
+        response = redirect(source)
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    response = send_file(path, mimetype=THUMBNAIL_FORMATS[extension][1], conditional=True)
+    response.headers["Cache-Control"] = IMMUTABLE
+    return response
+
+
+# view cafe information
+@pages.route("/info/<string:id>", methods=["POST", "GET"])
+@read_replica
+@conditional(info_validator)
+def info(id):
+    # find the cafe by id, and show details, comments
+    this_cafe = Cafe.query.get(id)
+    if request.method == "POST":
+        new_comment = Comment(
+            cafe_id=this_cafe.id,
+            author_id=current_user.id,
+            text=request.form.get("message"),
+            date=date.today().strftime("%B %d, %Y")
+        )
+        db.session.add(new_comment)
+        db.session.commit()
+    thread = comment_thread(this_cafe.id, cursor=request.args.get("comments"))
+    more_comments_url = url_for("pages.info", id=this_cafe.id, comments=thread.next_cursor) \
+        if thread.next_cursor else None
+    return render_template("info.html", this_cafe=this_cafe, comments=thread.items,
+                           more_comments_url=more_comments_url, current_user=current_user, year=current_user)
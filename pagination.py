@@ -0,0 +1,80 @@
+import base64
+import json
+import numbers
+from collections import namedtuple
+from sqlalchemy import and_, or_
+
+# one page of a keyset query, next_cursor is None on the last page
+Page = namedtuple("Page", ["items", "next_cursor"])
+
+
+# encode the sort key of the last row into an opaque, url safe cursor
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+# a cursor value of the expected python type, a number for numeric columns, any string or number when unknown
+def cursor_value(value, expected):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return False
+    if expected is None:
+        return True
+    if issubclass(expected, numbers.Number):
+        return isinstance(value, (int, float))
+    return isinstance(value, expected)
+
+
+# the python type of a sort column, None when the column type does not tell
+def column_type(column):
+    try:
+        return column.type.python_type
+    except (AttributeError, NotImplementedError):
+        return None
+
+
+# decode a cursor, a broken or foreign cursor simply starts from the first page
+# types are the expected python types of the values, lists, objects, booleans and nulls are never accepted
+def decode_cursor(cursor, length, types=None):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw.decode("utf-8"))
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    if not all(cursor_value(value, expected) for value, expected in zip(values, types or [None] * length)):
+        return None
+    return values
+
+
+# build the "comes after this row" condition for the given sort order
+# order is a list of (column, descending) pairs, the last column has to be unique (e.g. the primary key)
+def after_condition(order, values):
+    clauses = []
+    for position, (column, descending) in enumerate(order):
+        equal = [prior == value for (prior, _), value in zip(order[:position], values)]
+        step = column < values[position] if descending else column > values[position]
+        clauses.append(and_(*equal, step))
+    return or_(*clauses)
+
+
+# fetch one page of the query, seeking past the cursor instead of using OFFSET
+def keyset_page(query, order, cursor=None, per_page=24, key=None):
+    values = decode_cursor(cursor, len(order), [column_type(column) for column, _ in order])
+    if values is not None:
+        query = query.filter(after_condition(order, values))
+    query = query.order_by(*[column.desc() if descending else column.asc() for column, descending in order])
+    rows = query.limit(per_page + 1).all()
+    if len(rows) <= per_page:
+        return Page(rows, None)
+    rows = rows[:per_page]
+    # read the sort key of the last row, by default from the attributes named like the order columns
+    last = rows[-1]
+    if key is None:
+        last_values = [getattr(last, column.key) for column, _ in order]
+    else:
+        last_values = key(last)
+    return Page(rows, encode_cursor(last_values))
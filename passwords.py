@@ -0,0 +1,131 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from werkzeug.security import check_password_hash
+
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+# password hashing off the request threads
+# hashes are computed on a bounded process pool, so a burst of logins uses the configured cores and never the GIL of
+# the threads serving pages, stored hashes record their parameters and are upgraded on the next successful login
+
+SALT_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+# scrypt hashes use the "scrypt:n:r:p$salt$hex" format of newer werkzeug versions
+def scrypt_hash(password, salt, n, r, p):
+    key = hashlib.scrypt(password.encode("utf-8"), salt=salt.encode("utf-8"), n=n, r=r, p=p,
+                         maxmem=132 * n * r * p, dklen=64)
+    return key.hex()
+
+
+def make_hash(method, params, password):
+    if method == "argon2":
+        if argon2 is None:
+            raise RuntimeError("argon2 hashing needs the argon2-cffi package")
+        return argon2.PasswordHasher(**params).hash(password)
+    if method == "scrypt":
+        salt = "".join(secrets.choice(SALT_CHARS) for _ in range(params["salt_length"]))
+        n, r, p = params["n"], params["r"], params["p"]
+        return f"scrypt:{n}:{r}:{p}${salt}${scrypt_hash(password, salt, n, r, p)}"
+    raise ValueError(f"unknown password hash method {method}")
+
+
+def check_hash(stored, password):
+    if stored.startswith("$argon2"):
+        if argon2 is None:
+            return False
+        try:
+            return argon2.PasswordHasher().verify(stored, password)
+        except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHash):
+            return False
+    if stored.startswith("scrypt:"):
+        try:
+            method, salt, expected = stored.split("$", 2)
+            _, n, r, p = method.split(":")
+            actual = scrypt_hash(password, salt, int(n), int(r), int(p))
+        except ValueError:
+            return False
+        return hmac.compare_digest(actual, expected)
+    # pbkdf2 and older werkzeug hashes
+    return check_password_hash(stored, password)
+
+
+class PasswordHasher:
+    # method is "scrypt" or "argon2", workers=0 hashes on the calling thread
+    def __init__(self, method="scrypt", scrypt_n=2 ** 15, scrypt_r=8, scrypt_p=1, salt_length=16,
+                 argon2_time_cost=3, argon2_memory_cost=65536, argon2_parallelism=1, workers=1, max_pending=None,
+                 timeout=30):
+        self.method = method
+        if method == "argon2":
+            self.params = {"time_cost": argon2_time_cost, "memory_cost": argon2_memory_cost,
+                           "parallelism": argon2_parallelism}
+        else:
+            self.params = {"n": scrypt_n, "r": scrypt_r, "p": scrypt_p, "salt_length": salt_length}
+        self.workers = workers
+        self.timeout = timeout
+        # requests waiting for a worker beyond this are turned away instead of piling up
+        self._pending = threading.BoundedSemaphore(max_pending or max(workers, 1) * 8)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def _executor(self):
+        with self._lock:
+            # a forked worker can not use the pool of its parent
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        # turned away at once, a request waiting here would hold its serving thread
+        if not self._pending.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            future = self._executor().submit(function, *args)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                future.cancel()
+                raise PasswordHasherBusy()
+        finally:
+            self._pending.release()
+
+    def hash(self, password):
+        return self._run(make_hash, self.method, self.params, password)
+
+    def verify(self, stored, password):
+        return self._run(check_hash, stored, password)
+
+    # true when the stored hash was made with another method or weaker parameters than the configured ones
+    def needs_rehash(self, stored):
+        if self.method == "argon2":
+            if not stored.startswith("$argon2") or argon2 is None:
+                return True
+            return argon2.PasswordHasher(**self.params).check_needs_rehash(stored)
+        if not stored.startswith("scrypt:"):
+            return True
+        try:
+            _, n, r, p = stored.split("$", 1)[0].split(":")
+        except ValueError:
+            return True
+        return (int(n), int(r), int(p)) != (self.params["n"], self.params["r"], self.params["p"])
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown(wait=False)
+            self._pool = None
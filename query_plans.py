@@ -0,0 +1,44 @@
+import re
+from contextlib import contextmanager
+from sqlalchemy import event
+
+# query plan check, records the statements a piece of code runs and asks the database how it would execute them
+# a plan that reads a whole table instead of an index means a missing index (or a query that can not use one)
+
+# "SCAN cafe" and "SCAN TABLE cafe" in older sqlite versions, index scans, virtual tables and subqueries are fine
+SQLITE_FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+POSTGRESQL_FULL_SCAN = re.compile(r"Seq Scan on (\w+)")
+
+
+# collect the (statement, parameters) of every select run on the engine inside the block
+@contextmanager
+def recorded_statements(engine):
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")) and (statement, parameters) not in statements:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+# the tables the statement would read from start to end
+def full_scans(engine, statement, parameters):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if engine.dialect.name == "postgresql":
+            # on a small database a sequential scan is always cheapest, only report the ones no index can replace
+            cursor.execute("SET enable_seqscan = off")
+            cursor.execute("EXPLAIN " + statement, parameters)
+            tables = [match.group(1) for row in cursor.fetchall() for match in POSTGRESQL_FULL_SCAN.finditer(row[0])]
+            connection.rollback()
+            return tables
+        cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        return [match.group(1) for row in cursor.fetchall() for match in [SQLITE_FULL_SCAN.match(row[-1])] if match]
+    finally:
+        connection.close()
@@ -0,0 +1,58 @@
+from sqlalchemy import case, cast, Integer, select, func, and_
+
+# configurable cafe rating model
+# seats are scored by the first threshold they reach, every amenity adds its weight
+
+DEFAULT_RATING_MODEL = {
+    "seats": [(30, 3), (10, 2), (0, 1)],
+    "has_wifi": 2,
+    "has_toilet": 2,
+    "has_sockets": 1,
+    "can_take_calls": 1,
+    "can_pay_with_card": 1,
+}
+
+AMENITY_WEIGHTS = ("has_wifi", "has_toilet", "has_sockets", "can_take_calls", "can_pay_with_card")
+
+
+# score one cafe
+def score(model, seats, **amenities):
+    rating = 0
+    for threshold, points in model["seats"]:
+        if seats >= threshold:
+            rating += points
+            break
+    for name in AMENITY_WEIGHTS:
+        if amenities.get(name):
+            rating += model[name]
+    return rating
+
+
+# the same score as a column expression, so a whole table is scored by the database in one statement
+def score_expression(model, table):
+    seats = case([(table.c.seats >= threshold, points) for threshold, points in model["seats"]], else_=0)
+    rating = seats
+    for name in AMENITY_WEIGHTS:
+        rating = rating + cast(table.c[name], Integer) * model[name]
+    return rating
+
+
+# rescore every row of the table, one id range per transaction so the write lock is never held for long
+# only rows whose rating changes are written, bump_version also increases their row version
+# returns the number of changed rows
+def recompute_ratings(engine, table, model, chunk_size=50000, bump_version=False):
+    expression = score_expression(model, table)
+    changed = 0
+    with engine.connect() as connection:
+        low, high = connection.execute(select([func.min(table.c.id), func.max(table.c.id)])).first()
+    if low is None:
+        return 0
+    for start in range(low, high + 1, chunk_size):
+        values = {"rating": expression}
+        if bump_version:
+            values["version"] = table.c.version + 1
+        statement = table.update().where(and_(table.c.id >= start, table.c.id < start + chunk_size,
+                                              table.c.rating != expression)).values(**values)
+        with engine.begin() as connection:
+            changed += connection.execute(statement).rowcount
+    return changed
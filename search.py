@@ -0,0 +1,118 @@
+import re
+
+# full text search over cafes and their comments
+# on sqlite two external content FTS5 tables index the existing rows, triggers keep them in sync with every insert,
+# update and delete, whichever code path commits it, on postgresql GIN expression indexes serve the same search
+
+SEARCH_TABLES = [
+    "CREATE VIRTUAL TABLE cafe_fts USING fts5(name, description, location, city, "
+    "content='cafe', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE comment_fts USING fts5(text, "
+    "content='comments', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+]
+
+SEARCH_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS cafe_fts_insert AFTER INSERT ON cafe BEGIN
+        INSERT INTO cafe_fts(rowid, name, description, location, city)
+        VALUES (new.id, new.name, new.description, new.location, new.city);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cafe_fts_delete AFTER DELETE ON cafe BEGIN
+        INSERT INTO cafe_fts(cafe_fts, rowid, name, description, location, city)
+        VALUES ('delete', old.id, old.name, old.description, old.location, old.city);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cafe_fts_update AFTER UPDATE OF name, description, location, city ON cafe BEGIN
+        INSERT INTO cafe_fts(cafe_fts, rowid, name, description, location, city)
+        VALUES ('delete', old.id, old.name, old.description, old.location, old.city);
+        INSERT INTO cafe_fts(rowid, name, description, location, city)
+        VALUES (new.id, new.name, new.description, new.location, new.city);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_fts_insert AFTER INSERT ON comments BEGIN
+        INSERT INTO comment_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_fts_delete AFTER DELETE ON comments BEGIN
+        INSERT INTO comment_fts(comment_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_fts_update AFTER UPDATE OF text ON comments BEGIN
+        INSERT INTO comment_fts(comment_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO comment_fts(rowid, text) VALUES (new.id, new.text);
+    END""",
+]
+
+# bm25 weights of the cafe columns (name, description, location, city), comment matches count half
+SEARCH_QUERY = """
+    SELECT cafe_id FROM (
+        SELECT rowid AS cafe_id, bm25(cafe_fts, 10.0, 2.0, 4.0, 4.0) AS score
+        FROM cafe_fts WHERE cafe_fts MATCH :match
+        UNION ALL
+        SELECT comments.cafe_id AS cafe_id, bm25(comment_fts) * 0.5 AS score
+        FROM comment_fts JOIN comments ON comments.id = comment_fts.rowid
+        WHERE comment_fts MATCH :match
+    )
+    GROUP BY cafe_id
+    ORDER BY SUM(score)
+    LIMIT :limit
+"""
+
+
+CAFE_DOCUMENT = "to_tsvector('simple', name || ' ' || description || ' ' || location || ' ' || city)"
+COMMENT_DOCUMENT = "to_tsvector('simple', text)"
+
+POSTGRESQL_SEARCH_INDEXES = [
+    f"CREATE INDEX IF NOT EXISTS ix_cafe_search ON cafe USING gin ({CAFE_DOCUMENT})",
+    f"CREATE INDEX IF NOT EXISTS ix_comments_search ON comments USING gin ({COMMENT_DOCUMENT})",
+]
+
+POSTGRESQL_SEARCH_QUERY = f"""
+    SELECT cafe_id FROM (
+        SELECT id AS cafe_id, ts_rank({CAFE_DOCUMENT}, query) AS score
+        FROM cafe, to_tsquery('simple', :match) AS query WHERE {CAFE_DOCUMENT} @@ query
+        UNION ALL
+        SELECT cafe_id, ts_rank({COMMENT_DOCUMENT}, query) * 0.5 AS score
+        FROM comments, to_tsquery('simple', :match) AS query WHERE {COMMENT_DOCUMENT} @@ query
+    ) AS matches
+    GROUP BY cafe_id
+    ORDER BY SUM(score) DESC
+    LIMIT :limit
+"""
+
+
+# create the search tables and triggers on the connection, index the rows that are already there
+def create_search_index(connection):
+    if connection.dialect.name == "postgresql":
+        for statement in POSTGRESQL_SEARCH_INDEXES:
+            connection.execute(statement)
+        return True
+    if connection.dialect.name != "sqlite":
+        return False
+    existing = {row[0] for row in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('cafe_fts', 'comment_fts')")}
+    for statement in SEARCH_TABLES:
+        table = statement.split()[3]
+        if table not in existing:
+            connection.execute(statement)
+            connection.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+    for statement in SEARCH_TRIGGERS:
+        connection.execute(statement)
+    return True
+
+
+# turn free user input into a safe FTS5 (or tsquery) query, every word has to match, the last one may be a prefix
+def match_expression(text, dialect_name="sqlite"):
+    words = re.findall(r"\w+", text or "", re.UNICODE)
+    if not words:
+        return None
+    if dialect_name == "postgresql":
+        return " & ".join(words) + ":*"
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+# ids of the best matching cafes, best first
+def search_cafes(connection, text, limit=50, dialect_name="sqlite"):
+    match = match_expression(text, dialect_name)
+    if match is None:
+        return []
+    query = POSTGRESQL_SEARCH_QUERY if dialect_name == "postgresql" else SEARCH_QUERY
+    rows = connection.execute(query, {"match": match, "limit": limit})
+    return [row[0] for row in rows]
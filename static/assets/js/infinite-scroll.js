@@ -0,0 +1,34 @@
+/*Infinite scroll for the cafe listing*/
+(function($) {
+  var loadMore = document.getElementById("load-more");
+  if (!loadMore || !("IntersectionObserver" in window)) {
+    return;
+  }
+  var $isotope = $(".isotope-box");
+  var nextUrl = loadMore.getAttribute("data-more");
+  var loading = false;
+
+  // hide the fallback link, the next chunk is fetched when the end of the list is visible
+  loadMore.querySelector("a").style.visibility = "hidden";
+
+  var observer = new IntersectionObserver(function(entries) {
+    if (!entries[0].isIntersecting || loading || !nextUrl) {
+      return;
+    }
+    loading = true;
+    $.getJSON(nextUrl, function(data) {
+      var $items = $(data.html).filter(".isotope-item");
+      $isotope.append($items).isotope("appended", $items);
+      nextUrl = data.next;
+      if (!nextUrl) {
+        observer.disconnect();
+        loadMore.parentNode.removeChild(loadMore);
+      }
+    }).always(function() {
+      loading = false;
+    });
+  }, { rootMargin: "600px" });
+
+  observer.observe(loadMore);
+})(jQuery);
+/*End Infinite scroll*/
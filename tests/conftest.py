@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import create_app  # noqa: E402
+from migrations import upgrade  # noqa: E402
+from extensions import db, thumbnails  # noqa: E402
+from models import Cafe, User, Comment  # noqa: E402
+from catalogue import rate_cafe  # noqa: E402
+from thumbnails import file_fetcher  # noqa: E402
+
+# an app on a temporary sqlite database upgraded by the migrations, with a small catalogue
+# user 1 is the admin, every cafe of CITIES has a few comments
+
+CITIES = [("Hungary", "Budapest"), ("Hungary", "Szeged"), ("Germany", "Berlin")]
+
+
+def cafe_row(number, country, city, has_wifi=True, seats=20):
+    cafe = {"name": f"Cafe {number}", "map_url": "https://maps.example.com", "img_url": "https://img.example.com/a.jpg",
+            "latitude": 47.0 + number / 100, "longitude": 19.0 + number / 100, "country": country, "city": city,
+            "location": f"{number} Main street", "description": f"espresso and cake number {number}", "seats": seats,
+            "coffee_price": 2.5, "has_toilet": True, "has_wifi": has_wifi, "has_sockets": number % 2 == 0,
+            "can_take_calls": True, "can_pay_with_card": number % 3 == 0}
+    cafe["rating"] = rate_cafe(cafe)
+    return cafe
+
+
+# the settings of a test app, everything it writes goes to tmp_path
+def app_config(tmp_path, **config):
+    return dict({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'cafes.db'}",
+        "WTF_CSRF_ENABLED": False,
+        "MAIL_QUEUE_IN_PROCESS": False,
+        "PASSWORD_HASH_WORKERS": 0,
+        "THUMBNAIL_DIR": str(tmp_path / "thumbnails"),
+        "USER_CACHE_DIR": str(tmp_path / "user_versions"),
+    }, **config)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(app_config(tmp_path))
+    with app.app_context():
+        # the images are read from tmp_path/images, the tests never go online
+        thumbnails.fetcher = file_fetcher(str(tmp_path / "images"))
+        upgrade(db.engine)
+        db.session.add(User(email="admin@example.com", nickname="admin", password="-"))
+        db.session.add(User(email="user@example.com", nickname="user", password="-"))
+        db.session.commit()
+        db.engine.execute(Cafe.__table__.insert(), [
+            cafe_row(number, *CITIES[number % len(CITIES)], has_wifi=number % 4 != 0, seats=5 + number)
+            for number in range(1, 61)])
+        db.engine.execute(Comment.__table__.insert(), [
+            {"cafe_id": cafe_id, "author_id": 2, "text": f"great latte {number}", "date": "January 1, 2024"}
+            for cafe_id in (1, 2, 3) for number in range(5)])
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.get_engine(app).dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = "1"
+    return client
@@ -0,0 +1,68 @@
+from extensions import db
+from models import User, Suggest
+from pagination import encode_cursor
+from conftest import cafe_row
+
+
+def add_users(app, count=30):
+    with app.app_context():
+        db.session.add_all(User(email=f"u{number:02d}@example.com", nickname=f"nick{(count - number):02d}",
+                                password="-") for number in range(count))
+        db.session.commit()
+
+
+def pages(client, url):
+    rows = []
+    while url:
+        body = client.get(url).get_json()
+        rows.extend(body["rows"])
+        url = body["next"]
+    return rows
+
+
+def test_every_user_once_in_the_sort_order(app, admin_client):
+    add_users(app)
+    app.config["ADMIN_ROWS_PER_PAGE"] = 7
+    rows = pages(admin_client, "/user_database.json?sort=nickname")
+    assert len(rows) == 32
+    assert len({row["id"] for row in rows}) == 32
+    assert [row["nickname"] for row in rows] == sorted(row["nickname"] for row in rows)
+    rows = pages(admin_client, "/user_database.json?sort=email&order=desc")
+    assert [row["email"] for row in rows] == sorted((row["email"] for row in rows), reverse=True)
+    assert set(rows[0]) == {"id", "email", "nickname"}
+
+
+def test_search_by_prefix(app, admin_client):
+    add_users(app)
+    app.config["ADMIN_ROWS_PER_PAGE"] = 4
+    rows = pages(admin_client, "/user_database.json?q=u1&sort=email")
+    assert [row["email"] for row in rows] == [f"u{number}@example.com" for number in range(10, 20)]
+    assert {row["nickname"] for row in pages(admin_client, "/user_database.json?q=nick0")} == \
+           {f"nick0{number}" for number in range(1, 10)}
+
+
+def test_unknown_sort_and_foreign_cursor(app, admin_client):
+    rows = admin_client.get("/user_database.json?sort=password").get_json()["rows"]
+    assert [row["id"] for row in rows] == [1, 2]
+    cursor = encode_cursor(["not", "an id"])
+    assert admin_client.get(f"/user_database.json?cursor={cursor}").get_json()["rows"] == rows
+
+
+def test_suggestion_table(app, admin_client):
+    with app.app_context():
+        db.session.add_all(Suggest(**dict(cafe_row(number, "Hungary", "Budapest"), name=f"Suggested {number:02d}"))
+                           for number in range(12))
+        db.session.commit()
+    app.config["ADMIN_ROWS_PER_PAGE"] = 5
+    rows = pages(admin_client, "/suggested.json?sort=name&order=desc")
+    assert [row["name"] for row in rows] == [f"Suggested {number:02d}" for number in range(11, -1, -1)]
+    response = admin_client.get("/suggested?sort=name")
+    assert b"Suggested 00" in response.data and b"Suggested 05" not in response.data
+    assert b"cursor=" in response.data
+
+
+def test_only_the_admin(client, app):
+    with client.session_transaction() as session:
+        session["_user_id"] = "2"
+    assert client.get("/user_database.json").status_code == 403
+    assert client.get("/suggested").status_code == 403
@@ -0,0 +1,98 @@
+import pytest
+
+import amenities
+from amenities import AmenityIndex, AMENITIES, bitmap, popcount
+from pagination import encode_cursor
+
+
+def row(cafe_id, city, rating, seats=20, price=2.5, **amenities):
+    values = {name: amenities.get(name, False) for name in AMENITIES}
+    return dict(values, id=cafe_id, country="Hungary" if city != "Berlin" else "Germany", city=city, seats=seats,
+                coffee_price=price, rating=rating)
+
+
+ROWS = [row(cafe_id, ["Budapest", "Szeged", "Berlin"][cafe_id % 3], cafe_id % 5, seats=cafe_id,
+            has_wifi=cafe_id % 2 == 0, has_toilet=cafe_id % 3 == 0) for cafe_id in range(1, 101)]
+
+
+@pytest.fixture
+def index():
+    return AmenityIndex(lambda: ROWS)
+
+
+def ids_of(bits):
+    return {cafe_id for cafe_id in range(bits.bit_length()) if bits >> cafe_id & 1}
+
+
+def test_bitmap():
+    assert bitmap([]) == 0
+    assert ids_of(bitmap([0, 7, 8, 1000])) == {0, 7, 8, 1000}
+    assert popcount(bitmap(range(0, 5000, 3))) == len(range(0, 5000, 3))
+
+
+@pytest.mark.parametrize("bit_count", [True, False])
+def test_popcount_before_python_3_10(monkeypatch, bit_count):
+    monkeypatch.setattr(amenities, "BIT_COUNT", bit_count and hasattr(int, "bit_count"))
+    assert popcount(0) == 0
+    assert popcount(bitmap([1, 64, 65, 10 ** 4])) == 4
+
+
+def test_the_price_bound_is_exclusive():
+    index = AmenityIndex(lambda: [row(1, "Budapest", 3, price=2.99), row(2, "Budapest", 3, price=3.0),
+                                  row(3, "Budapest", 3, price=3.5)])
+    assert ids_of(index.match(max_price=3)) == {1}
+    assert ids_of(index.match(min_price=3)) == {2, 3}
+    assert index.counts(max_price=3.01)["total"] == 2
+
+
+def test_match(index):
+    bits = index.match(amenities=["has_wifi", "has_toilet"], city="Budapest", min_seats=30, max_price=3)
+    assert ids_of(bits) == {r["id"] for r in ROWS if r["has_wifi"] and r["has_toilet"] and r["city"] == "Budapest"
+                            and r["seats"] >= 30}
+
+
+def test_counts_leave_the_city_facet_out(index):
+    counts = index.counts(amenities=["has_wifi"], city="Budapest")
+    with_wifi = [r for r in ROWS if r["has_wifi"]]
+    in_budapest = [r for r in with_wifi if r["city"] == "Budapest"]
+    assert counts["total"] == len(in_budapest)
+    assert counts["amenities"]["has_toilet"] == len([r for r in in_budapest if r["has_toilet"]])
+    # the other cities stay selectable with the number of cafes they would show
+    assert counts["cities"] == {city: len([r for r in with_wifi if r["city"] == city])
+                                for city in ("Budapest", "Szeged", "Berlin")}
+
+
+def test_pages_follow_rating_and_id(index):
+    bits = index.match(amenities=["has_wifi"])
+    expected = sorted(((r["rating"], r["id"]) for r in ROWS if r["has_wifi"]), reverse=True)
+    seen, after = [], None
+    while True:
+        keys, last = index.page(bits, after=after, limit=7)
+        seen.extend(keys)
+        if last is None:
+            break
+        after = list(last)
+    assert seen == expected
+
+
+@pytest.mark.parametrize("after", [[3, 10 ** 10], [3, -1], [3, "x"], [True, 5], [99, 5], [3, 5, 1], [3.5, 5]])
+def test_invalid_cursors_start_over(index, after):
+    first_page = index.page(index.match(), limit=5)
+    assert index.page(index.match(), after=after, limit=5) == first_page
+
+
+def test_add_and_remove(index):
+    index.cities()
+    index.add(row(500, "Vienna", 4, has_wifi=True))
+    assert ids_of(index.match(city="Vienna")) == {500}
+    assert index.counts(city="Vienna")["cities"]["Vienna"] == 1
+    index.remove(row(500, "Vienna", 4, has_wifi=True))
+    assert index.match(city="Vienna") == 0
+
+
+def test_filter_route(client):
+    response = client.get("/filter?has_wifi=on&city=Budapest")
+    assert response.status_code == 200
+    # every city with a wifi cafe is offered, not only the selected one
+    assert b"Szeged" in response.data and b"Berlin" in response.data
+    assert client.get(f"/filter?cursor={encode_cursor([3, 10 ** 10])}").status_code == 200
@@ -0,0 +1,107 @@
+import json
+
+from api import stream_page, selected_fields, FieldError, ResponseCache
+from catalogue import delete_cafes
+from extensions import db, api_cache
+from models import Comment
+
+import pytest
+
+
+def all_pages(client, url):
+    cafes = []
+    while url:
+        body = client.get(url).get_json()
+        cafes.extend(body["cafes"])
+        url = body["next"]
+    return cafes
+
+
+def test_the_selected_fields_only(client):
+    cafes = client.get("/api/v1/cafes?fields=city,name").get_json()["cafes"]
+    assert len(cafes) == 60
+    assert all(set(cafe) == {"name", "city"} for cafe in cafes)
+    cafe = client.get("/api/v1/cafes/7?fields=rating,has_wifi").get_json()
+    assert set(cafe) == {"rating", "has_wifi"}
+    response = client.get("/api/v1/cafes?fields=name,password")
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "unknown fields: password"}
+    assert client.get("/api/v1/cafes/999").status_code == 404
+
+
+def test_pages_in_listing_order(app, client):
+    app.config["API_MAX_PAGE_SIZE"] = 9
+    cafes = all_pages(client, "/api/v1/cafes?fields=id,rating&city=Szeged&limit=1000")
+    assert len(cafes) == 20
+    assert [(cafe["rating"], cafe["id"]) for cafe in cafes] == \
+           sorted(((cafe["rating"], cafe["id"]) for cafe in cafes), reverse=True)
+    first = client.get("/api/v1/cafes?fields=id&limit=1000").get_json()
+    assert len(first["cafes"]) == 9 and "limit=1000" in first["next"]
+
+
+def test_list_etag_follows_the_catalogue(app, client):
+    response = client.get("/api/v1/cafes?fields=name")
+    assert response.is_streamed
+    assert len(response.get_json()["cafes"]) == 60
+    etag = response.headers["ETag"]
+    assert client.get("/api/v1/cafes?fields=name", headers={"If-None-Match": etag}).status_code == 304
+    # another field selection is another tag
+    assert client.get("/api/v1/cafes?fields=city").headers["ETag"] != etag
+    with app.test_request_context():
+        delete_cafes([4])
+    response = client.get("/api/v1/cafes?fields=name", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.get_json()["cafes"]) == 59
+
+
+def test_finished_bodies_are_served_from_the_cache(app, client):
+    body = client.get("/api/v1/cafes?fields=name").data
+    with app.app_context():
+        assert len(api_cache._bodies) == 1
+        key, = api_cache._bodies
+        api_cache.set(key, b'{"cafes":[],"next":null}')
+    assert client.get("/api/v1/cafes?fields=name").get_json() == {"cafes": [], "next": None}
+    with app.test_request_context():
+        delete_cafes([4])
+        assert len(api_cache._bodies) == 0
+    assert client.get("/api/v1/cafes?fields=name").data != body
+
+
+def test_cafe_etag_follows_the_row(client, admin_client):
+    etag = client.get("/api/v1/cafes/3").headers["ETag"]
+    assert client.get("/api/v1/cafes/3", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/api/v1/cafes/4", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_comments_newest_first_with_the_author(app, client):
+    comments = client.get("/api/v1/cafes/1/comments?limit=2").get_json()
+    assert [comment["text"] for comment in comments["comments"]] == ["great latte 4", "great latte 3"]
+    assert comments["comments"][0]["author"] == "user"
+    etag = client.get("/api/v1/cafes/1/comments").headers["ETag"]
+    with app.app_context():
+        db.session.add(Comment(cafe_id=1, author_id=1, text="new one", date="January 2, 2024"))
+        db.session.commit()
+    response = client.get("/api/v1/cafes/1/comments", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["comments"][0] == {"id": response.get_json()["comments"][0]["id"], "text": "new one",
+                                                  "date": "January 2, 2024", "author": "admin"}
+    assert client.get("/api/v1/cafes/999/comments").status_code == 404
+
+
+def test_stream_page_chunks_make_one_document():
+    rows = [type("Row", (), {"id": number, "name": f"Cafe {number}"})() for number in range(5)]
+    chunks = list(stream_page("cafes", rows, ["id", "name"], "/next", chunk_rows=2))
+    assert len(chunks) == 5
+    assert json.loads(b"".join(chunks)) == {"cafes": [{"id": number, "name": f"Cafe {number}"} for number in range(5)],
+                                            "next": "/next"}
+    assert json.loads(b"".join(stream_page("cafes", [], ["id"], None))) == {"cafes": [], "next": None}
+
+
+def test_field_selection_and_body_limit():
+    assert selected_fields(" name , id ", ("id", "name", "city")) == ["id", "name"]
+    assert selected_fields(None, ("id", "name")) == ["id", "name"]
+    with pytest.raises(FieldError):
+        selected_fields("id,secret", ("id",))
+    cache = ResponseCache(max_body_bytes=4)
+    assert list(cache.recording("big", [b"123", b"45"])) == [b"123", b"45"]
+    assert cache.get("big") is None
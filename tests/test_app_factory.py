@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+
+from flask import Flask
+
+import database
+from commands import COMMANDS
+from main import create_app
+from extensions import db
+from models import Cafe
+from conftest import app_config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_main_makes_no_app_and_no_engine(tmp_path):
+    script = ("import main, extensions, flask\n"
+              "assert not [value for value in vars(main).values() if isinstance(value, flask.Flask)]\n"
+              "assert extensions.db.app is None\n")
+    subprocess.run([sys.executable, "-c", script], cwd=str(tmp_path), check=True,
+                   env=dict(os.environ, PYTHONPATH=ROOT))
+    # no database file, no instance folder, nothing was connected to
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_create_app_registers_everything(tmp_path):
+    app = create_app(app_config(tmp_path))
+    assert isinstance(app, Flask)
+    assert {"pages", "api", "admin", "accounts"} <= set(app.blueprints)
+    assert {command.name for command in COMMANDS} <= set(app.cli.commands)
+    assert "metrics_endpoint" in app.view_functions
+    # every app has its own services
+    assert create_app(app_config(tmp_path)).extensions["cafe"] is not app.extensions["cafe"]
+
+
+def test_preload_closes_the_connections_before_the_fork(app, tmp_path):
+    preloaded = create_app(app_config(tmp_path, PRELOAD=True))
+    # the templates are compiled in the master
+    assert "cafe_card.html" in {key[1] for key in preloaded.jinja_env.cache.keys()}
+    with preloaded.app_context():
+        engine = db.engine
+    assert engine.pool.checkedin() == 0
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # the worker
+        status = 1
+        try:
+            with preloaded.app_context():
+                count = Cafe.query.count()
+                db.session.remove()
+            os.write(write, f"{count} {len(database.inherited_connections)}".encode("ascii"))
+            status = 0
+        finally:
+            os._exit(status)
+    os.close(write)
+    _, status = os.waitpid(pid, 0)
+    answer = os.read(read, 100).decode("ascii")
+    os.close(read)
+    assert status == 0
+    # a fresh connection, none inherited from the master
+    assert answer == "60 0"
@@ -0,0 +1,133 @@
+import gzip
+import json
+import os
+
+import pytest
+from flask import Flask, url_for
+
+from assets import Assets, IMMUTABLE, minify_css
+
+RULES = "".join(f".rule-{number} {{ color: red; margin: 0 auto; }}\n" for number in range(50))
+
+
+def write(folder, filename, data):
+    path = folder / filename
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data if isinstance(data, bytes) else data.encode("utf-8"))
+
+
+@pytest.fixture
+def site(tmp_path):
+    static = tmp_path / "static"
+    write(static, "img/logo.png", b"\x89PNG not really")
+    write(static, "css/base.css", RULES)
+    write(static, "css/page.css", '@import "base.css";\n'
+                                  ".logo { background: url('../img/logo.png?v=1#top'); }\n"
+                                  ".dot { background: url(data:image/png;base64,AAAA); }\n"
+                                  "/* dropped */ /*! kept licence */\n" + RULES)
+    write(static, "js/first.js", "var first = 1")
+    write(static, "js/second.js", "var second = 2;\n//# sourceMappingURL=second.js.map\n")
+    write(static, "js/second.js.map", "{}")
+    app = Flask(__name__, static_folder=str(static))
+    site_assets = Assets(app, {"bundles/site.css": ["css/base.css", "css/page.css"],
+                               "bundles/site.js": ["js/first.js", "js/second.js"]})
+    site_assets.build()
+    return app, site_assets, static
+
+
+def built(static, name):
+    return (static / name).read_text(encoding="utf-8")
+
+
+def test_minify_css_keeps_strings_and_licences():
+    css = '.a  {\n  content: "/* not a comment */" ;\n}\n/* gone */ /*! licence */ .b > .c { color: red; }'
+    assert minify_css(css) == '.a{content:"/* not a comment */"} /*! licence */ .b>.c{color:red}'
+    assert minify_css("a::after { content: '  two  spaces ' }") == "a::after{content:'  two  spaces '}"
+
+
+def test_urls_point_at_the_fingerprinted_files(site):
+    app, site_assets, static = site
+    logo = site_assets.files["img/logo.png"]
+    assert logo.startswith("dist/img/logo.") and logo.endswith(".png")
+    page = built(static, site_assets.files["css/page.css"])
+    # the built css is in dist/css and the built image in dist/img, the query and the fragment stay
+    assert f'url("../img/{os.path.basename(logo)}?v=1#top")' in page
+    assert "url(data:image/png;base64,AAAA)" in page
+    assert "dropped" not in page and "/*! kept licence */" in page
+    assert f'@import "{os.path.basename(site_assets.files["css/base.css"])}"' in page
+    assert "second.js.map" not in site_assets.files
+    with app.test_request_context():
+        assert url_for("static", filename="img/logo.png") == f"/static/{logo}"
+        assert site_assets.asset_bundle("bundles/site.css") == [f"/static/{site_assets.files['bundles/site.css']}"]
+
+
+def test_bundles_hoist_imports_and_separate_scripts(site):
+    app, site_assets, static = site
+    css = built(static, site_assets.files["bundles/site.css"])
+    # an @import only counts at the top, the one of the second file comes before the rules of the first
+    assert css.startswith('@import "../css/base.')
+    assert css.count("@import") == 1
+    assert css.index(".rule-0") < css.index(".logo")
+    assert "url(\"../img/logo." in css
+    js = built(static, site_assets.files["bundles/site.js"])
+    assert js.startswith("var first = 1\n;\n")
+    assert "sourceMappingURL" not in js
+    manifest = json.loads(built(static, "dist/manifest.json"))
+    assert manifest["bundles"] == {name: site_assets.files[name] for name in ("bundles/site.css", "bundles/site.js")}
+
+
+def test_a_new_build_changes_the_version(site):
+    app, site_assets, static = site
+    version = site_assets.version
+    assert version
+    write(static, "css/base.css", RULES + ".new { color: blue; }")
+    site_assets.build()
+    assert site_assets.version != version
+
+
+def test_the_precompressed_variant_the_browser_accepts(site):
+    app, site_assets, static = site
+    client = app.test_client()
+    url = f"/static/{site_assets.files['bundles/site.css']}"
+    plain = client.get(url)
+    assert plain.headers["Cache-Control"] == IMMUTABLE
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["Vary"] == "Accept-Encoding"
+    assert plain.mimetype == "text/css"
+    compressed = client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["Vary"] == "Accept-Encoding"
+    assert compressed.headers["Cache-Control"] == IMMUTABLE
+    assert gzip.decompress(compressed.data) == plain.data
+    # images are not compressed again and have no variant to choose from
+    image = client.get(f"/static/{site_assets.files['img/logo.png']}", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in image.headers and "Vary" not in image.headers
+    assert image.headers["Cache-Control"] == IMMUTABLE
+    plain.close(), compressed.close(), image.close()
+
+
+def test_brotli_comes_first(site):
+    brotli = pytest.importorskip("brotli")
+    app, site_assets, static = site
+    response = app.test_client().get(f"/static/{site_assets.files['bundles/site.css']}",
+                                     headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert brotli.decompress(response.data) == (static / site_assets.files["bundles/site.css"]).read_bytes()
+    response.close()
+
+
+def test_the_sources_are_served_without_the_long_cache(site):
+    app, site_assets, static = site
+    response = app.test_client().get("/static/css/base.css")
+    assert response.status_code == 200
+    assert response.headers.get("Cache-Control") != IMMUTABLE
+    response.close()
+
+
+def test_without_a_build_the_sources_are_linked(tmp_path):
+    write(tmp_path / "static", "css/base.css", RULES)
+    app = Flask(__name__, static_folder=str(tmp_path / "static"))
+    site_assets = Assets(app, {"bundles/site.css": ["css/base.css"]})
+    assert site_assets.version == ""
+    with app.test_request_context():
+        assert site_assets.asset_bundle("bundles/site.css") == ["/static/css/base.css"]
@@ -0,0 +1,92 @@
+import pytest
+
+from cafe_ingest import cafe_from_form
+from catalogue import rate_cafe, cafe_snapshot
+from extensions import db
+from models import Cafe, Suggest, Catalogue
+from conftest import cafe_row
+
+
+def form(name, **values):
+    fields = {"name": name, "map_url": "https://maps.example.com", "latitude": "47.5", "longitude": "19.05",
+              "img_url": "https://img.example.com/b.jpg", "country": "Hungary", "city": "Budapest",
+              "location": "1 Side street", "description": "flat white", "seats": "12", "coffee_price": "2.8",
+              "has_wifi": "on", "has_toilet": "on"}
+    fields.update(values)
+    return {key: value for key, value in fields.items() if value is not None}
+
+
+def suggest(app, *names):
+    with app.app_context():
+        suggestions = [Suggest(**dict(cafe_row(100 + number, "Hungary", "Budapest", seats=35), name=name))
+                       for number, name in enumerate(names)]
+        db.session.add_all(suggestions)
+        db.session.commit()
+        return [suggestion.id for suggestion in suggestions]
+
+
+def catalogue_version(app):
+    with app.app_context():
+        return Catalogue.query.get(1).version
+
+
+def test_unchecked_boxes_are_false_and_bad_values_are_refused(app):
+    with app.app_context():
+        cafe = cafe_from_form(form("Checked"), rate_cafe)
+        assert (cafe["has_wifi"], cafe["has_sockets"], cafe["seats"]) == (True, False, 12)
+        assert cafe["rating"] == rate_cafe(cafe)
+        with pytest.raises(ValueError):
+            cafe_from_form(form("Bad", seats="many"), rate_cafe)
+        with pytest.raises(ValueError):
+            cafe_from_form(form("No city", city=""), rate_cafe)
+
+
+def test_suggest_form(app, client):
+    assert b"Please check the form" in client.post("/suggest", data=form("Bad", latitude="north")).data
+    assert client.post("/suggest", data=form("Suggested")).status_code == 302
+    with app.app_context():
+        assert [suggestion.name for suggestion in Suggest.query.all()] == ["Suggested"]
+
+
+def test_bulk_approval_publishes_the_selected_suggestions(app, admin_client):
+    ids = suggest(app, "New one", "New two", "Cafe 1", "Not selected")
+    version = catalogue_version(app)
+    response = admin_client.post("/approve_suggested", data={"ids": [str(id) for id in ids[:3]] + ["x"]},
+                                 follow_redirects=True)
+    assert b"2 cafes published" in response.data
+    assert b"1 suggestions were not published" in response.data
+    with app.app_context():
+        published = {cafe.name: cafe for cafe in Cafe.query.filter(Cafe.name.in_(["New one", "New two"]))}
+        assert set(published) == {"New one", "New two"}
+        # rated by the database with the current model
+        assert all(cafe.rating == rate_cafe(cafe_snapshot(cafe)) for cafe in published.values())
+        # the taken name and the unselected one stay suggestions
+        assert sorted(suggestion.name for suggestion in Suggest.query.all()) == ["Cafe 1", "Not selected"]
+    assert catalogue_version(app) == version + 1
+    # the listing shows the new cafes at once
+    assert b"New one" in admin_client.get("/sorted/Budapest").data
+
+
+def test_suggestions_with_the_same_name_become_one_cafe(app, admin_client):
+    ids = suggest(app, "Twin", "Twin")
+    admin_client.post("/approve_suggested", data={"ids": [str(id) for id in ids]})
+    with app.app_context():
+        assert Cafe.query.filter_by(name="Twin").count() == 1
+        assert Suggest.query.count() == 0
+
+
+def test_nothing_selected_changes_nothing(app, admin_client):
+    version = catalogue_version(app)
+    assert b"0 cafes published" in admin_client.post("/approve_suggested", follow_redirects=True).data
+    assert catalogue_version(app) == version
+
+
+def test_edit_suggested_publishes_the_corrected_cafe(app, admin_client):
+    suggestion_id, = suggest(app, "Typo")
+    response = admin_client.post(f"/edit/{suggestion_id}", data=form("Corrected"))
+    assert response.status_code == 302
+    with app.app_context():
+        assert Cafe.query.filter_by(name="Corrected").one().seats == 12
+        assert Suggest.query.count() == 0
+    suggestion_id, = suggest(app, "Cafe 2")
+    assert b"This cafe already exist" in admin_client.post(f"/edit/{suggestion_id}", data=form("Cafe 2")).data
@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+
+import pytest
+
+from catalogue_io import read_rows, import_rows, export_rows, write_rows, clean_row
+from catalogue import rate_cafe, export_columns, delete_cafes
+from extensions import db
+from models import Cafe
+
+
+def exported(app, file_format):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["export-cafes", "--format", file_format])
+    assert result.exit_code == 0
+    return result.output
+
+
+def without_ids(text, file_format):
+    rows = list(read_rows(io.StringIO(text), file_format))
+    for row in rows:
+        row.pop("id")
+    return sorted(rows, key=lambda row: row["name"])
+
+
+@pytest.mark.parametrize("file_format", ["csv", "ndjson"])
+def test_round_trip(app, tmp_path, file_format):
+    text = exported(app, file_format)
+    path = tmp_path / f"cafes.{file_format}"
+    path.write_text(text, encoding="utf-8")
+    runner = app.test_cli_runner()
+    # every cafe is there already
+    result = runner.invoke(args=["import-cafes", str(path), "--format", file_format, "--batch-size", "7"])
+    assert "0 cafes imported, 60 duplicates skipped, 0 invalid rows" in result.output
+    with app.test_request_context():
+        delete_cafes(list(range(1, 61)))
+    result = runner.invoke(args=["import-cafes", str(path), "--format", file_format, "--batch-size", "7"])
+    assert "60 cafes imported, 0 duplicates skipped, 0 invalid rows" in result.output
+    assert without_ids(exported(app, file_format), file_format) == without_ids(text, file_format)
+
+
+def test_invalid_rows_are_reported_and_the_rest_imported(app):
+    good = {"name": "Imported", "map_url": "https://maps.example.com", "latitude": "47.5", "longitude": "19.05",
+            "img_url": "https://img.example.com/b.jpg", "country": "Hungary", "city": "Budapest",
+            "location": "1 Side street", "description": "flat white", "seats": "12", "coffee_price": "2.8",
+            "has_toilet": "yes", "has_wifi": "1", "has_sockets": "", "can_take_calls": "no",
+            "can_pay_with_card": "true"}
+    rows = [good, dict(good, name=""), dict(good, name="Bad wifi", has_wifi="maybe"),
+            dict(good, name="Bad seats", seats="many"), {"name": "Only a name"}, dict(good, city="Szeged")]
+    with app.app_context():
+        inserted, skipped, errors = import_rows(db.engine, Cafe.__table__, rows, rate=rate_cafe, batch_size=2)
+        cafe = Cafe.query.filter_by(name="Imported").one()
+        assert cafe.rating == rate_cafe(clean_row(good))
+    assert (inserted, skipped) == (1, 1)
+    assert [number for number, _ in errors] == [2, 3, 4, 5]
+    assert errors[0][1] == "name is missing"
+    assert errors[1][1] == "has_wifi is not a boolean"
+    assert (cafe.city, cafe.seats, cafe.has_wifi, cafe.has_sockets, cafe.can_take_calls) == \
+           ("Budapest", 12, True, False, False)
+
+
+def test_the_errors_are_capped(app):
+    with app.app_context():
+        _, _, errors = import_rows(db.engine, Cafe.__table__, ({"name": ""} for _ in range(50)), rate=rate_cafe,
+                                   max_errors=10)
+    assert len(errors) == 10
+
+
+def test_export_reads_in_chunks(app):
+    with app.app_context():
+        columns = export_columns(Cafe.__table__)
+        rows = list(export_rows(db.engine, Cafe.__table__, columns, chunk_size=7))
+    assert [row["id"] for row in rows] == list(range(1, 61))
+    chunks = list(write_rows(rows, columns, "csv"))
+    assert len(list(csv.DictReader(io.StringIO("".join(chunks))))) == 60
+    assert "version" not in columns and "image_digest" not in columns
+
+
+def test_export_route(admin_client):
+    response = admin_client.get("/export/cafes.ndjson")
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"] == "attachment; filename=cafes.ndjson"
+    assert len([json.loads(line) for line in response.data.decode("utf-8").splitlines()]) == 60
+    assert admin_client.get("/export/users.csv").status_code == 404
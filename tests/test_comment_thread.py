@@ -0,0 +1,73 @@
+import html
+import re
+
+from sqlalchemy import event
+
+from extensions import db
+from models import Comment, User
+
+REVIEW = re.compile(r'<h5><img class="commenterImage" src="[^"]*"/>([^<]*)</h5>\s*<i>[^<]*</i>\s*<p>([^<]*)</p>')
+OLDER = re.compile(r'<a href="([^"]*)">Older reviews</a>')
+
+
+# 45 reviews of cafe 4, each by another author
+def add_reviews(app, count=45):
+    with app.app_context():
+        db.engine.execute(User.__table__.insert(), [
+            {"email": f"reviewer{number}@example.com", "nickname": f"reviewer {number}", "password": "-"}
+            for number in range(count)])
+        authors = {user.nickname: user.id for user in User.query.filter(User.nickname.like("reviewer %"))}
+        db.engine.execute(Comment.__table__.insert(), [
+            {"cafe_id": 4, "author_id": authors[f"reviewer {number}"], "text": f"review {number}",
+             "date": "January 1, 2024"} for number in range(count)])
+
+
+def statements(app, client, url):
+    executed = []
+    with app.app_context():
+        engine = db.engine
+
+    def count(*args):
+        executed.append(1)
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        page = client.get(url).get_data(as_text=True)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return len(executed), page
+
+
+def test_the_authors_come_with_the_comments(app, client):
+    add_reviews(app)
+    few, page = statements(app, client, "/info/1")
+    assert [author for author, text in REVIEW.findall(page)] == ["user"] * 5
+    many, page = statements(app, client, "/info/4")
+    # 20 authors on the page and no statement per comment
+    assert len(set(REVIEW.findall(page))) == 20
+    assert many == few
+
+
+def test_a_page_is_capped(app, client):
+    add_reviews(app)
+    app.config["COMMENTS_PER_PAGE"] = 7
+    page = client.get("/info/4").get_data(as_text=True)
+    assert len(REVIEW.findall(page)) == 7
+    assert OLDER.search(page)
+    # a short thread has no link
+    assert not OLDER.search(client.get("/info/1").get_data(as_text=True))
+
+
+def test_older_reviews_visit_every_comment_once(app, client):
+    add_reviews(app)
+    app.config["COMMENTS_PER_PAGE"] = 20
+    seen, url, pages = [], "/info/4", 0
+    while url:
+        page = client.get(url).get_data(as_text=True)
+        seen.extend(text for author, text in REVIEW.findall(page))
+        older = OLDER.search(page)
+        url = html.unescape(older.group(1)) if older else None
+        pages += 1
+    assert pages == 3
+    # newest first
+    assert seen == [f"review {number}" for number in reversed(range(45))]
@@ -0,0 +1,60 @@
+from catalogue import delete_cafes
+from extensions import assets
+
+
+def test_unchanged_page_is_not_modified(client):
+    response = client.get("/")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert "Cookie" in response.headers["Vary"]
+    cached = client.get("/", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.data == b""
+    assert "Cookie" in cached.headers["Vary"]
+
+
+def test_a_change_of_the_catalogue_makes_a_new_tag(app, client):
+    etag = client.get("/").headers["ETag"]
+    with app.test_request_context():
+        delete_cafes([5])
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_the_tag_is_per_user(client, admin_client):
+    etag = client.get("/").headers["ETag"]
+    response = admin_client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, no-cache"
+
+
+def test_the_date_alone_never_answers(client, admin_client):
+    last_modified = client.get("/").headers["Last-Modified"]
+    assert client.get("/", headers={"If-Modified-Since": last_modified}).status_code == 200
+    assert admin_client.get("/", headers={"If-Modified-Since": last_modified}).status_code == 200
+
+
+def test_information_page(client):
+    etag = client.get("/info/1").headers["ETag"]
+    assert client.get("/info/1", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/info/2", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_a_new_asset_build_makes_a_new_tag(app, client, tmp_path):
+    etag = client.get("/").headers["ETag"]
+    app.static_folder = str(tmp_path / "static")
+    (tmp_path / "static" / "dist").mkdir(parents=True)
+    (tmp_path / "static" / "dist" / "manifest.json").write_text('{"files": {}, "encodings": {}}')
+    with app.app_context():
+        assets.reload()
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert client.get("/", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_a_new_release_makes_a_new_tag(app, client):
+    etag = client.get("/info/1").headers["ETag"]
+    app.config["RELEASE"] = "next"
+    assert client.get("/info/1", headers={"If-None-Match": etag}).status_code == 200
@@ -0,0 +1,86 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from admin import delete_users
+from catalogue import delete_cafes
+from extensions import db, amenity_index
+from models import Cafe, User, Comment, Catalogue
+
+
+@contextmanager
+def deletes(engine):
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("DELETE"):
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def add_users(app, count):
+    with app.app_context():
+        users = [User(email=f"spam{number}@example.com", nickname=f"spam{number}", password="-")
+                 for number in range(count)]
+        db.session.add_all(users)
+        db.session.commit()
+        db.session.add_all(Comment(cafe_id=4, author_id=user.id, text="buy now", date="January 1, 2024")
+                           for user in users for _ in range(3))
+        db.session.commit()
+        return [user.id for user in users]
+
+
+def test_purging_users_takes_one_statement_per_table(app, admin_client):
+    ids = add_users(app, 25)
+    with app.app_context(), deletes(db.engine) as statements:
+        response = admin_client.post("/purge_users", data={"ids": [str(id) for id in ids] + ["1"]},
+                                     follow_redirects=True)
+    assert b"25 users deleted" in response.data
+    assert len(statements) == 2
+    with app.app_context():
+        # the admin stays, and so do the other users and their comments
+        assert sorted(user.id for user in User.query.all()) == [1, 2]
+        assert Comment.query.filter_by(cafe_id=4).count() == 0
+        assert Comment.query.count() == 15
+
+
+def test_the_admin_is_never_deleted(app):
+    with app.test_request_context():
+        assert delete_users([1]) == 0
+        assert User.query.get(1) is not None
+
+
+def test_deleting_cafes_takes_one_statement_per_table(app, client):
+    client.get("/filter")
+    with app.test_request_context():
+        version = Catalogue.query.get(1).version
+        with deletes(db.engine) as statements:
+            assert delete_cafes([1, 2, 3, 999]) == 3
+        assert len(statements) == 2
+        assert Cafe.query.filter(Cafe.id.in_([1, 2, 3])).count() == 0
+        assert Comment.query.count() == 0
+        assert Catalogue.query.get(1).version == version + 1
+        # the in-memory indexes followed the delete without a reload
+        assert amenity_index.counts()["total"] == 57
+    assert b"Cafe 3<" not in client.get("/sorted/Budapest").data
+
+
+def test_deleting_unknown_cafes_changes_nothing(app):
+    with app.test_request_context():
+        version = Catalogue.query.get(1).version
+        assert delete_cafes([]) == 0
+        assert delete_cafes([999]) == 0
+        assert Catalogue.query.get(1).version == version
+
+
+def test_delete_route(app, admin_client):
+    assert admin_client.get("/delete/5").status_code == 302
+    assert admin_client.get("/delete/not-an-id").status_code == 302
+    with app.app_context():
+        assert Cafe.query.get(5) is None
+        assert Cafe.query.count() == 59
@@ -0,0 +1,57 @@
+from facets import FacetIndex
+from catalogue import delete_cafes
+
+
+def test_cities_of_a_country(client):
+    response = client.get("/cities")
+    assert response.status_code == 200
+    assert b"Germany" in response.data and b"Hungary" in response.data
+    response = client.post("/cities", data={"gender": "Hungary"})
+    assert b"Budapest (20)" in response.data
+    assert b"Szeged (20)" in response.data
+    assert b"Berlin" not in response.data
+
+
+def test_deleted_cafes_leave_the_counts(app, client):
+    client.get("/cities")
+    with app.test_request_context():
+        delete_cafes([3, 6])
+    response = client.post("/cities", data={"gender": "Hungary"})
+    assert b"Budapest (18)" in response.data
+
+
+def test_local_changes_are_applied_without_a_reload():
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return [("Hungary", "Budapest", 2), ("Germany", "Berlin", 1)]
+
+    index = FacetIndex(loader)
+    index.sync(1)
+    assert index.countries() == ["Germany", "Hungary"]
+    index.remove("Germany", "Berlin")
+    index.add("Hungary", "Szeged")
+    index.advance(2)
+    assert index.countries() == ["Hungary"]
+    assert index.cities("Hungary") == [("Budapest", 2), ("Szeged", 1)]
+    assert len(loads) == 1
+
+
+def test_a_change_of_another_worker_reloads():
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return [("Hungary", "Budapest", len(loads))]
+
+    index = FacetIndex(loader)
+    index.sync(1)
+    assert index.cities("Hungary") == [("Budapest", 1)]
+    index.sync(1)
+    assert index.cities("Hungary") == [("Budapest", 1)]
+    # a version skipped by the local commits means another worker committed too
+    index.advance(3)
+    assert index.cities("Hungary") == [("Budapest", 2)]
+    index.sync(5)
+    assert index.cities("Hungary") == [("Budapest", 3)]
@@ -0,0 +1,95 @@
+from fragment_cache import FragmentCache
+from main import create_app
+from pages import build_version, cafe_card
+from migrations import upgrade
+from extensions import db, fragment_cache
+from models import Cafe
+from catalogue import delete_cafes, cafe_snapshot, cafe_changed, touch_catalogue
+from conftest import app_config, cafe_row
+
+
+def test_a_fragment_is_rendered_once_per_version():
+    cache = FragmentCache(maxsize=8)
+    renders = []
+    for _ in range(3):
+        assert cache.get_or_render("card", 1, 1, lambda: renders.append(1) or "<b>one</b>") == "<b>one</b>"
+    assert len(renders) == 1
+    assert cache.get_or_render("card", 1, 2, lambda: "<b>two</b>") == "<b>two</b>"
+
+
+def test_invalidate_drops_the_fragments_of_one_cafe():
+    cache = FragmentCache(maxsize=8)
+    cache.set("card", 1, 1, "one")
+    cache.set("card", 2, 1, "two")
+    cache.invalidate(1)
+    assert cache.get("card", 1, 1) is None
+    assert cache.get("card", 2, 1) == "two"
+
+
+def test_workers_share_the_disk_store(tmp_path):
+    first = FragmentCache(maxsize=8, directory=str(tmp_path))
+    second = FragmentCache(maxsize=8, directory=str(tmp_path))
+    first.set("card", 1, 1, "<i>shared</i>")
+    assert second.get("card", 1, 1) == "<i>shared</i>"
+    first.invalidate(1)
+    second.clear()
+    assert second.get("card", 1, 1) is None
+
+
+def test_an_edited_cafe_gets_a_new_card(app, client):
+    assert b"Cafe 60" in client.get("/").data
+    with app.test_request_context():
+        cafe = Cafe.query.get(60)
+        before = cafe_snapshot(cafe)
+        cafe.name = "Renamed cafe"
+        touch_catalogue()
+        db.session.commit()
+        cafe_changed(before=before, after=cafe_snapshot(cafe))
+    page = client.get("/").data
+    assert b"Renamed cafe" in page
+    assert b"Cafe 60<" not in page
+
+
+def test_the_id_of_a_deleted_cafe_is_not_reused(app, client):
+    # the newest cafe is rendered, deleted, and a new one takes its place at the top of the listing
+    assert b"Cafe 60" in client.get("/").data
+    with app.test_request_context():
+        delete_cafes([60])
+        cafe = Cafe(**dict(cafe_row(60, "Hungary", "Budapest", seats=65), name="Newcomer"))
+        db.session.add(cafe)
+        touch_catalogue()
+        db.session.commit()
+        cafe_changed(after=cafe_snapshot(cafe))
+        assert cafe.id == 61
+    page = client.get("/").data
+    assert b"Newcomer" in page
+    assert b"Cafe 60" not in page
+
+
+def test_the_upgrade_keeps_the_cafes_searchable_and_nearby(app):
+    with app.app_context():
+        assert upgrade(db.engine) == []
+        sql = db.engine.execute("SELECT sql FROM sqlite_master WHERE name = 'cafe'").scalar()
+        assert "AUTOINCREMENT" in sql
+        db.engine.execute("UPDATE cafe SET name = 'Moved cafe', latitude = 10, longitude = 10 WHERE id = 7")
+        assert db.engine.execute("SELECT rowid FROM cafe_fts WHERE cafe_fts MATCH 'moved'").scalar() == 7
+        assert db.engine.execute("SELECT min_lat FROM cafe_rtree WHERE id = 7").scalar() == 10
+
+
+
+def test_a_new_release_renders_new_fragments(app, tmp_path):
+    # two deploys of the same database sharing one fragment directory
+    def deploy(release):
+        return create_app(app_config(tmp_path, FRAGMENT_CACHE_DIR=str(tmp_path / "fragments"), RELEASE=release))
+
+    old = deploy("1")
+    with old.test_request_context():
+        # the card as the template of the old release rendered it
+        cafe = Cafe.query.get(7)
+        fragment_cache.set("card", 7, f"{cafe.version}|{build_version()}", "<p>old card</p>")
+        assert cafe_card(cafe) == "<p>old card</p>"
+    with deploy("1").test_request_context():
+        assert cafe_card(Cafe.query.get(7)) == "<p>old card</p>"
+    with deploy("2").test_request_context():
+        card = cafe_card(Cafe.query.get(7))
+        assert "old card" not in card and "Cafe 7" in card
@@ -0,0 +1,188 @@
+import socketserver
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from sqlalchemy import select
+
+from mail_queue import MailDispatcher, SENT, FAILED, PENDING
+from main import create_app
+from migrations import upgrade
+from extensions import db, mail_dispatcher
+from models import OutboxMail
+from conftest import app_config
+
+
+class FakeConnection:
+    def __init__(self, log, fail_for=()):
+        self.log = log
+        self.fail_for = fail_for
+
+    def send(self, message):
+        if message in self.fail_for:
+            raise ValueError(f"refused {message}")
+        self.log.append(message)
+
+
+def dispatcher(log, opened, fail_for=(), **options):
+    @contextmanager
+    def connect():
+        opened.append(1)
+        yield FakeConnection(log, fail_for)
+
+    return MailDispatcher(db.engine, OutboxMail.__table__, connect=connect, build_message=lambda row: row["recipient"],
+                          context=nullcontext, rate=1000, poll_interval=0.05, **options)
+
+
+def queue(*recipients):
+    db.session.add_all(OutboxMail(recipient=recipient, subject="Hello", body="Hi") for recipient in recipients)
+    db.session.commit()
+
+
+def statuses():
+    table = OutboxMail.__table__
+    with db.engine.connect() as connection:
+        return {row["recipient"]: (row["status"], row["attempts"])
+                for row in connection.execute(select([table.c.recipient, table.c.status, table.c.attempts]))}
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_queued_mail_is_sent_over_one_connection(app):
+    with app.app_context():
+        queue("a@example.com", "b@example.com", "c@example.com")
+        log, opened = [], []
+        sender = dispatcher(log, opened, batch_size=10)
+        sender.start()
+        try:
+            wait_for(lambda: len(log) == 3)
+            wait_for(lambda: all(status == SENT for status, _ in statuses().values()))
+        finally:
+            sender.stop(timeout=5)
+        assert sorted(log) == ["a@example.com", "b@example.com", "c@example.com"]
+        assert len(opened) == 1
+
+
+def test_failed_mail_is_retried_then_given_up(app):
+    with app.app_context():
+        queue("good@example.com", "bad@example.com")
+        log, opened = [], []
+        sender = dispatcher(log, opened, fail_for={"bad@example.com"}, backoff=0, max_attempts=2)
+        sender.start()
+        try:
+            wait_for(lambda: statuses()["bad@example.com"][0] == FAILED)
+        finally:
+            sender.stop(timeout=5)
+        assert statuses() == {"good@example.com": (SENT, 0), "bad@example.com": (FAILED, 2)}
+        assert log == ["good@example.com"]
+
+
+def test_forgot_password_queues_the_mail(app, client):
+    response = client.post("/forgot", data={"email": "user@example.com"})
+    assert response.status_code == 302
+    with app.app_context():
+        mail = OutboxMail.query.one()
+        assert mail.recipient == "user@example.com" and mail.status == PENDING
+        assert "/forgot/" in mail.body
+
+
+# a local smtp server that accepts every mail, it hangs up on the first MAIL command of its first drop_connections
+# connections
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, drop_connections=0):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.drop_connections = drop_connections
+        self.connections = 0
+        # (connection number, recipients) of every accepted mail
+        self.messages = []
+        self.lock = threading.Lock()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            number = server.connections
+        self.reply("220 localhost ready")
+        recipients = []
+        for line in self.rfile:
+            command = line.decode("ascii", "replace").strip()
+            verb = command[:4].upper()
+            if verb == "MAIL" and number <= server.drop_connections:
+                return
+            if verb == "MAIL":
+                recipients = []
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip(" <>"))
+            elif verb == "DATA":
+                self.reply("354 end with a dot")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                with server.lock:
+                    server.messages.append((number, recipients))
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            self.reply("250 OK")
+
+
+@contextmanager
+def smtp_app(tmp_path, drop_connections=0):
+    server = SMTPStandIn(drop_connections)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    app = create_app(app_config(tmp_path, MAIL_SERVER="127.0.0.1", MAIL_PORT=server.server_address[1],
+                                MAIL_USE_TLS=False, MAIL_USERNAME="noreply@example.com", MAIL_PASSWORD="",
+                                MAIL_QUEUE_RATE=1000, MAIL_QUEUE_BACKOFF=0))
+    try:
+        with app.app_context():
+            upgrade(db.engine)
+            yield server
+            mail_dispatcher.stop(timeout=5)
+            db.session.remove()
+            db.get_engine(app).dispose()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_one_smtp_connection_per_batch(tmp_path):
+    with smtp_app(tmp_path) as server:
+        queue("a@example.com", "b@example.com", "c@example.com")
+        mail_dispatcher.start()
+        wait_for(lambda: all(status == SENT for status, _ in statuses().values()))
+        assert sorted(server.messages) == [(1, ["a@example.com"]), (1, ["b@example.com"]), (1, ["c@example.com"])]
+        assert server.connections == 1
+
+
+def test_a_dropped_connection_is_opened_again_for_the_retry(tmp_path):
+    with smtp_app(tmp_path, drop_connections=1) as server:
+        queue("a@example.com", "b@example.com")
+        mail_dispatcher.start()
+        wait_for(lambda: all(status == SENT for status, _ in statuses().values()))
+        # the whole batch waited for the retry and went out over the second connection
+        assert statuses() == {"a@example.com": (SENT, 1), "b@example.com": (SENT, 1)}
+        assert sorted(server.messages) == [(2, ["a@example.com"]), (2, ["b@example.com"])]
+        assert server.connections == 2
+
+
+def test_an_unreachable_server_is_retried(tmp_path):
+    with smtp_app(tmp_path) as server:
+        server.shutdown()
+        server.server_close()
+        queue("a@example.com")
+        mail_dispatcher.start()
+        wait_for(lambda: statuses()["a@example.com"][1] >= 1)
+        assert statuses()["a@example.com"][0] in (PENDING, FAILED)
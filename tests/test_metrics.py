@@ -0,0 +1,82 @@
+from sqlalchemy import event
+
+from main import create_app
+from metrics import Metrics, STATEMENTS
+from extensions import db, metrics
+from conftest import app_config
+
+
+def test_render_cumulative_buckets():
+    recorded = Metrics()
+    labels = (("endpoint", "pages.home"),)
+    for value in (0, 3, 300):
+        recorded.observe("cafe_request_sql_statements", labels, value)
+    recorded.inc("cafe_slow_queries_total", labels, 2)
+    lines = recorded.render().splitlines()
+    assert "# TYPE cafe_request_sql_statements histogram" in lines
+    buckets = [line for line in lines if line.startswith("cafe_request_sql_statements_bucket")]
+    assert len(buckets) == len(STATEMENTS) + 1
+    assert buckets[0] == 'cafe_request_sql_statements_bucket{endpoint="pages.home",le="0"} 1'
+    assert 'cafe_request_sql_statements_bucket{endpoint="pages.home",le="2"} 1' in buckets
+    assert 'cafe_request_sql_statements_bucket{endpoint="pages.home",le="3"} 2' in buckets
+    assert 'cafe_request_sql_statements_bucket{endpoint="pages.home",le="200"} 2' in buckets
+    assert buckets[-1] == 'cafe_request_sql_statements_bucket{endpoint="pages.home",le="+Inf"} 3'
+    assert 'cafe_request_sql_statements_sum{endpoint="pages.home"} 303.0' in lines
+    assert 'cafe_request_sql_statements_count{endpoint="pages.home"} 3' in lines
+    assert 'cafe_slow_queries_total{endpoint="pages.home"} 2' in lines
+    assert recorded.totals("cafe_request_sql_statements") == {labels: (3, 303.0)}
+
+
+def test_label_values_are_escaped():
+    recorded = Metrics()
+    recorded.observe("cafe_template_render_duration_seconds", (("template", 'a"b\\c\nd'),), 0.5)
+    assert 'cafe_template_render_duration_seconds_count{template="a\\"b\\\\c\\nd"} 1' in recorded.render()
+
+
+def test_the_statements_of_a_request_are_counted(app, client):
+    executed = []
+    with app.app_context():
+        engine = db.engine
+
+    def count(*args):
+        executed.append(1)
+
+    labels = (("endpoint", "api.api_comments"),)
+    before = metrics.totals("cafe_request_sql_statements").get(labels, (0, 0.0))
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        assert len(client.get("/api/v1/cafes/1/comments").get_json()["comments"]) == 5
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    after = metrics.totals("cafe_request_sql_statements")[labels]
+    assert executed
+    assert after == (before[0] + 1, before[1] + len(executed))
+    duration = metrics.totals("cafe_request_duration_seconds")
+    assert any(dict(labels)["endpoint"] == "api.api_comments" and dict(labels)["status"] == 200
+               for labels in duration)
+
+
+def test_metrics_need_the_token(app, client, tmp_path):
+    assert client.get("/metrics").status_code == 200
+    protected = create_app(app_config(tmp_path, METRICS_TOKEN="s3cret")).test_client()
+    assert protected.get("/metrics").status_code == 401
+    assert protected.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = protected.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-store"
+    assert "# TYPE cafe_request_duration_seconds histogram" in response.get_data(as_text=True)
+
+
+def test_profiles_need_the_token(app, client, tmp_path):
+    # without a PROFILE_TOKEN the header does nothing
+    assert client.get("/api/v1/cafes/1", headers={"X-Profile": "anything"}).is_json
+    profiled = create_app(app_config(tmp_path, PROFILE_TOKEN="s3cret")).test_client()
+    assert profiled.get("/api/v1/cafes/1", headers={"X-Profile": "wrong"}).is_json
+    response = profiled.get("/api/v1/cafes/1", headers={"X-Profile": "s3cret"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert response.headers["Cache-Control"] == "no-store"
+    assert "sql;dur=" in response.headers["Server-Timing"]
+    report = response.get_data(as_text=True)
+    assert report.startswith("GET /api/v1/cafes/1? -> 200 OK")
+    assert "function calls" in report
@@ -0,0 +1,83 @@
+import math
+
+import pytest
+
+import nearby
+from nearby import bounding_boxes, haversine, nearby_cafes
+from extensions import db
+from models import Cafe
+from conftest import cafe_row
+
+
+def closest(app, lat, lng, radius, k):
+    with app.app_context():
+        return nearby_cafes(db.session, lat, lng, radius, k)
+
+
+@pytest.mark.parametrize("vectorised", [True, False])
+def test_haversine(monkeypatch, vectorised):
+    if vectorised:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(nearby, "numpy", None)
+    budapest_vienna, same = haversine(47.4979, 19.0402, [48.2082, 47.4979], [16.3738, 19.0402])
+    assert budapest_vienna == pytest.approx(214.5, abs=1.0)
+    assert same == pytest.approx(0.0, abs=1e-6)
+
+
+def test_a_box_over_the_antimeridian_is_split():
+    boxes = bounding_boxes(0.0, 179.99, 5.0)
+    assert len(boxes) == 2
+    assert boxes[0][3] == 180.0 and boxes[1][2] == -180.0
+    # near the pole every longitude is within reach
+    assert bounding_boxes(89.99, 0.0, 50.0) == [(pytest.approx(89.54, abs=0.01), 90.0, -180.0, 180.0)]
+
+
+def test_the_nearest_cafes_within_the_radius(app):
+    results = closest(app, 47.10, 19.10, 2.0, 3)
+    assert [cafe_id for cafe_id, _ in results][0] == 10
+    assert sorted(cafe_id for cafe_id, _ in results[1:]) == [9, 11]
+    assert [distance for _, distance in results] == sorted(distance for _, distance in results)
+    assert all(distance <= 2.0 for _, distance in results)
+    assert closest(app, 10.0, 10.0, 50.0, 3) == []
+
+
+def test_cafes_across_the_antimeridian(app):
+    with app.app_context():
+        db.engine.execute(Cafe.__table__.insert(), [dict(cafe_row(100, "Fiji", "Taveuni"), name="Dateline cafe",
+                                                         latitude=-16.8, longitude=179.99)])
+    assert [cafe_id for cafe_id, _ in closest(app, -16.8, -179.99, 5.0, 5)] == [61]
+
+
+def test_the_index_follows_moved_and_deleted_cafes(app):
+    with app.app_context():
+        db.engine.execute("UPDATE cafe SET latitude = 10, longitude = 10 WHERE id = 20")
+    assert [cafe_id for cafe_id, _ in closest(app, 10.0, 10.0, 1.0, 5)] == [20]
+    with app.app_context():
+        db.engine.execute("DELETE FROM cafe WHERE id = 20")
+    assert closest(app, 10.0, 10.0, 1.0, 5) == []
+
+
+def test_nearby_json(client):
+    cafes = client.get("/nearby.json?lat=47.10&lng=19.10&radius=2&k=2").get_json()["cafes"]
+    assert [cafe["id"] for cafe in cafes][0] == 10
+    assert len(cafes) == 2
+    assert cafes[0]["distance_km"] <= cafes[1]["distance_km"]
+    assert client.get("/nearby.json").status_code == 400
+    assert client.get("/nearby.json?lat=100&lng=19").status_code == 400
+    assert client.get("/nearby.json?lat=north&lng=19").status_code == 400
+    assert client.get("/nearby?lat=47.10&lng=19.10").status_code == 200
+
+
+def test_cafes_at_the_edge_of_the_radius(app):
+    # 49.99 km due north of (0, 0) and 49.99 km due east along the 60th parallel
+    north = math.degrees(49.99 / nearby.EARTH_RADIUS_KM)
+    east = math.degrees(2 * math.asin(math.sin(49.99 / (2 * nearby.EARTH_RADIUS_KM)) / math.cos(math.radians(60))))
+    with app.app_context():
+        db.engine.execute(Cafe.__table__.insert(), [
+            dict(cafe_row(100, "Nowhere", "Null Island"), name="North cafe", latitude=north, longitude=0.0),
+            dict(cafe_row(101, "Nowhere", "Parallel"), name="East cafe", latitude=60.0, longitude=east)])
+    assert haversine(0.0, 0.0, [north], [0.0])[0] == pytest.approx(49.99)
+    assert haversine(60.0, 0.0, [60.0], [east])[0] == pytest.approx(49.99)
+    assert [cafe_id for cafe_id, _ in closest(app, 0.0, 0.0, 50.0, 5)] == [61]
+    assert [cafe_id for cafe_id, _ in closest(app, 60.0, 0.0, 50.0, 5)] == [62]
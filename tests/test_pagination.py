@@ -0,0 +1,57 @@
+import base64
+import json
+
+import pytest
+
+from pagination import encode_cursor, decode_cursor, keyset_page
+from models import Cafe
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def test_round_trip():
+    assert decode_cursor(encode_cursor([12, 345]), 2) == [12, 345]
+    assert decode_cursor(encode_cursor(["Berlin", 7]), 2, [str, int]) == ["Berlin", 7]
+
+
+@pytest.mark.parametrize("cursor", [None, "", "not base64!", raw_cursor({"a": 1}), raw_cursor([1]),
+                                    raw_cursor([1, 2, 3]), "e30"])
+def test_broken_cursors_start_over(cursor):
+    assert decode_cursor(cursor, 2) is None
+
+
+@pytest.mark.parametrize("values", [[{"a": 1}, 2], [[1], 2], [True, 2], [None, 2], [1, {"b": 2}]])
+def test_values_must_be_scalars(values):
+    assert decode_cursor(encode_cursor(values), 2) is None
+
+
+def test_values_must_have_the_column_type():
+    assert decode_cursor(encode_cursor(["high", 2]), 2, [int, int]) is None
+    assert decode_cursor(encode_cursor([3, 2]), 2, [str, int]) is None
+    # a float column takes integers, json does not keep 2.0 apart from 2
+    assert decode_cursor(encode_cursor([2, 5]), 2, [float, int]) == [2, 5]
+
+
+def test_keyset_pages_cover_every_row_once(app):
+    order = [(Cafe.rating, True), (Cafe.id, True)]
+    with app.app_context():
+        expected = [cafe.id for cafe in Cafe.query.order_by(Cafe.rating.desc(), Cafe.id.desc())]
+        seen, cursor = [], None
+        while True:
+            page = keyset_page(Cafe.query, order, cursor=cursor, per_page=7)
+            seen.extend(cafe.id for cafe in page.items)
+            if page.next_cursor is None:
+                break
+            cursor = page.next_cursor
+        assert seen == expected
+
+
+@pytest.mark.parametrize("values", [[{"a": 1}, 2], ["x", 2], [3, [4]], [True, 1]])
+def test_routes_ignore_foreign_cursors(admin_client, values):
+    cursor = encode_cursor(values)
+    for url in ["/", "/cafes.json", "/api/v1/cafes", "/api/v1/cafes/1/comments", "/user_database?sort=email",
+                "/suggested?sort=name"]:
+        separator = "&" if "?" in url else "?"
+        assert admin_client.get(f"{url}{separator}cursor={cursor}").status_code == 200, url
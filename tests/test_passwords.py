@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from passwords import PasswordHasher, PasswordHasherBusy
+from extensions import password_hasher
+
+FAST = {"scrypt_n": 2 ** 10}
+
+
+def test_hash_and_verify():
+    hasher = PasswordHasher(workers=0, **FAST)
+    stored = hasher.hash("secret")
+    assert stored.startswith("scrypt:1024:8:1$")
+    assert hasher.verify(stored, "secret")
+    assert not hasher.verify(stored, "wrong")
+    assert not hasher.needs_rehash(stored)
+    assert PasswordHasher(workers=0, scrypt_n=2 ** 11).needs_rehash(stored)
+
+
+def test_full_queue_is_busy_at_once():
+    hasher = PasswordHasher(workers=1, max_pending=1, **FAST)
+    try:
+        # another request holds the only slot
+        hasher._pending.acquire()
+        started = time.monotonic()
+        with pytest.raises(PasswordHasherBusy):
+            hasher.hash("secret")
+        assert time.monotonic() - started < 0.5
+        hasher._pending.release()
+        assert hasher.verify(hasher.hash("secret"), "secret")
+    finally:
+        hasher.shutdown()
+
+
+def test_slow_hash_is_busy():
+    hasher = PasswordHasher(workers=1, scrypt_n=2 ** 15, timeout=0.001)
+    try:
+        with pytest.raises(PasswordHasherBusy):
+            hasher.hash("secret")
+        # the slot is given back
+        assert hasher._pending.acquire(blocking=False)
+    finally:
+        hasher.shutdown()
+
+
+def test_busy_login_asks_to_retry(app, client, monkeypatch):
+    def busy(stored, password):
+        raise PasswordHasherBusy()
+
+    with app.app_context():
+        monkeypatch.setattr(password_hasher._get_current_object(), "verify", busy)
+    response = client.post("/login/user@example.com", data={"email": "user@example.com", "password": "long secret"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
@@ -0,0 +1,16 @@
+from commands import check_query_plans_command
+from extensions import db
+from query_plans import full_scans
+
+
+def test_no_page_reads_a_whole_table(app):
+    result = app.test_cli_runner().invoke(check_query_plans_command)
+    assert result.exit_code == 0, result.output
+    assert "full scan" not in result.output
+
+
+def test_a_full_scan_is_reported(app):
+    with app.app_context():
+        assert full_scans(db.engine, "SELECT id FROM cafe WHERE description = ?", ("espresso",)) == ["cafe"]
+        assert full_scans(db.engine, "SELECT id FROM cafe WHERE city = ? ORDER BY rating DESC, id DESC",
+                          ("Berlin",)) == []
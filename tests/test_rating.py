@@ -0,0 +1,76 @@
+from sqlalchemy import select
+
+from commands import recompute_ratings_command
+from facets import RatingHistograms
+from rating import DEFAULT_RATING_MODEL, AMENITY_WEIGHTS, score, score_expression
+from extensions import db, rating_histograms
+from models import Cafe, Catalogue
+
+MODEL = {"seats": [(50, 5), (20, 1)], "has_wifi": 3, "has_toilet": 0, "has_sockets": 2, "can_take_calls": 4,
+         "can_pay_with_card": 1}
+
+
+def catalogue_version(app):
+    with app.app_context():
+        return Catalogue.query.get(1).version
+
+
+def test_the_sql_score_matches_the_python_score(app):
+    table = Cafe.__table__
+    with app.app_context():
+        rows = db.engine.execute(select([table, score_expression(MODEL, table).label("score")])).fetchall()
+    assert len(rows) == 60
+    for row in rows:
+        assert row["score"] == score(MODEL, row["seats"], **{name: row[name] for name in AMENITY_WEIGHTS}), row["id"]
+    # every branch of the seats case is taken, below the lowest threshold included
+    assert {row["seats"] >= 50 for row in rows} == {True, False}
+    assert any(row["seats"] < 20 for row in rows)
+
+
+def test_only_changed_ratings_are_written(app):
+    before_version = catalogue_version(app)
+    with app.app_context():
+        before = {cafe.id: (cafe.rating, cafe.version) for cafe in Cafe.query}
+    # sockets are worth more, only the cafes with sockets (the even ones) change
+    app.config["RATING_MODEL"] = dict(DEFAULT_RATING_MODEL, has_sockets=3)
+    result = app.test_cli_runner().invoke(recompute_ratings_command, ["--chunk-size", "7"])
+    assert result.exit_code == 0, result.output
+    assert result.output.strip() == "30 cafes and 0 suggestions rescored"
+    with app.app_context():
+        after = {cafe.id: (cafe.rating, cafe.version) for cafe in Cafe.query}
+    for id, (rating, version) in after.items():
+        if id % 2 == 0:
+            assert (rating, version) == (before[id][0] + 2, before[id][1] + 1), id
+        else:
+            assert (rating, version) == before[id], id
+    assert catalogue_version(app) > before_version
+    # nothing left to change, the catalogue stays where it is
+    version = catalogue_version(app)
+    result = app.test_cli_runner().invoke(recompute_ratings_command)
+    assert result.output.strip() == "0 cafes and 0 suggestions rescored"
+    assert catalogue_version(app) == version
+
+
+def test_histograms_follow_the_catalogue_version():
+    loads = []
+    counts = {None: [(5, 2)], "Berlin": [(4, 1)]}
+    histograms = RatingHistograms(lambda city: loads.append(city) or counts[city])
+    assert histograms.get(1) == [(5, 2)]
+    assert histograms.get(1, city="Berlin") == [(4, 1)]
+    assert histograms.get(1) == [(5, 2)]
+    assert loads == [None, "Berlin"]
+    counts[None] = [(5, 3)]
+    assert histograms.get(2) == [(5, 3)]
+    assert loads == [None, "Berlin", None]
+
+
+def test_the_listing_histogram_follows_a_recompute(app, client):
+    with app.app_context():
+        before = rating_histograms.get(Catalogue.query.get(1).version)
+    app.config["RATING_MODEL"] = dict(DEFAULT_RATING_MODEL, has_sockets=3)
+    app.test_cli_runner().invoke(recompute_ratings_command)
+    with app.app_context():
+        after = rating_histograms.get(Catalogue.query.get(1).version)
+        expected = db.engine.execute("SELECT rating, count(*) FROM cafe GROUP BY rating").fetchall()
+    assert after != before
+    assert dict(after) == dict(expected)
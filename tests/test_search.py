@@ -0,0 +1,60 @@
+from search import search_cafes, match_expression
+from extensions import db
+from models import Cafe, Comment
+from conftest import cafe_row
+
+
+def search(app, text):
+    with app.app_context():
+        return search_cafes(db.session, text)
+
+
+def add_cafe(app, number, **values):
+    with app.app_context():
+        db.engine.execute(Cafe.__table__.insert(), [dict(cafe_row(number, "Hungary", "Budapest"), **values)])
+
+
+def test_the_name_ranks_above_the_description_and_the_reviews(app):
+    add_cafe(app, 100, name="Mokka bar")
+    add_cafe(app, 101, description="the best mokka in town")
+    with app.app_context():
+        db.engine.execute(Comment.__table__.insert(), [{"cafe_id": 5, "author_id": 2, "text": "mokka was fine",
+                                                       "date": "January 1, 2024"}])
+    assert search(app, "mokka") == [61, 62, 5]
+
+
+def test_reviews_find_their_cafe(app):
+    assert sorted(search(app, "latte")) == [1, 2, 3]
+
+
+def test_prefix_and_diacritics(app):
+    add_cafe(app, 100, name="Café Múzeum")
+    assert search(app, "cafe muz") == [61]
+    assert search(app, "múzeum") == [61]
+
+
+def test_the_triggers_follow_every_change(app):
+    add_cafe(app, 100, name="Kaffeehaus Zentral")
+    assert search(app, "kaffeehaus") == [61]
+    with app.app_context():
+        db.engine.execute("UPDATE cafe SET name = 'Zentral' WHERE id = 61")
+    assert search(app, "kaffeehaus") == []
+    assert search(app, "zentral") == [61]
+    with app.app_context():
+        db.engine.execute("DELETE FROM comments WHERE cafe_id = 1")
+        db.engine.execute("DELETE FROM cafe WHERE id = 61")
+    assert search(app, "zentral") == []
+    assert sorted(search(app, "latte")) == [2, 3]
+
+
+def test_user_input_is_never_fts_syntax(app):
+    assert match_expression('latte" OR name:*') == '"latte" "OR" "name"*'
+    assert match_expression("  -- ") is None
+    assert search(app, 'NEAR(") cafe') == []
+
+
+def test_search_page(client):
+    response = client.get("/search?q=latte")
+    assert response.status_code == 200
+    assert b"Cafe 1" in response.data
+    assert b"No cafes found" in client.get("/search?q=nothing+like+this").data
@@ -0,0 +1,139 @@
+import os
+import threading
+
+import pytest
+from flask_login import login_user
+
+from thumbnails import ThumbnailCache, file_fetcher, FORMATS
+from extensions import db, thumbnails
+from models import Cafe, User
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def save_image(directory, name="a.jpg", color="red", size=(900, 600)):
+    os.makedirs(directory, exist_ok=True)
+    Image.new("RGB", size, color).save(os.path.join(directory, name), "JPEG")
+
+
+@pytest.fixture
+def images(tmp_path):
+    directory = str(tmp_path / "images")
+    save_image(directory)
+    save_image(directory, "b.jpg", color="blue")
+    return directory
+
+
+def files(cache):
+    return sorted(name for _, _, names in os.walk(cache.directory) for name in names if not name.endswith(".url"))
+
+
+def wait_for_background(cache=None):
+    (cache or thumbnails).submit(lambda: None).result(timeout=10)
+
+
+def test_store_makes_every_width_and_format(tmp_path, images):
+    cache = ThumbnailCache(str(tmp_path / "cache"), file_fetcher(images), widths=(320, 640))
+    digest = cache.store("https://img.example.com/a.jpg")
+    assert len(files(cache)) == 2 * len(FORMATS)
+    with Image.open(cache.file(digest, 320, "jpg")) as image:
+        assert image.size == (320, 213)
+    # the same image is not rendered again, an unreadable one has no thumbnails
+    assert cache.store("https://img.example.com/a.jpg?again") == digest
+    assert cache.store("https://img.example.com/missing.jpg") is None
+    assert cache.file(digest, 999, "jpg") is None
+    assert cache.file("not-a-digest", 320, "jpg") is None
+
+
+def test_the_least_recently_served_are_evicted(tmp_path, images):
+    cache = ThumbnailCache(str(tmp_path / "cache"), file_fetcher(images), widths=(320,))
+    first = cache.store("https://img.example.com/a.jpg")
+    size = sum(os.path.getsize(cache.path(first, 320, extension)) for extension in FORMATS)
+    os.utime(cache.path(first, 320, "jpg"), (1, 1))
+    os.utime(cache.path(first, 320, "webp"), (1, 1))
+    cache.max_bytes = size * 1.5
+    second = cache.store("https://img.example.com/b.jpg")
+    assert cache.file(first, 320, "jpg") is None
+    assert cache.file(second, 320, "jpg") is not None
+
+
+def test_one_restore_per_evicted_digest(tmp_path, images):
+    cache = ThumbnailCache(str(tmp_path / "cache"), file_fetcher(images), widths=(320,))
+    digest = cache.store("https://img.example.com/a.jpg")
+    os.remove(cache.path(digest, 320, "jpg"))
+    fetched = []
+    fetch = cache.fetcher
+    cache.fetcher = lambda url: fetched.append(threading.current_thread().name) or fetch(url)
+    release = threading.Event()
+    cache.submit(release.wait, 10)
+    for _ in range(5):
+        assert cache.file(digest, 320, "jpg") is None
+        cache.restore_later(digest)
+    release.set()
+    wait_for_background(cache)
+    assert cache.file(digest, 320, "jpg") is not None
+    assert len(fetched) == 1 and fetched[0].startswith("thumbnails")
+
+
+def test_an_evicted_thumbnail_redirects_to_the_image_until_it_is_restored(app, client, images):
+    with app.app_context():
+        thumbnails.fetcher = file_fetcher(images)
+        digest = thumbnails.store("https://img.example.com/a.jpg")
+        os.remove(thumbnails.path(digest, 640, "webp"))
+    response = client.get(f"/thumbnails/{digest}-640.webp")
+    assert response.status_code == 302
+    assert response.headers["Location"] == "https://img.example.com/a.jpg"
+    assert response.headers["Cache-Control"] == "no-store"
+    with app.app_context():
+        wait_for_background()
+    response = client.get(f"/thumbnails/{digest}-640.webp")
+    assert response.status_code == 200
+    assert response.mimetype == "image/webp"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert client.get(f"/thumbnails/{'0' * 32}-640.webp").status_code == 404
+    assert client.get(f"/thumbnails/{digest}-641.webp").status_code == 404
+
+
+def add_form(name, img_url):
+    return {"name": name, "map_url": "https://maps.example.com", "latitude": "47.5", "longitude": "19.05",
+            "img_url": img_url, "country": "Hungary", "city": "Budapest", "location": "1 Side street",
+            "description": "flat white", "seats": "12", "coffee_price": "2.8"}
+
+
+def test_admin_writes_fetch_the_image_after_the_request(app, admin_client, images):
+    fetched = []
+    with app.app_context():
+        fetch = file_fetcher(images)
+        thumbnails.fetcher = lambda url: fetched.append((url, threading.current_thread())) or fetch(url)
+        release = threading.Event()
+        thumbnails.submit(release.wait, 10)
+    # the request returns while the background worker is still busy
+    assert admin_client.post("/add", data=add_form("Fresh", "https://img.example.com/a.jpg")).status_code == 302
+    # a rejected form fetches nothing
+    assert b"This cafe already exist" in admin_client.post(
+        "/add", data=add_form("Cafe 1", "https://img.example.com/b.jpg")).data
+    assert fetched == []
+    release.set()
+    with app.app_context():
+        wait_for_background()
+        cafe = Cafe.query.filter_by(name="Fresh").one()
+        assert cafe.image_digest is not None
+        # not on the request thread
+        assert fetched == [("https://img.example.com/a.jpg", fetched[0][1])]
+        assert fetched[0][1] is not threading.main_thread()
+        first_digest = cafe.image_digest
+    # a new image drops the old thumbnails in the same commit and fetches the new one later
+    with app.app_context():
+        thumbnails.submit(release.clear)
+        wait_for_background()
+        thumbnails.submit(release.wait, 10)
+    # admin.edit shares its url with admin.edit_suggested, which gets every request, so the view is called directly
+    with app.test_request_context(method="POST", data=add_form("Fresh", "https://img.example.com/b.jpg")):
+        login_user(User.query.get(1))
+        assert app.view_functions["admin.edit"](str(cafe.id)).status_code == 302
+    with app.app_context():
+        assert Cafe.query.get(cafe.id).image_digest is None
+        release.set()
+        wait_for_background()
+        db.session.remove()
+        assert Cafe.query.get(cafe.id).image_digest not in (None, first_digest)
@@ -0,0 +1,72 @@
+import time
+
+from user_cache import UserCache, CachedUser
+from accounts import load_user
+from admin import delete_users
+from extensions import user_cache
+
+
+def cache_user(cache, user_id=7):
+    cache.set(user_id, CachedUser(user_id, "a@example.com", "a"), cache.version(user_id))
+
+
+def test_a_bump_drops_the_user_at_once():
+    cache = UserCache()
+    cache_user(cache)
+    assert cache.get(7).nickname == "a"
+    cache.bump(7)
+    assert cache.get(7) is None
+
+
+def test_a_user_loaded_before_a_bump_is_not_cached_under_the_new_version():
+    cache = UserCache()
+    version = cache.version(7)
+    cache.bump(7)
+    cache.set(7, CachedUser(7, "old@example.com", "old"), version)
+    assert cache.get(7) is None
+
+
+def test_entries_expire_and_the_oldest_leave_first():
+    cache = UserCache(ttl=0.05, maxsize=2)
+    for user_id in (1, 2, 3):
+        cache_user(cache, user_id)
+    assert cache.get(1) is None and cache.get(3) is not None
+    time.sleep(0.1)
+    assert cache.get(3) is None
+
+
+def test_workers_see_a_bump_within_the_check_interval(tmp_path, monkeypatch):
+    worker = UserCache(directory=str(tmp_path), check_interval=0.1)
+    other = UserCache(directory=str(tmp_path), check_interval=0.1)
+    cache_user(worker)
+    reads = []
+    version = UserCache.version
+    monkeypatch.setattr(UserCache, "version", lambda self, user_id: reads.append(user_id) or version(self, user_id))
+    # the hits in between read no file
+    for _ in range(10):
+        assert worker.get(7) is not None
+    assert reads == []
+    other.bump(7)
+    time.sleep(0.15)
+    assert worker.get(7) is None
+    assert reads == [7]
+
+
+def test_an_unchanged_version_is_checked_again_after_the_interval(tmp_path):
+    worker = UserCache(directory=str(tmp_path), check_interval=0.05)
+    cache_user(worker)
+    time.sleep(0.1)
+    assert worker.get(7) is not None
+    UserCache(directory=str(tmp_path)).bump(7)
+    # checked just now, the change shows after the next interval
+    assert worker.get(7) is not None
+    time.sleep(0.1)
+    assert worker.get(7) is None
+
+
+def test_load_user_follows_a_deleted_user(app):
+    with app.test_request_context():
+        assert load_user("2").email == "user@example.com"
+        assert user_cache.get(2) is not None
+        delete_users([2])
+        assert load_user("2") is None
@@ -0,0 +1,276 @@
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import re
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# local thumbnails of the cafe images
+# the image of a cafe is fetched once when the cafe is added or edited, resized to a few widths as webp and jpeg and
+# kept on disk under the hash of the original image, the pages link the local files with a one year immutable cache
+# instead of the full size remote image, the cache is bounded, the least recently served files are evicted and made
+# again from the source url on the background worker when they are asked for after that
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = (320, 640, 1280)
+# extension: (pillow format, mimetype)
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpg": ("JPEG", "image/jpeg")}
+DIGEST = re.compile(r"^[0-9a-f]{32}$")
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+# bigger images are refused before they are decoded
+MAX_PIXELS = 50_000_000
+# the last use of a file is recorded at most this often
+TOUCH_INTERVAL = 3600
+
+
+class FetchError(Exception):
+    pass
+
+
+# fetchers take the url of an image and return its bytes, raising anything on failure
+def http_fetcher(timeout=10, max_bytes=MAX_IMAGE_BYTES):
+    def fetch(url):
+        if not url.lower().startswith(("http://", "https://")):
+            raise FetchError(f"not an http url: {url}")
+        request = urllib.request.Request(url, headers={"User-Agent": "cafe-review-thumbnails"})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = response.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            raise FetchError(f"image larger than {max_bytes} bytes: {url}")
+        return data
+
+    return fetch
+
+
+# the file of the directory with the last path segment of the url as name, for development and tests
+def file_fetcher(directory):
+    def fetch(url):
+        name = url.rstrip("/").rsplit("/", 1)[-1].split("?", 1)[0]
+        with open(os.path.join(directory, name), "rb") as file:
+            return file.read()
+
+    return fetch
+
+
+def image_digest(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+
+# Pillow is only imported by the first thumbnail made, starting a worker does not load it
+def pillow_installed():
+    return importlib.util.find_spec("PIL") is not None
+
+
+# the image at every width in every format, {(width, extension): bytes}, widths larger than the image keep its size
+def render_thumbnails(data, widths, quality=80):
+    from PIL import Image, ImageOps
+    image = Image.open(io.BytesIO(data))
+    if image.width * image.height > MAX_PIXELS:
+        raise FetchError(f"image of {image.width}x{image.height} pixels is too large")
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA", "P"):
+        # jpeg has no transparency, transparent parts become white
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    else:
+        image = image.convert("RGB")
+    rendered = {}
+    for width in widths:
+        resized = image.copy()
+        resized.thumbnail((width, width * 4), Image.LANCZOS)
+        for extension, (image_format, mimetype) in FORMATS.items():
+            output = io.BytesIO()
+            if image_format == "JPEG":
+                resized.save(output, image_format, quality=quality, optimize=True, progressive=True)
+            else:
+                resized.save(output, image_format, quality=quality, method=4)
+            rendered[(width, extension)] = output.getvalue()
+    return rendered
+
+
+class ThumbnailCache:
+    def __init__(self, directory, fetcher, widths=WIDTHS, max_bytes=512 * 1024 * 1024, quality=80, workers=4):
+        self.directory = directory
+        self.fetcher = fetcher
+        self.widths = tuple(widths)
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.workers = workers
+        self._evicting = threading.Lock()
+        # bytes of thumbnails as last counted plus the ones written since, None until the first count
+        self._size = None
+        self._size_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._background = None
+        self._pid = None
+        # digests whose restore is queued, many requests for one evicted image make its thumbnails once
+        self._restoring = set()
+        self.available = pillow_installed()
+
+    def path(self, digest, width, extension):
+        return os.path.join(self.directory, digest[:2], f"{digest}-{width}.{extension}")
+
+    def _source_path(self, digest):
+        return os.path.join(self.directory, digest[:2], f"{digest}.url")
+
+    # fetch the image and make its thumbnails, returns the digest or None when the image can not be used
+    def store(self, url):
+        if not self.available or not url:
+            return None
+        try:
+            data = self.fetcher(url)
+            digest = image_digest(data)
+            if not self._complete(digest):
+                self._write(digest, render_thumbnails(data, self.widths, self.quality))
+            write_file(self._source_path(digest), url.encode("utf-8"))
+        except Exception as error:
+            # any fetcher may be plugged in, a failed image only means the remote url is shown
+            logger.warning("no thumbnails for %s: %s", url, error)
+            return None
+        self.evict()
+        return digest
+
+    # run the function on the background worker of this process, e.g. to make thumbnails after the request
+    def submit(self, function, *args):
+        with self._lock:
+            # a forked worker can not use the thread of its parent
+            if self._background is None or self._pid != os.getpid():
+                self._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")
+                self._pid = os.getpid()
+            return self._background.submit(function, *args)
+
+    # {url: digest or None} for every url, fetched in parallel
+    def store_many(self, urls):
+        urls = list(dict.fromkeys(url for url in urls if url))
+        if not urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(urls))) as executor:
+            return dict(zip(urls, executor.map(self.store, urls)))
+
+    def _complete(self, digest):
+        return all(os.path.exists(self.path(digest, width, extension))
+                   for width in self.widths for extension in FORMATS)
+
+    def _write(self, digest, rendered):
+        for (width, extension), data in rendered.items():
+            write_file(self.path(digest, width, extension), data)
+        with self._size_lock:
+            if self._size is not None:
+                self._size += sum(len(data) for data in rendered.values())
+
+    def valid(self, digest, width, extension):
+        return bool(DIGEST.match(digest)) and width in self.widths and extension in FORMATS
+
+    # the file of a thumbnail, None when there is none, see restore_later for an evicted one
+    def file(self, digest, width, extension):
+        if not self.valid(digest, width, extension):
+            return None
+        path = self.path(digest, width, extension)
+        try:
+            modified = os.stat(path).st_mtime
+        except OSError:
+            return None
+        # the modification time orders the eviction, keep it near the last time the file was served
+        if time.time() - modified > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path
+
+    # the url of the original image, None when it was never stored
+    def source(self, digest):
+        if not DIGEST.match(digest):
+            return None
+        try:
+            with open(self._source_path(digest), encoding="utf-8") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    # make the thumbnails of an evicted image again on the background worker, the request that asked for one does
+    # not wait for the fetch and the resizing, and a digest is queued once however many requests ask for it
+    def restore_later(self, digest):
+        if not self.available or not DIGEST.match(digest):
+            return
+        with self._lock:
+            if digest in self._restoring:
+                return
+            self._restoring.add(digest)
+        self.submit(self._restore_queued, digest)
+
+    def _restore_queued(self, digest):
+        try:
+            if not self._complete(digest):
+                self._restore(digest)
+        finally:
+            with self._lock:
+                self._restoring.discard(digest)
+
+    def _restore(self, digest):
+        if not self.available:
+            return False
+        try:
+            url = self.source(digest)
+            if url is None:
+                raise FetchError("the source url is unknown")
+            data = self.fetcher(url)
+            # the remote image changed since, the pages link the new one once the cafe is saved again
+            if image_digest(data) != digest:
+                return False
+            self._write(digest, render_thumbnails(data, self.widths, self.quality))
+        except Exception as error:
+            logger.warning("thumbnails of %s can not be restored: %s", digest, error)
+            return False
+        self.evict()
+        return True
+
+    # remove the least recently used thumbnails until the cache is 10% under its size
+    # the directory is only walked when the running total says the cache is full, files written by other processes
+    # are counted by the next walk
+    def evict(self):
+        with self._size_lock:
+            if self._size is not None and self._size <= self.max_bytes:
+                return
+        if not self._evicting.acquire(blocking=False):
+            return
+        try:
+            files = []
+            for directory, directories, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith(tuple("." + extension for extension in FORMATS)):
+                        path = os.path.join(directory, name)
+                        try:
+                            stat = os.stat(path)
+                        except OSError:
+                            continue
+                        files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for modified, size, path in files)
+            if total > self.max_bytes:
+                for modified, size, path in sorted(files):
+                    if total <= self.max_bytes * 0.9:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    total -= size
+            with self._size_lock:
+                self._size = total
+        finally:
+            self._evicting.release()
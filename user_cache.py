@@ -0,0 +1,86 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask_login import UserMixin
+
+# identity cache for flask-login's user_loader
+# entries expire after a ttl and are dropped as soon as the user's version is bumped, the versions live in memory or,
+# with a directory, in one small file per user that every worker on the host reads instead of the database
+# a cached user reads its version file at most every check_interval seconds, so a bump in another worker is seen
+# within that time and the requests in between touch neither the database nor the disk, the worker that bumps drops
+# its own copy at once
+
+
+# the columns of a user that pages read through current_user, detached from any database session
+class CachedUser(UserMixin):
+    def __init__(self, id, email, nickname):
+        self.id = id
+        self.email = email
+        self.nickname = nickname
+
+
+class UserCache:
+    def __init__(self, ttl=300, maxsize=10000, directory=None, check_interval=1.0):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.directory = directory
+        self.check_interval = check_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    # the current version of a user, read it before loading the user from the database
+    def version(self, user_id):
+        if self.directory:
+            try:
+                with open(os.path.join(self.directory, str(user_id)), encoding="ascii") as file:
+                    return file.read()
+            except OSError:
+                return ""
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    # the user was changed or deleted, every worker drops its cached copy on the next request
+    def bump(self, user_id):
+        if self.directory:
+            handle, temporary = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(handle, "w", encoding="ascii") as file:
+                file.write(uuid.uuid4().hex)
+            os.replace(temporary, os.path.join(self.directory, str(user_id)))
+        with self._lock:
+            if not self.directory:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._entries.pop(user_id, None)
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        user, version, expires, checked = entry
+        now = time.monotonic()
+        due = not self.directory or now - checked >= self.check_interval
+        if expires < now or (due and version != self.version(user_id)):
+            with self._lock:
+                self._entries.pop(user_id, None)
+            return None
+        with self._lock:
+            if self._entries.get(user_id) is entry:
+                if due and self.directory:
+                    self._entries[user_id] = (user, version, expires, now)
+                self._entries.move_to_end(user_id)
+        return user
+
+    # cache the user under the version that was read before loading it
+    def set(self, user_id, user, version):
+        with self._lock:
+            now = time.monotonic()
+            self._entries[user_id] = (user, version, now + self.ttl, now)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)